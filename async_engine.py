@@ -0,0 +1,338 @@
+"""
+Asyncio engine: each DataManager runs as an actor behind a simulated network
+link, and the TransactionManager sends it messages instead of calling it.
+
+A message reaches a site after the latency of its link (plus or minus a
+random jitter), waits in the inbox of the site, which handles one message
+at a time, and the reply comes back after another link delay. Write-lock
+requests, writes and commits are sent to all the replicas at once with
+`asyncio.gather`, or one replica after the other with the sequential
+fan-out, to compare both. The instructions are still executed one tick
+after the other, so the results are the same as with TransactionManager.
+Aborts, failures, recoveries and dumps act on the sites directly.
+"""
+import asyncio
+import inspect
+import random
+
+from transaction_manager import InvalidInstructionError, TransactionManager
+
+FAN_OUTS = ("gather", "sequential")
+
+
+class SiteActor:
+    """A DataManager receiving messages through an inbox."""
+
+    def __init__(self, dm, latency, jitter, rand):
+        """
+        Initialize a SiteActor instance.
+        :param dm: the DataManager
+        :param latency: one-way delay of the link to the site, in seconds
+        :param jitter: maximum random deviation from the latency, in seconds
+        :param rand: the random.Random drawing the jitter
+        """
+        self.dm = dm
+        self.latency = latency
+        self.jitter = jitter
+        self.rand = rand
+        self.inbox = None  # asyncio.Queue, created by `start`
+        self.task = None
+        self.num_messages = 0
+
+    def start(self):
+        """Start handling messages, in the running event loop."""
+        self.inbox = asyncio.Queue()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        """Stop handling messages."""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def delay(self):
+        """
+        :return: the delay of one message on the link, in seconds
+        """
+        if not self.jitter:
+            return self.latency
+        return max(0.0, self.latency +
+                   self.rand.uniform(-self.jitter, self.jitter))
+
+    async def run(self):
+        """Handle the messages of the inbox one at a time."""
+        while True:
+            method_name, args, future = await self.inbox.get()
+            try:
+                result = getattr(self.dm, method_name)(*args)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    async def call(self, method_name, *args):
+        """
+        Send a message to the site and wait for the reply.
+        :param method_name: the DataManager method handling the message
+        :param args: the arguments of the method
+        :return: the result of the method
+        """
+        await asyncio.sleep(self.delay())
+        self.num_messages += 1
+        future = asyncio.get_running_loop().create_future()
+        self.inbox.put_nowait((method_name, args, future))
+        result = await future
+        await asyncio.sleep(self.delay())
+        return result
+
+
+class AsyncTransactionManager(TransactionManager):
+    """
+    TransactionManager talking to SiteActors. Use `start` before running
+    instructions with `process_line_async` or `tick_async`, and `stop`
+    afterwards, in the same event loop.
+    """
+
+    def __init__(self, latency=0.001, jitter=0.0, fan_out="gather", seed=0,
+                 **kwargs):
+        """
+        Initialize an AsyncTransactionManager instance.
+        :param latency: one-way delay of the links to the sites in seconds,
+         or dict {site_id: delay} (sites not in it have no delay)
+        :param jitter: maximum random deviation from the latency, in seconds
+        :param fan_out: "gather" sends the messages of an operation to all
+         the replicas at once, "sequential" one after the other
+        :param seed: seed of the jitter
+        :param kwargs: arguments of TransactionManager
+        """
+        if fan_out not in FAN_OUTS:
+            raise ValueError("Unknown fan-out: {}".format(fan_out))
+        self.latency = latency
+        self.jitter = jitter
+        self.fan_out = fan_out
+        self.link_random = random.Random(seed)
+        self.actors = []
+        super().__init__(**kwargs)
+
+    def reset(self, sink=None):
+        """
+        See `TransactionManager.reset`. Actors are created for the new data
+        managers; call `start` again.
+        """
+        super().reset(sink)
+        self.actors = []
+        for dm in self.data_manager_list:
+            if isinstance(self.latency, dict):
+                latency = self.latency.get(dm.site_id, 0.0)
+            else:
+                latency = self.latency
+            self.actors.append(SiteActor(dm, latency, self.jitter,
+                                         self.link_random))
+
+    def __getstate__(self):
+        raise TypeError("An AsyncTransactionManager cannot be checkpointed")
+
+    def start(self):
+        """Start the site actors, in the running event loop."""
+        for actor in self.actors:
+            actor.start()
+
+    async def stop(self):
+        """Stop the site actors."""
+        for actor in self.actors:
+            await actor.stop()
+
+    def actor_of(self, dm):
+        """
+        :param dm: a DataManager
+        :return: the SiteActor of the DataManager
+        """
+        return self.actors[dm.site_id - 1]
+
+    async def send_all(self, replicas, method_name, *args):
+        """
+        Send the same message to several sites (see `fan_out`).
+        :param replicas: the DataManagers of the sites
+        :param method_name: the DataManager method handling the message
+        :param args: the arguments of the method
+        :return: the list of results, in the order of replicas
+        """
+        if self.fan_out == "gather":
+            return await asyncio.gather(*[
+                self.actor_of(dm).call(method_name, *args)
+                for dm in replicas])
+        results = []
+        for dm in replicas:
+            results.append(await self.actor_of(dm).call(method_name, *args))
+        return results
+
+    async def process_line_async(self, line):
+        """
+        See `TransactionManager.process_line`.
+        """
+        li = self.parser.parse_line(line)
+        if li:
+            command = li.pop(0)
+            try:
+                await self.tick_async(self.process_instruction_async,
+                                      command, li)
+            except InvalidInstructionError as e:
+                self.sink.emit("invalid_instruction", e.message,
+                               line.strip())
+                return False
+        return True
+
+    async def tick_async(self, instruction, *args):
+        """
+        See `TransactionManager.tick`. The instruction may be a coroutine
+        function.
+        """
+        self.sink.emit("tick", self.ts)
+        if self.resolve_deadlock():
+            await self.execute_operation_queue_async()
+        result = instruction(*args)
+        if inspect.isawaitable(result):
+            result = await result
+        await self.execute_operation_queue_async()
+        self.finish_tick()
+        return result
+
+    async def process_instruction_async(self, command, args):
+        """
+        See `Client.instruction`. Commits go through the actors; reads and
+        writes are queued and run by the tick.
+        """
+        if command == "end":
+            await self.end_async(args[0])
+        else:
+            instruction, args = self.client.instruction(command, args)
+            instruction(*args)
+
+    async def execute_operation_queue_async(self):
+        """
+        See `TransactionManager.execute_operation_queue`.
+        """
+        self.start_operation_pass()
+        op = self.next_ready_operation()
+        while op:
+            success = False
+            if op.command == "R":
+                success = await self.read_async(op.transaction_id,
+                                                op.variable_id)
+            elif op.command == "W":
+                success = await self.write_async(
+                    op.transaction_id, op.variable_id, op.value)
+            else:
+                self.sink.emit("invalid_operation", op.op_id)
+            self.finish_operation(op, success)
+            op = self.next_ready_operation()
+
+    async def read_async(self, transaction_id, variable_id):
+        """
+        See `TransactionManager.read` and `read_snapshot`. The replicas are
+        tried one after the other.
+        """
+        t = self.transaction_table.get(transaction_id)
+        if not t:
+            raise InvalidInstructionError(
+                "Transaction {} does not exist".format(transaction_id))
+        replicas = self.get_read_replicas(t, variable_id)
+        for dm in replicas:
+            actor = self.actor_of(dm)
+            if t.is_ro:
+                result = await actor.call("read_snapshot", variable_id, t.ts)
+            else:
+                t.lock_sites.add(dm.site_id)
+                result = await actor.call("read", transaction_id,
+                                          variable_id)
+            if result.success:
+                if not t.is_ro:
+                    # the read may wait at other sites since an earlier try
+                    await self.send_all(
+                        [other_dm for other_dm in replicas
+                         if other_dm is not dm],
+                        "withdraw_read", transaction_id, variable_id)
+                self.record_read(t, dm, variable_id, result.value)
+                return True
+        return False
+
+    async def write_async(self, transaction_id, variable_id, value):
+        """
+        See `TransactionManager.write`. The W-locks are requested from all
+        the replicas, then the value is written to all of them.
+        """
+        t = self.transaction_table.get(transaction_id)
+        if not t:
+            raise InvalidInstructionError(
+                "Transaction {} does not exist".format(transaction_id))
+        replicas = self.get_live_replicas(variable_id)
+        for dm in replicas:
+            t.lock_sites.add(dm.site_id)
+        locked = await self.send_all(replicas, "get_write_lock",
+                                     transaction_id, variable_id)
+        # at least one relevant site must be up
+        if replicas and all(locked):
+            await self.send_all(replicas, "write", transaction_id,
+                                variable_id, value)
+            self.record_write(t, replicas, variable_id, value)
+            return True
+        return False
+
+    async def end_async(self, transaction_id):
+        """
+        See `TransactionManager.end`.
+        """
+        if not self.transaction_table.get(transaction_id):
+            raise InvalidInstructionError(
+                "Transaction {} does not exist".format(transaction_id))
+        if self.transaction_table[transaction_id].will_abort:
+            self.abort(transaction_id, "site failure")
+            return False
+        self.check_no_queued_locks(self.transaction_table[transaction_id])
+        await self.commit_async(transaction_id, self.ts)
+        return True
+
+    async def commit_async(self, transaction_id, commit_ts):
+        """
+        See `TransactionManager.commit`. The commit is sent to all the sites
+        where the transaction may hold locks.
+        """
+        transaction = self.transaction_table[transaction_id]
+        gc_horizon_ts = self.prepare_commit(transaction)
+        await self.send_all(
+            [self.data_manager_list[site_id - 1]
+             for site_id in sorted(transaction.lock_sites)],
+            "commit", transaction_id, commit_ts, gc_horizon_ts)
+        self.remove_transaction(transaction_id)
+        self.sink.emit("commit", transaction_id)
+
+
+async def run_lines(tm, lines):
+    """
+    Run instructions on an AsyncTransactionManager.
+    :param tm: the AsyncTransactionManager
+    :param lines: iterable of instruction lines
+    """
+    tm.start()
+    try:
+        for line in lines:
+            await tm.process_line_async(line)
+    finally:
+        await tm.stop()
+
+
+def run(tm, lines):
+    """
+    Run instructions on an AsyncTransactionManager in a new event loop.
+    :param tm: the AsyncTransactionManager
+    :param lines: iterable of instruction lines
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run_lines(tm, lines))
+    finally:
+        loop.close()
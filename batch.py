@@ -0,0 +1,214 @@
+"""
+Run many traces in parallel, one TransactionManager per worker process.
+
+Usage:
+$ python3 batch.py [--jobs N] [--expected DIR] [--output-dir DIR]
+      [--policy POLICY] [--sites N] [--variables M] [--replication-factor K]
+      [--gc-interval TICKS] trace [trace ...]
+Each trace is a file, a directory of files, or a glob pattern. Compiled
+instruction streams (see instruction_stream.py) are replayed directly.
+"""
+import argparse
+import concurrent.futures
+import difflib
+import glob
+import io
+import os
+import sys
+import time
+import traceback
+
+import event_sink
+import instruction_stream
+import topology
+import transaction_manager
+
+# TransactionManager of the current worker process, reset for each trace
+worker_tm = None
+
+
+def init_worker(policy, num_sites, num_variables, replication_factor,
+                gc_interval):
+    """
+    Create the TransactionManager of a worker process.
+    """
+    global worker_tm
+    cluster = topology.Topology(num_sites, num_variables, replication_factor)
+    worker_tm = transaction_manager.TransactionManager(
+        policy, cluster, gc_interval)
+
+
+def run_trace(file_path):
+    """
+    Run one trace on the TransactionManager of the worker process.
+    :param file_path: path of a text trace or of a compiled stream
+    :return: tuple (file_path, output, seconds, error), where error is the
+     traceback of an unexpected exception, or None
+    """
+    output = io.StringIO()
+    sink = event_sink.TextSink(output, buffer_size=4096)
+    worker_tm.reset(sink)
+    error = None
+    start = time.perf_counter()
+    try:
+        sink.emit("message", "Getting input from {}...".format(file_path))
+        with open(file_path, 'rb') as file:
+            is_compiled = file.read(len(instruction_stream.MAGIC)) == \
+                instruction_stream.MAGIC
+        if is_compiled:
+            with open(file_path, 'rb') as file:
+                instruction_stream.replay(worker_tm, file)
+        else:
+            with open(file_path, 'r') as file:
+                for line in file:
+                    worker_tm.process_line(line)
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        sink.close()
+    return file_path, output.getvalue(), time.perf_counter() - start, error
+
+
+def expand_traces(patterns):
+    """
+    :param patterns: list of files, directories and glob patterns
+    :return: sorted list of trace files, without duplicates
+    """
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files.update(os.path.join(pattern, name)
+                         for name in os.listdir(pattern))
+        else:
+            files.update(glob.glob(pattern) or [pattern])
+    return sorted(f for f in files if not os.path.isdir(f))
+
+
+def output_body(output):
+    """
+    :param output: the output of a trace
+    :return: the lines of the output without the "Getting input from" line,
+     which depends on the path the trace was run with
+    """
+    lines = output.splitlines(True)
+    if lines and lines[0].startswith("Getting input from "):
+        return lines[1:]
+    return lines
+
+
+def check_output(file_path, output, expected_dir, suffix):
+    """
+    Compare the output of a trace with its expected output file.
+    :return: None if there is no expected file, [] if the output matches,
+     or the lines of a unified diff
+    """
+    expected_path = os.path.join(expected_dir,
+                                 os.path.basename(file_path) + suffix)
+    if not os.path.isfile(expected_path):
+        return None
+    with open(expected_path, 'r') as file:
+        expected = output_body(file.read())
+    return list(difflib.unified_diff(expected, output_body(output),
+                                     expected_path, file_path))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    arg_parser.add_argument("traces", nargs="+",
+                            help="trace files, directories or glob patterns")
+    arg_parser.add_argument(
+        "--jobs", type=int, default=os.cpu_count() or 1,
+        help="number of worker processes (default: number of CPUs)")
+    arg_parser.add_argument(
+        "--expected", metavar="DIR",
+        help="compare each output with DIR/<trace name><suffix>")
+    arg_parser.add_argument(
+        "--suffix", default=".out",
+        help="suffix of the expected and saved outputs (default: .out)")
+    arg_parser.add_argument(
+        "--output-dir", metavar="DIR",
+        help="save each output as DIR/<trace name><suffix>")
+    arg_parser.add_argument(
+        "--show-diff", type=int, default=20, metavar="LINES",
+        help="lines of diff to print for each mismatch (default: 20)")
+    arg_parser.add_argument(
+        "--policy", default=transaction_manager.ConcurrencyPolicy.DETECTION,
+        type=transaction_manager.ConcurrencyPolicy,
+        choices=list(transaction_manager.ConcurrencyPolicy),
+        metavar="{" + ",".join(
+            p.value for p in transaction_manager.ConcurrencyPolicy) + "}")
+    arg_parser.add_argument("--sites", type=int, default=10)
+    arg_parser.add_argument("--variables", type=int, default=20)
+    arg_parser.add_argument("--replication-factor", type=int, default=None)
+    arg_parser.add_argument("--gc-interval", type=int, default=50)
+    args = arg_parser.parse_args()
+
+    try:
+        topology.Topology(args.sites, args.variables,
+                          args.replication_factor)
+    except ValueError as e:
+        arg_parser.error(str(e))
+    file_paths = expand_traces(args.traces)
+    if not file_paths:
+        arg_parser.error("no trace found")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    worker_args = (args.policy, args.sites, args.variables,
+                   args.replication_factor,
+                   args.gc_interval if args.gc_interval >= 0 else None)
+
+    start = time.perf_counter()
+    if args.jobs > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            args.jobs, initializer=init_worker, initargs=worker_args)
+        results = executor.map(run_trace, file_paths,
+                               chunksize=max(1, len(file_paths) //
+                                             (4 * args.jobs)))
+    else:
+        executor = None
+        init_worker(*worker_args)
+        results = map(run_trace, file_paths)
+
+    counts = {"PASS": 0, "FAIL": 0, "ERROR": 0, "DONE": 0}
+    busy_time = 0.0
+    try:
+        for file_path, output, seconds, error in results:
+            busy_time += seconds
+            if args.output_dir:
+                with open(os.path.join(
+                        args.output_dir,
+                        os.path.basename(file_path) + args.suffix),
+                        'w') as file:
+                    file.write(output)
+            diff = None
+            if error:
+                status = "ERROR"
+            elif args.expected:
+                diff = check_output(file_path, output, args.expected,
+                                    args.suffix)
+                status = "DONE" if diff is None else \
+                    "FAIL" if diff else "PASS"
+            else:
+                status = "DONE"
+            counts[status] += 1
+            print("{:<6}{:>9.3f}s  {}".format(status, seconds, file_path))
+            if error:
+                print(error.rstrip())
+            elif diff:
+                print("".join(diff[:args.show_diff]).rstrip())
+    finally:
+        if executor:
+            executor.shutdown()
+    elapsed = time.perf_counter() - start
+
+    print("{} traces: {} passed, {} failed, {} errors, {} not checked".format(
+        len(file_paths), counts["PASS"], counts["FAIL"], counts["ERROR"],
+        counts["DONE"]))
+    print("{:.2f}s of work in {:.2f}s with {} job(s)".format(
+        busy_time, elapsed, args.jobs))
+    if counts["FAIL"] or counts["ERROR"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
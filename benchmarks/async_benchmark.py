@@ -0,0 +1,180 @@
+"""
+Compare commit latency with replication fan-out through asyncio.gather and
+with sequential messages, on sites behind simulated network links.
+
+Runs a synthetic workload in a closed loop (see run_benchmark.py) on an
+AsyncTransactionManager (see async_engine.py) once per fan-out, and reports
+the wall time of the commits, of the writes, and of whole transactions
+(from the start of their begin to the end of their commit).
+
+Usage:
+$ python3 benchmarks/async_benchmark.py [--latency MS] [--jitter MS]
+      [--fan-out FAN_OUT ...] [workload options]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import async_engine  # noqa: E402
+from event_sink import EventSink  # noqa: E402
+from run_benchmark import ClosedLoopDriver, percentile  # noqa: E402
+from topology import Topology  # noqa: E402
+from workload import (add_workload_arguments,  # noqa: E402
+                      workload_from_arguments)
+
+
+class CommitSink(EventSink):
+    """Keeps the transactions committed since the last call of `pop`."""
+
+    def __init__(self):
+        self.committed = []
+        self.num_aborts = 0
+
+    def emit(self, event, *values):
+        if event == "commit":
+            self.committed.append(values[0])
+        elif event == "abort":
+            self.num_aborts += 1
+
+    def pop(self):
+        """
+        :return: the transactions committed since the last call
+        """
+        committed = self.committed
+        self.committed = []
+        return committed
+
+
+class AsyncClosedLoopDriver(ClosedLoopDriver):
+    """
+    ClosedLoopDriver of an AsyncTransactionManager, timing the commits, the
+    writes and the transactions.
+    """
+
+    def __init__(self, tm, workload, sink):
+        """
+        :param tm: the AsyncTransactionManager
+        :param workload: the Workload
+        :param sink: the CommitSink of the AsyncTransactionManager
+        """
+        super().__init__(tm, workload, "direct")
+        self.handlers["end"] = tm.end_async
+        self.sink = sink
+        self.commit_latencies = []
+        self.write_latencies = []
+        self.transaction_latencies = []
+        self.begin_times = {}  # {transaction_id: start of its begin}
+
+    async def run_async(self):
+        """
+        Run all the transactions of the workload.
+        """
+        self.tm.start()
+        try:
+            for instruction in self.instructions():
+                command, args = instruction or ("idle", [])
+                handler = self.handlers.get(command, lambda: None)
+                start = time.perf_counter()
+                await self.tm.tick_async(handler, *args)
+                end = time.perf_counter()
+                self.latencies.append(end - start)
+                if command in ("begin", "beginRO"):
+                    self.begin_times[args[0]] = start
+                elif command == "W":
+                    self.write_latencies.append(end - start)
+                committed = self.sink.pop()
+                if command == "end" and args[0] in committed:
+                    self.commit_latencies.append(end - start)
+                for transaction_id in committed:
+                    self.transaction_latencies.append(
+                        end - self.begin_times.pop(transaction_id))
+        finally:
+            await self.tm.stop()
+
+
+def run(workload, latency, jitter, fan_out):
+    """
+    Run the trace of a workload with a fan-out and measure it.
+    :param workload: the Workload
+    :param latency: one-way latency of the links, in seconds
+    :param jitter: maximum deviation from the latency, in seconds
+    :param fan_out: see `async_engine.FAN_OUTS`
+    :return: dict of results
+    """
+    sink = CommitSink()
+    tm = async_engine.AsyncTransactionManager(
+        latency, jitter, fan_out, workload.seed,
+        topology=Topology(workload.num_sites, workload.num_variables),
+        sink=sink)
+    driver = AsyncClosedLoopDriver(tm, workload, sink)
+    loop = asyncio.new_event_loop()
+    start = time.perf_counter()
+    try:
+        loop.run_until_complete(driver.run_async())
+    finally:
+        loop.close()
+    elapsed = time.perf_counter() - start
+    results = {"fan_out": fan_out, "seconds": elapsed,
+               "ticks": len(driver.latencies),
+               "commits": len(driver.commit_latencies),
+               "aborts": sink.num_aborts,
+               "messages": sum(actor.num_messages for actor in tm.actors)}
+    for name, values in (("commit", driver.commit_latencies),
+                         ("write", driver.write_latencies),
+                         ("transaction", driver.transaction_latencies)):
+        values.sort()
+        results[name + "_ms"] = {
+            "p50": 1e3 * percentile(values, 0.50),
+            "p99": 1e3 * percentile(values, 0.99)} if values else None
+    return results
+
+
+def print_results(results):
+    """Print one line per fan-out."""
+    print("{:<12}{:>9}{:>9}{:>11}{:>11}{:>11}{:>11}{:>12}{:>12}".format(
+        "fan-out", "commits", "seconds", "messages", "commit p50",
+        "commit p99", "write p50", "txn p50 ms", "txn p99 ms"))
+    for r in results:
+        cells = []
+        for name, key in (("commit_ms", "p50"), ("commit_ms", "p99"),
+                          ("write_ms", "p50"), ("transaction_ms", "p50"),
+                          ("transaction_ms", "p99")):
+            cells.append(r[name][key] if r[name] else float("nan"))
+        print("{:<12}{:>9}{:>9.2f}{:>11}{:>11.2f}{:>11.2f}{:>11.2f}"
+              "{:>12.1f}{:>12.1f}".format(
+                  r["fan_out"], r["commits"], r["seconds"], r["messages"],
+                  *cells))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    add_workload_arguments(arg_parser)
+    arg_parser.set_defaults(transactions=200)
+    arg_parser.add_argument(
+        "--latency", type=float, default=1.0, metavar="MS",
+        help="one-way latency of the links to the sites (default: 1.0)")
+    arg_parser.add_argument(
+        "--jitter", type=float, default=0.2, metavar="MS",
+        help="maximum deviation from the latency (default: 0.2)")
+    arg_parser.add_argument(
+        "--fan-out", nargs="+", choices=async_engine.FAN_OUTS,
+        default=list(async_engine.FAN_OUTS),
+        help="fan-outs to compare (default: gather sequential)")
+    args = arg_parser.parse_args()
+
+    results = []
+    for fan_out in args.fan_out:
+        workload = workload_from_arguments(args)
+        results.append(run(workload, args.latency / 1e3, args.jitter / 1e3,
+                           fan_out))
+    print("Latency {} ms, jitter {} ms, {} sites".format(
+        args.latency, args.jitter, args.sites))
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
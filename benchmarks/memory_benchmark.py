@@ -0,0 +1,118 @@
+"""
+Compare the memory used by the slotted data model classes with equivalent
+dict-backed classes, replaying the same generated trace through a
+TransactionManager.
+
+Usage:
+$ python3 benchmarks/memory_benchmark.py [--transactions N] [--variables M]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import data_manager  # noqa: E402
+import transaction_manager  # noqa: E402
+from event_sink import NullSink  # noqa: E402
+from topology import Topology  # noqa: E402
+
+SLOTTED_CLASSES = [
+    (data_manager, "CommitValue"), (data_manager, "TempValue"),
+    (data_manager, "Variable"), (data_manager, "Result"),
+    (data_manager, "ReadLock"), (data_manager, "WriteLock"),
+    (data_manager, "QueuedLock"), (data_manager, "LockManager"),
+    (data_manager, "TransactionLocks"), (data_manager, "FailureHistory"),
+    (transaction_manager, "Transaction"), (transaction_manager, "Operation"),
+]
+
+
+def dict_backed(cls):
+    """
+    :param cls: a class with __slots__
+    :return: the same class without __slots__, so instances use a __dict__
+    """
+    namespace = {name: value for name, value in vars(cls).items()
+                 if name not in cls.__slots__ and
+                 name not in ("__slots__", "__dict__", "__weakref__")}
+    return type(cls.__name__, cls.__bases__, namespace)
+
+
+def generate_trace(num_transactions, num_variables, ops_per_transaction,
+                   seed=0):
+    """
+    Generate a trace of short read/write transactions running one after
+    another, so each commit adds a new version of the variables written.
+    :return: list of instruction lines
+    """
+    rand = random.Random(seed)
+    lines = []
+    for t_idx in range(1, num_transactions + 1):
+        transaction_id = "T{}".format(t_idx)
+        lines.append("begin({})".format(transaction_id))
+        for _ in range(ops_per_transaction):
+            variable_id = "x{}".format(rand.randint(1, num_variables))
+            if rand.random() < 0.5:
+                lines.append("R({},{})".format(transaction_id, variable_id))
+            else:
+                lines.append("W({},{},{})".format(
+                    transaction_id, variable_id, rand.randint(1, 10 ** 6)))
+        lines.append("end({})".format(transaction_id))
+    return lines
+
+
+def run(lines, num_variables):
+    """
+    Replay the trace and measure its memory.
+    :return: (peak bytes, retained bytes, seconds)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    tm = transaction_manager.TransactionManager(
+        topology=Topology(num_variables=num_variables), sink=NullSink())
+    for line in lines:
+        tm.process_line(line)
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tm
+    return peak, retained, elapsed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    arg_parser.add_argument("--transactions", type=int, default=20000)
+    arg_parser.add_argument("--variables", type=int, default=2000)
+    arg_parser.add_argument("--ops", type=int, default=5,
+                            help="operations per transaction")
+    args = arg_parser.parse_args()
+
+    lines = generate_trace(args.transactions, args.variables, args.ops)
+    print("Trace: {} lines, {} variables".format(len(lines), args.variables))
+
+    slotted = run(lines, args.variables)
+    originals = [(module, name, getattr(module, name))
+                 for module, name in SLOTTED_CLASSES]
+    try:
+        for module, name, cls in originals:
+            setattr(module, name, dict_backed(cls))
+        dict_based = run(lines, args.variables)
+    finally:
+        for module, name, cls in originals:
+            setattr(module, name, cls)
+
+    print("{:<12}{:>14}{:>16}{:>10}".format(
+        "classes", "peak (KiB)", "retained (KiB)", "time (s)"))
+    for label, (peak, retained, elapsed) in (("dict", dict_based),
+                                             ("slots", slotted)):
+        print("{:<12}{:>14.1f}{:>16.1f}{:>10.2f}".format(
+            label, peak / 1024, retained / 1024, elapsed))
+    print("retained memory saved: {:.1f}%".format(
+        100 * (1 - slotted[1] / dict_based[1])))
+
+
+if __name__ == "__main__":
+    main()
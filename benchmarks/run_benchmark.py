@@ -0,0 +1,351 @@
+"""
+Measure the throughput, latency and abort rate of the TransactionManager
+on a synthetic workload.
+
+Each client runs one transaction at a time (closed loop): it issues its
+next instruction only after the previous one has completed, and starts a
+new transaction when its transaction commits or aborts.
+
+Usage:
+$ python3 benchmarks/run_benchmark.py [--policy POLICY ...] [--mode MODE]
+      [--recovery MODE] [--replica-selection SELECTION ...]
+      [--json OUTPUT_FILE] [--compare BASELINE_FILE] [workload options]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import transaction_manager  # noqa: E402
+from event_sink import EventSink  # noqa: E402
+from topology import Topology  # noqa: E402
+from workload import (add_workload_arguments,  # noqa: E402
+                      format_instruction, workload_from_arguments)
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+class CountingSink(EventSink):
+    """
+    Counts the events and the aborts by reason, and keeps the duration of
+    each catch-up.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.abort_reasons = Counter()
+        self.catch_up_seconds = []
+
+    def emit(self, event, *values):
+        self.counts[event] += 1
+        if event == "abort":
+            self.abort_reasons[values[1]] += 1
+        elif event == "catch_up":
+            self.catch_up_seconds.append(values[4])
+
+
+def percentile(sorted_values, fraction):
+    """
+    :param sorted_values: non-empty ascending list
+    :param fraction: between 0 and 1
+    :return: the nearest-rank percentile of the values
+    """
+    idx = max(0, min(len(sorted_values) - 1,
+                     int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+
+class ClosedLoopDriver:
+    """
+    Drive a TransactionManager with `concurrency` clients running the
+    transactions of a Workload.
+    """
+
+    def __init__(self, tm, workload, mode="text"):
+        """
+        :param tm: the TransactionManager
+        :param workload: the Workload
+        :param mode: "text" to send instructions as lines of input to
+         `process_line`, "direct" to call the instruction methods through
+         `tick`
+        """
+        self.tm = tm
+        self.workload = workload
+        self.mode = mode
+        self.handlers = {"begin": tm.begin, "beginRO": tm.beginro,
+                         "R": tm.add_read_operation,
+                         "W": tm.add_write_operation, "end": tm.end,
+                         "fail": tm.fail, "recover": tm.recover}
+        self.latencies = []  # seconds of each tick
+        self.timeouts = 0
+
+    def execute(self, command, args):
+        """
+        Run one instruction and record its latency.
+        """
+        if self.mode == "text":
+            line = format_instruction(command, args)
+            start = time.perf_counter()
+            self.tm.process_line(line)
+        else:
+            start = time.perf_counter()
+            self.tm.tick(self.handlers[command], *args)
+        self.latencies.append(time.perf_counter() - start)
+
+    def idle(self):
+        """Run a tick without instruction, so blocked operations retry."""
+        start = time.perf_counter()
+        self.tm.tick(lambda: None)
+        self.latencies.append(time.perf_counter() - start)
+
+    def run(self):
+        """
+        Run all the transactions of the workload.
+        """
+        for instruction in self.instructions():
+            if instruction:
+                self.execute(*instruction)
+            else:
+                self.idle()
+
+    def instructions(self):
+        """
+        Schedule the instructions of the clients, each one after the
+        previous one has run.
+        :return: generator of instructions (command, args), or None for a
+         tick without instruction
+        """
+        tm = self.tm
+        workload = self.workload
+        rand = workload.rand
+        clients = []  # [transaction_id, remaining instructions]
+        stalled = False
+        while clients or workload.has_next_transaction():
+            while len(clients) < workload.concurrency and \
+                    workload.has_next_transaction():
+                script = workload.next_transaction_script()
+                clients.append([script[0][1][0], script])
+            site_event = workload.next_site_event()
+            if site_event:
+                yield site_event
+            ready = []
+            for idx, (transaction_id, script) in enumerate(clients):
+                begun = script[0][0] not in ("begin", "beginRO")
+                if begun and transaction_id not in tm.transaction_table:
+                    ready.append(idx)  # aborted, the client moves on
+                elif not tm.has_pending_operations(transaction_id):
+                    ready.append(idx)
+            if not ready:
+                if stalled and not workload.down_sites:
+                    # nothing can unblock the clients: time out the
+                    # youngest transaction
+                    transaction_id = max(
+                        (tm.transaction_table[t_id].ts, t_id)
+                        for t_id, _ in clients)[1]
+                    tm.abort(transaction_id, "timeout")
+                    self.timeouts += 1
+                else:
+                    yield None
+                stalled = True
+                continue
+            stalled = False
+            idx = rand.choice(ready)
+            transaction_id, script = clients[idx]
+            if script[0][0] not in ("begin", "beginRO") and \
+                    transaction_id not in tm.transaction_table:
+                del clients[idx]
+                continue
+            yield script.pop(0)
+            if not script:
+                del clients[idx]
+        for site_event in workload.recover_all():
+            yield site_event
+
+
+def run(workload, policy, mode, trace_memory,
+        recovery=transaction_manager.RecoveryMode.WAIT_FOR_WRITE,
+        replica_selection=transaction_manager.ReplicaSelection.FIRST):
+    """
+    Run a workload and measure it.
+    :param workload: the Workload
+    :param policy: the ConcurrencyPolicy
+    :param mode: "text" or "direct" (see ClosedLoopDriver)
+    :param trace_memory: measure the peak memory with tracemalloc, which
+     slows down the run
+    :param recovery: the RecoveryMode of the sites
+    :param replica_selection: the ReplicaSelection of reads
+    :return: dict of results
+    """
+    sink = CountingSink()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    tm = transaction_manager.TransactionManager(
+        policy, Topology(workload.num_sites, workload.num_variables),
+        sink=sink, recovery=recovery, replica_selection=replica_selection)
+    driver = ClosedLoopDriver(tm, workload, mode)
+    driver.run()
+    elapsed = time.perf_counter() - start
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    elif resource:
+        # kilobytes on Linux, bytes on macOS
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            peak_memory *= 1024
+
+    latencies = sorted(driver.latencies)
+    counts = sink.counts
+    operations = counts["read"] + counts["read_snapshot"] + counts["write"]
+    finished = counts["commit"] + counts["abort"]
+    catch_ups = sink.catch_up_seconds
+    return {
+        "policy": policy.value, "mode": mode, "recovery": recovery.value,
+        "replica_selection": replica_selection.value,
+        "ticks": len(latencies), "operations": operations,
+        "commits": counts["commit"], "aborts": counts["abort"],
+        "abort_reasons": dict(sink.abort_reasons),
+        "abort_rate": counts["abort"] / finished if finished else 0.0,
+        "seconds": elapsed,
+        "ticks_per_sec": len(latencies) / elapsed,
+        "ops_per_sec": operations / elapsed,
+        "latency_us": {
+            "mean": 1e6 * sum(latencies) / len(latencies),
+            "p50": 1e6 * percentile(latencies, 0.50),
+            "p95": 1e6 * percentile(latencies, 0.95),
+            "p99": 1e6 * percentile(latencies, 0.99),
+            "max": 1e6 * latencies[-1]},
+        "peak_memory_bytes": peak_memory,
+        "peak_memory_source": "tracemalloc" if trace_memory else "maxrss",
+        "reads_by_site": {str(site_id): n for site_id, n
+                          in sorted(tm.read_stats().items())},
+        "versions": tm.version_stats(),
+        "catch_ups": len(catch_ups),
+        "catch_up_us": {
+            "mean": 1e6 * sum(catch_ups) / len(catch_ups),
+            "max": 1e6 * max(catch_ups)} if catch_ups else None,
+    }
+
+
+def print_results(results, baseline=None):
+    """
+    Print a table of results, with the relative change from a baseline run
+    of the same policy, mode and replica selection if any.
+    :param results: list of dicts returned by `run`
+    :param baseline: list of dicts returned by `run` (optional)
+    """
+    def key(r):
+        return r["policy"], r["mode"], r.get("replica_selection", "first")
+
+    baseline_of = {key(r): r for r in baseline or []}
+    header = "{:<12}{:>8}{:>12}{:>12}{:>10}{:>10}{:>10}{:>8}{:>12}".format(
+        "policy", "mode", "ticks/s", "ops/s", "p50 us", "p95 us", "p99 us",
+        "abort", "peak MiB")
+    print(header)
+    for r in results:
+        latency = r["latency_us"]
+        memory = r["peak_memory_bytes"]
+        print("{:<12}{:>8}{:>12.0f}{:>12.0f}{:>10.1f}{:>10.1f}{:>10.1f}"
+              "{:>7.1f}%{:>12}".format(
+                  r["policy"], r["mode"], r["ticks_per_sec"],
+                  r["ops_per_sec"], latency["p50"], latency["p95"],
+                  latency["p99"], 100 * r["abort_rate"],
+                  "-" if memory is None else
+                  "{:.1f}".format(memory / 2 ** 20)))
+        if r.get("catch_up_us"):
+            print("  {} catch-ups after recovery: mean {:.1f} us, max {:.1f} "
+                  "us".format(r["catch_ups"], r["catch_up_us"]["mean"],
+                              r["catch_up_us"]["max"]))
+        print("  {} replica selection, reads by site: ".format(
+            r["replica_selection"]) + ", ".join(
+            "{}: {}".format(site_id, n)
+            for site_id, n in r["reads_by_site"].items()))
+        if r.get("versions"):
+            print("  versions: {retained} retained, {reclaimed} reclaimed"
+                  .format(**r["versions"]))
+        base = baseline_of.get(key(r))
+        if base:
+            print("{:<20}{:>+11.1f}%{:>+11.1f}%{:>+9.1f}%{:>+9.1f}%"
+                  "{:>+9.1f}%".format(
+                      "  vs baseline",
+                      change(base["ticks_per_sec"], r["ticks_per_sec"]),
+                      change(base["ops_per_sec"], r["ops_per_sec"]),
+                      change(base["latency_us"]["p50"], latency["p50"]),
+                      change(base["latency_us"]["p95"], latency["p95"]),
+                      change(base["latency_us"]["p99"], latency["p99"])))
+
+
+def change(old, new):
+    """
+    :return: the relative change from old to new, in percent
+    """
+    return 100 * (new - old) / old if old else 0.0
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    add_workload_arguments(arg_parser)
+    arg_parser.add_argument(
+        "--policy", nargs="+", type=transaction_manager.ConcurrencyPolicy,
+        default=[transaction_manager.ConcurrencyPolicy.DETECTION],
+        help="policies to run, among: " + ", ".join(
+            p.value for p in transaction_manager.ConcurrencyPolicy))
+    arg_parser.add_argument(
+        "--mode", choices=["text", "direct"], default="text",
+        help="send instructions as text lines through process_line "
+             "(default), or call the instruction methods directly")
+    arg_parser.add_argument(
+        "--recovery", type=transaction_manager.RecoveryMode,
+        default=transaction_manager.RecoveryMode.WAIT_FOR_WRITE,
+        help="how recovered sites make replicated variables readable: " +
+             ", ".join(m.value for m in transaction_manager.RecoveryMode))
+    arg_parser.add_argument(
+        "--replica-selection", nargs="+",
+        type=transaction_manager.ReplicaSelection,
+        default=[transaction_manager.ReplicaSelection.FIRST],
+        help="replica selections of reads to run, among: " + ", ".join(
+            s.value for s in transaction_manager.ReplicaSelection))
+    arg_parser.add_argument(
+        "--trace-memory", action="store_true",
+        help="measure peak memory with tracemalloc instead of the peak "
+             "resident set size (slower)")
+    arg_parser.add_argument("--json", metavar="OUTPUT_FILE",
+                            help="save the results as JSON")
+    arg_parser.add_argument("--compare", metavar="BASELINE_FILE",
+                            help="compare with results saved with --json")
+    args = arg_parser.parse_args()
+
+    results = []
+    for policy in args.policy:
+        for replica_selection in args.replica_selection:
+            workload = workload_from_arguments(args)
+            results.append(run(workload, policy, args.mode,
+                               args.trace_memory, args.recovery,
+                               replica_selection))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+    print("Workload: {}".format(json.dumps(workload.config())))
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"workload": workload.config(),
+                       "python": platform.python_version(),
+                       "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Load-test a running server.py with concurrent client connections.
+
+Each connection runs transactions of a synthetic workload in a closed loop:
+it pipelines the begin, the reads and the writes of a transaction without
+waiting for their responses, waits until all its operations have executed,
+then sends the end. It reports the throughput, and the latency percentiles
+of the responses and of the committed transactions.
+
+Usage:
+$ python3 server.py --port 7070 &
+$ python3 benchmarks/server_load.py [--host HOST] [--port PORT | --unix PATH]
+      [--connections N] [--protocol PROTOCOL] [workload options]
+The server must be started with the --sites and --variables of the workload,
+and a fresh server gives unique transaction ids.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import server  # noqa: E402
+from run_benchmark import percentile  # noqa: E402
+from workload import (add_workload_arguments,  # noqa: E402
+                      format_instruction, workload_from_arguments)
+
+# text events a client waits for: "T1 reads x2.1: 20", "T1 (RO) reads ...",
+# "T1 writes ...", "T1 commits!", "T1 aborts! (due to ...)"
+TEXT_EVENT = re.compile(
+    r"^(\S+) (?:\(RO\) )?(reads|writes|commits!|aborts!)")
+TEXT_EVENT_NAMES = {"reads": "read", "writes": "write",
+                    "commits!": "commit", "aborts!": "abort"}
+
+
+class TransactionState:
+    """Progress of a transaction of a client."""
+
+    __slots__ = ("num_operations", "num_executed", "outcome", "changed")
+
+    def __init__(self, num_operations):
+        self.num_operations = num_operations
+        self.num_executed = 0
+        self.outcome = None  # "commit" or "abort"
+        self.changed = asyncio.Event()
+
+
+class LoadClient:
+    """One connection to the server."""
+
+    def __init__(self, protocol):
+        """
+        :param protocol: "text" or "binary"
+        """
+        self.protocol = protocol
+        self.reader = None
+        self.writer = None
+        self.responses = collections.deque()  # futures of the responses
+        self.transactions = {}  # {transaction_id: TransactionState}
+        self.response_latencies = []
+
+    async def connect(self, host, port, unix_path):
+        if unix_path:
+            self.reader, self.writer = await asyncio.open_unix_connection(
+                unix_path)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(
+                host, port)
+        if self.protocol == "binary":
+            self.writer.write(server.MAGIC)
+
+    def send(self, command, args):
+        """
+        Send an instruction without waiting for its response.
+        :return: the future of its response
+        """
+        if self.protocol == "binary":
+            self.writer.write(server.encode_request(command, args))
+        else:
+            self.writer.write(
+                (format_instruction(command, args) + "\n").encode("utf-8"))
+        future = asyncio.get_event_loop().create_future()
+        self.responses.append((time.perf_counter(), future))
+        return future
+
+    async def receive(self):
+        """Read the responses and notifications until the server closes."""
+        try:
+            if self.protocol == "binary":
+                while True:
+                    header = await self.reader.readexactly(
+                        server.FRAME_HEADER.size)
+                    payload = await self.reader.readexactly(
+                        server.FRAME_HEADER.unpack(header)[0])
+                    events = [json.loads(line) for line in
+                              payload[1:].decode("utf-8").split("\n")
+                              if line]
+                    for event in events:
+                        self.handle_event(event.get("event"),
+                                          event.get("transaction_id"))
+                    if payload[0] == server.FRAME_RESPONSE:
+                        self.resolve_response()
+            else:
+                while True:
+                    line = (await self.reader.readline()).decode("utf-8")
+                    if not line:
+                        break
+                    line = line.rstrip("\n")
+                    if line == server.TEXT_END:
+                        self.resolve_response()
+                        continue
+                    if line.startswith(server.TEXT_NOTIFICATION):
+                        line = line[len(server.TEXT_NOTIFICATION):]
+                    match = TEXT_EVENT.match(line)
+                    if match:
+                        self.handle_event(TEXT_EVENT_NAMES[match.group(2)],
+                                          match.group(1))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for _, future in self.responses:
+                if not future.done():
+                    future.set_exception(ConnectionError("closed"))
+
+    def resolve_response(self):
+        start, future = self.responses.popleft()
+        self.response_latencies.append(time.perf_counter() - start)
+        future.set_result(None)
+
+    def handle_event(self, event, transaction_id):
+        state = self.transactions.get(transaction_id)
+        if not state:
+            return
+        if event in ("read", "read_snapshot", "write"):
+            state.num_executed += 1
+        elif event in ("commit", "abort"):
+            state.outcome = event
+        else:
+            return
+        state.changed.set()
+
+    async def run_transaction(self, script):
+        """
+        Run a transaction script: pipeline its begin and operations, wait
+        for them to execute, then end it.
+        :return: True if it committed, False if it aborted
+        """
+        transaction_id = script[0][1][0]
+        state = TransactionState(len(script) - 2)
+        self.transactions[transaction_id] = state
+        try:
+            responses = [self.send(command, args)
+                         for command, args in script[:-1]]
+            await asyncio.gather(*responses)
+            while state.outcome is None and \
+                    state.num_executed < state.num_operations:
+                state.changed.clear()
+                await state.changed.wait()
+            if state.outcome is None:
+                await self.send(*script[-1])
+            return state.outcome == "commit"
+        finally:
+            del self.transactions[transaction_id]
+
+    async def run(self, scripts, stats):
+        """
+        Run transactions until there are none left.
+        :param scripts: the shared iterator of transaction scripts
+        :param stats: dict of the shared counters
+        """
+        receiver = asyncio.ensure_future(self.receive())
+        try:
+            for script in scripts:
+                start = time.perf_counter()
+                if await self.run_transaction(script):
+                    stats["commits"] += 1
+                    stats["transaction_latencies"].append(
+                        time.perf_counter() - start)
+                else:
+                    stats["aborts"] += 1
+        finally:
+            self.writer.close()
+            await receiver
+
+
+async def run_load(args, workload):
+    """
+    :return: dict of results
+    """
+    def scripts():
+        while workload.has_next_transaction():
+            yield workload.next_transaction_script()
+
+    shared_scripts = scripts()
+    stats = {"commits": 0, "aborts": 0, "transaction_latencies": []}
+    clients = [LoadClient(args.protocol) for _ in range(args.connections)]
+    for client in clients:
+        await client.connect(args.host, args.port, args.unix)
+    start = time.perf_counter()
+    await asyncio.gather(*[client.run(shared_scripts, stats)
+                           for client in clients])
+    elapsed = time.perf_counter() - start
+    response_latencies = sorted(latency for client in clients
+                                for latency in client.response_latencies)
+    transaction_latencies = sorted(stats["transaction_latencies"])
+    results = {"connections": args.connections, "protocol": args.protocol,
+               "seconds": elapsed, "commits": stats["commits"],
+               "aborts": stats["aborts"],
+               "instructions": len(response_latencies)}
+    for name, values in (("response_ms", response_latencies),
+                         ("transaction_ms", transaction_latencies)):
+        results[name] = {
+            "p50": 1e3 * percentile(values, 0.50),
+            "p90": 1e3 * percentile(values, 0.90),
+            "p99": 1e3 * percentile(values, 0.99)} if values else None
+    return results
+
+
+def print_results(r):
+    print("{} connections ({}): {} commits, {} aborts in {:.2f} s".format(
+        r["connections"], r["protocol"], r["commits"], r["aborts"],
+        r["seconds"]))
+    print("throughput: {:.0f} commits/s, {:.0f} instructions/s".format(
+        r["commits"] / r["seconds"], r["instructions"] / r["seconds"]))
+    for name in ("response_ms", "transaction_ms"):
+        if r[name]:
+            print("{:<16}p50 {:8.3f}  p90 {:8.3f}  p99 {:8.3f} ms".format(
+                name.split("_")[0], r[name]["p50"], r[name]["p90"],
+                r[name]["p99"]))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    add_workload_arguments(arg_parser)
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=7070)
+    arg_parser.add_argument("--unix", metavar="PATH",
+                            help="connect to a Unix socket instead of TCP")
+    arg_parser.add_argument(
+        "--connections", type=int, default=8, metavar="N",
+        help="number of concurrent client connections (default: 8)")
+    arg_parser.add_argument(
+        "--protocol", choices=["text", "binary"], default="binary",
+        help="instruction framing (default: binary)")
+    arg_parser.add_argument("--json", metavar="FILE",
+                            help="save the results as JSON")
+    args = arg_parser.parse_args()
+    if args.connections < 1:
+        arg_parser.error("--connections must be positive")
+    if args.fail_rate:
+        arg_parser.error("site failures are not generated by the clients")
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(
+            run_load(args, workload_from_arguments(args)))
+    finally:
+        loop.close()
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
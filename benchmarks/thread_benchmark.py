@@ -0,0 +1,90 @@
+"""
+Measure the throughput of the lock managers as the number of threads grows.
+
+Runs the transactions of a synthetic workload on a ThreadedEngine (see
+threaded_engine.py) once per worker count, and reports the commits per
+second, the wait-die restarts, the operations that blocked on a queued lock
+and the contended latch acquisitions. On a free-threaded build of Python
+(3.13t and later) the workers run in parallel; otherwise the GIL interleaves
+them, and a --think-us delay with the locks held shows the contention.
+
+Usage:
+$ python3 benchmarks/thread_benchmark.py [--workers N ...] [--stripes N]
+      [--think-us US] [workload options]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from threaded_engine import ThreadedEngine  # noqa: E402
+from topology import Topology  # noqa: E402
+from workload import (add_workload_arguments,  # noqa: E402
+                      workload_from_arguments)
+
+
+def run(workload, num_workers, num_stripes, think_time):
+    """
+    Run the transactions of a workload on worker threads and measure it.
+    :param workload: the Workload (site failures are ignored)
+    :param num_workers: number of worker threads
+    :param num_stripes: number of latches per site
+    :param think_time: time a worker sleeps after each operation, in seconds
+    :return: dict of results
+    """
+    scripts = []
+    while workload.has_next_transaction():
+        scripts.append(workload.next_transaction_script())
+    engine = ThreadedEngine(
+        Topology(workload.num_sites, workload.num_variables), num_workers,
+        num_stripes, think_time)
+    results = engine.run(scripts)
+    results["commits_per_sec"] = results["commits"] / results["seconds"]
+    return results
+
+
+def print_results(results):
+    """Print one line per worker count."""
+    print("{:>8}{:>9}{:>9}{:>12}{:>9}{:>9}{:>14}{:>12}".format(
+        "workers", "commits", "seconds", "commits/s", "deaths", "waits",
+        "wait ms/op", "contended"))
+    for r in results:
+        print("{:>8}{:>9}{:>9.2f}{:>12.0f}{:>9}{:>9}{:>14.3f}{:>12}".format(
+            r["workers"], r["commits"], r["seconds"], r["commits_per_sec"],
+            r["deaths"], r["waits"],
+            1e3 * r["wait_seconds"] / max(1, r["operations"]),
+            r["latch_contention"]))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    add_workload_arguments(arg_parser)
+    arg_parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4, 8], metavar="N",
+        help="worker counts to run (default: 1 2 4 8)")
+    arg_parser.add_argument(
+        "--stripes", type=int, default=64, metavar="N",
+        help="number of latches per site (default: 64)")
+    arg_parser.add_argument(
+        "--think-us", type=float, default=0.0, metavar="US",
+        help="time a worker spends after each operation, holding its locks "
+             "(default: 0)")
+    args = arg_parser.parse_args()
+    if any(n < 1 for n in args.workers) or args.stripes < 1:
+        arg_parser.error("--workers and --stripes must be positive")
+
+    results = []
+    for num_workers in args.workers:
+        workload = workload_from_arguments(args)
+        results.append(run(workload, num_workers, args.stripes,
+                           args.think_us / 1e6))
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print("Python {}, GIL {}, {} sites, {} variables".format(
+        sys.version.split()[0], "enabled" if is_gil_enabled else "disabled",
+        args.sites, args.variables))
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
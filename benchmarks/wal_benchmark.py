@@ -0,0 +1,114 @@
+"""
+Compare the write-ahead log with an fsync per commit and group commit.
+
+Each configuration runs the same synthetic workload; the logs are replayed
+when failed sites recover.
+
+Usage:
+$ python3 benchmarks/wal_benchmark.py [--group-ticks N ...] [--wal-dir DIR]
+      [--mode MODE] [workload options]
+The logs are written to a temporary directory unless --wal-dir is given;
+put it on the disk to measure, a tmpfs makes fsync almost free.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import transaction_manager  # noqa: E402
+from run_benchmark import ClosedLoopDriver, CountingSink  # noqa: E402
+from topology import Topology  # noqa: E402
+from wal import SyncPolicy  # noqa: E402
+from workload import (add_workload_arguments,  # noqa: E402
+                      workload_from_arguments)
+
+
+def run(workload, wal_dir, sync_policy, group_ticks, mode):
+    """
+    Run a workload with (or without) write-ahead logs and measure it.
+    :param workload: the Workload
+    :param wal_dir: directory of the logs, None to run without logs
+    :param sync_policy: the SyncPolicy of the logs
+    :param group_ticks: number of ticks per group commit
+    :param mode: "text" or "direct" (see ClosedLoopDriver)
+    :return: dict of results
+    """
+    sink = CountingSink()
+    start = time.perf_counter()
+    tm = transaction_manager.TransactionManager(
+        topology=Topology(workload.num_sites, workload.num_variables),
+        sink=sink, wal_dir=wal_dir, wal_sync=sync_policy,
+        wal_group_ticks=group_ticks)
+    driver = ClosedLoopDriver(tm, workload, mode)
+    driver.run()
+    tm.close_logs()
+    elapsed = time.perf_counter() - start
+    logs = [dm.wal for dm in tm.data_manager_list if dm.wal]
+    latencies = sorted(driver.latencies)
+    if not wal_dir:
+        name = "no log"
+    elif sync_policy == SyncPolicy.GROUP:
+        name = "group/{} tick{}".format(group_ticks,
+                                        "s" if group_ticks > 1 else "")
+    else:
+        name = sync_policy.value
+    return {
+        "name": name,
+        "commits": sink.counts["commit"],
+        "seconds": elapsed,
+        "commits_per_sec": sink.counts["commit"] / elapsed,
+        "records": sum(log.num_records for log in logs),
+        "fsyncs": sum(log.num_syncs for log in logs),
+        "log_bytes": sum(log.size for log in logs),
+        "p99_latency_us": 1e6 * latencies[
+            max(0, int(round(0.99 * len(latencies))) - 1)],
+    }
+
+
+def print_results(results):
+    """Print one line per configuration."""
+    print("{:<16}{:>10}{:>12}{:>10}{:>10}{:>12}{:>14}".format(
+        "sync", "commits", "commits/s", "records", "fsyncs", "log (KiB)",
+        "p99 tick (us)"))
+    for r in results:
+        print("{:<16}{:>10}{:>12.0f}{:>10}{:>10}{:>12.1f}{:>14.0f}".format(
+            r["name"], r["commits"], r["commits_per_sec"], r["records"],
+            r["fsyncs"], r["log_bytes"] / 1024, r["p99_latency_us"]))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    add_workload_arguments(arg_parser)
+    arg_parser.add_argument(
+        "--group-ticks", type=int, nargs="+", default=[1, 10, 100],
+        metavar="N",
+        help="group commit windows to run, in ticks (default: 1 10 100)")
+    arg_parser.add_argument(
+        "--wal-dir", metavar="DIR",
+        help="directory of the logs (default: a temporary directory)")
+    arg_parser.add_argument(
+        "--mode", choices=["text", "direct"], default="direct",
+        help="send instructions as text lines through process_line, or "
+             "call the instruction methods directly (default)")
+    args = arg_parser.parse_args()
+    if any(n < 1 for n in args.group_ticks):
+        arg_parser.error("--group-ticks must be positive")
+
+    configs = [(False, SyncPolicy.NONE, 1), (True, SyncPolicy.COMMIT, 1)]
+    configs += [(True, SyncPolicy.GROUP, n) for n in args.group_ticks]
+    if args.wal_dir:
+        os.makedirs(args.wal_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=args.wal_dir) as wal_dir:
+        results = []
+        for use_wal, sync_policy, group_ticks in configs:
+            workload = workload_from_arguments(args)
+            results.append(run(workload, wal_dir if use_wal else None,
+                               sync_policy, group_ticks, args.mode))
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
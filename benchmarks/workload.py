@@ -0,0 +1,232 @@
+"""
+Synthetic workload generator for RepCRec.
+
+Usage:
+$ python3 benchmarks/workload.py [--transactions N] [--ops K] [--skew S] ...
+      > trace.txt
+"""
+import argparse
+import bisect
+import itertools
+import random
+
+
+def format_instruction(command, args):
+    """
+    :param command: the command of the instruction (e.g. "R")
+    :param args: list of arguments of the instruction
+    :return: the instruction as a line of input (e.g. "R(T1,x2)")
+    """
+    return "{}({})".format(command, ",".join(str(arg) for arg in args))
+
+
+class ZipfSampler:
+    """
+    Sample indexes 1...n with probability proportional to 1 / index ** skew.
+    A skew of 0 is uniform; larger skews concentrate the samples on a few
+    hot indexes.
+    """
+
+    def __init__(self, n, skew, rand):
+        """
+        :param n: number of indexes
+        :param skew: the exponent of the distribution
+        :param rand: the random.Random to sample with
+        """
+        self.rand = rand
+        self.cumulative_weights = list(itertools.accumulate(
+            1 / i ** skew for i in range(1, n + 1)))
+
+    def sample(self):
+        """
+        :return: an index between 1 and n
+        """
+        x = self.rand.random() * self.cumulative_weights[-1]
+        return bisect.bisect_right(self.cumulative_weights, x) + 1
+
+
+class Workload:
+    """
+    A stream of transactions with random reads and writes, plus random site
+    failures and recoveries.
+    Each transaction is a script of instructions (command, args): begin,
+    some reads and writes, and end.
+    """
+
+    def __init__(self, num_transactions=1000, ops_per_transaction=5,
+                 read_ratio=0.5, read_only_fraction=0.1, skew=0.0,
+                 fail_rate=0.0, recover_delay=10, concurrency=8,
+                 num_variables=20, num_sites=10, seed=0):
+        """
+        Initialize a Workload instance.
+        :param num_transactions: number of transactions
+        :param ops_per_transaction: reads and writes of each transaction
+        :param read_ratio: fraction of the operations that are reads
+        :param read_only_fraction: fraction of the transactions that are
+         read-only
+        :param skew: Zipf exponent of the variable accesses (0: uniform)
+        :param fail_rate: probability of a site failure at each instruction
+        :param recover_delay: number of instructions a failed site stays down
+        :param concurrency: number of transactions running at the same time
+        :param num_variables: number of variables x1...x{num_variables}
+        :param num_sites: number of sites
+        :param seed: seed of the random generator
+        """
+        self.num_transactions = num_transactions
+        self.ops_per_transaction = ops_per_transaction
+        self.read_ratio = read_ratio
+        self.read_only_fraction = read_only_fraction
+        self.skew = skew
+        self.fail_rate = fail_rate
+        self.recover_delay = recover_delay
+        self.concurrency = concurrency
+        self.num_variables = num_variables
+        self.num_sites = num_sites
+        self.seed = seed
+        self.rand = random.Random(seed)
+        self.variable_sampler = ZipfSampler(num_variables, skew, self.rand)
+        self.next_transaction = 1
+        self.down_sites = {}  # {site_id: instruction count to recover at}
+        self.clock = 0
+
+    def config(self):
+        """
+        :return: dict of the parameters of the workload
+        """
+        return {"transactions": self.num_transactions,
+                "ops_per_transaction": self.ops_per_transaction,
+                "read_ratio": self.read_ratio,
+                "read_only_fraction": self.read_only_fraction,
+                "skew": self.skew, "fail_rate": self.fail_rate,
+                "recover_delay": self.recover_delay,
+                "concurrency": self.concurrency,
+                "variables": self.num_variables, "sites": self.num_sites,
+                "seed": self.seed}
+
+    def has_next_transaction(self):
+        """
+        :return: boolean value to indicate if there are transactions left
+        """
+        return self.next_transaction <= self.num_transactions
+
+    def next_transaction_script(self):
+        """
+        :return: the instructions of the next transaction, begin first and
+         end last
+        """
+        transaction_id = "T{}".format(self.next_transaction)
+        self.next_transaction += 1
+        rand = self.rand
+        is_ro = rand.random() < self.read_only_fraction
+        script = [("beginRO" if is_ro else "begin", [transaction_id])]
+        for _ in range(self.ops_per_transaction):
+            variable_id = "x{}".format(self.variable_sampler.sample())
+            if is_ro or rand.random() < self.read_ratio:
+                script.append(("R", [transaction_id, variable_id]))
+            else:
+                script.append(("W", [transaction_id, variable_id,
+                                     str(rand.randint(1, 10 ** 6))]))
+        script.append(("end", [transaction_id]))
+        return script
+
+    def next_site_event(self):
+        """
+        Advance the failure clock by one instruction.
+        :return: a fail or recover instruction to run before the next
+         instruction, or None
+        """
+        self.clock += 1
+        for site_id, recover_at in self.down_sites.items():
+            if recover_at <= self.clock:
+                del self.down_sites[site_id]
+                return "recover", [site_id]
+        if self.fail_rate and self.rand.random() < self.fail_rate and \
+                len(self.down_sites) < self.num_sites - 1:
+            site_id = self.rand.choice(
+                [s for s in range(1, self.num_sites + 1)
+                 if s not in self.down_sites])
+            self.down_sites[site_id] = self.clock + self.recover_delay
+            return "fail", [site_id]
+        return None
+
+    def recover_all(self):
+        """
+        :return: the recover instructions of all failed sites
+        """
+        events = [("recover", [site_id]) for site_id in self.down_sites]
+        self.down_sites.clear()
+        return events
+
+    def trace(self):
+        """
+        Generate an open-loop trace: the instructions of `concurrency`
+        transactions interleaved at random, without knowing if they block or
+        abort.
+        :return: generator of instructions (command, args)
+        """
+        active = []
+        while active or self.has_next_transaction():
+            while len(active) < self.concurrency and \
+                    self.has_next_transaction():
+                active.append(self.next_transaction_script())
+            site_event = self.next_site_event()
+            if site_event:
+                yield site_event
+            idx = self.rand.randrange(len(active))
+            script = active[idx]
+            yield script.pop(0)
+            if not script:
+                active[idx] = active[-1]
+                active.pop()
+        for site_event in self.recover_all():
+            yield site_event
+
+
+def add_workload_arguments(arg_parser):
+    """
+    Add the command line arguments of the Workload parameters.
+    :param arg_parser: the argparse.ArgumentParser
+    """
+    arg_parser.add_argument("--transactions", type=int, default=1000)
+    arg_parser.add_argument("--ops", type=int, default=5,
+                            help="operations per transaction")
+    arg_parser.add_argument("--read-ratio", type=float, default=0.5,
+                            help="fraction of operations that are reads")
+    arg_parser.add_argument("--read-only", type=float, default=0.1,
+                            help="fraction of read-only transactions")
+    arg_parser.add_argument("--skew", type=float, default=0.0,
+                            help="Zipf exponent of variable accesses "
+                                 "(0: uniform)")
+    arg_parser.add_argument("--fail-rate", type=float, default=0.0,
+                            help="probability of a site failure at each "
+                                 "instruction")
+    arg_parser.add_argument("--recover-delay", type=int, default=10,
+                            help="instructions a failed site stays down")
+    arg_parser.add_argument("--concurrency", type=int, default=8,
+                            help="transactions running at the same time")
+    arg_parser.add_argument("--variables", type=int, default=20)
+    arg_parser.add_argument("--sites", type=int, default=10)
+    arg_parser.add_argument("--seed", type=int, default=0)
+
+
+def workload_from_arguments(args):
+    """
+    :param args: the arguments parsed with `add_workload_arguments`
+    :return: the Workload
+    """
+    return Workload(args.transactions, args.ops, args.read_ratio,
+                    args.read_only, args.skew, args.fail_rate,
+                    args.recover_delay, args.concurrency, args.variables,
+                    args.sites, args.seed)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    add_workload_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    for command, instruction_args in workload_from_arguments(args).trace():
+        print(format_instruction(command, instruction_args))
+
+
+if __name__ == "__main__":
+    main()
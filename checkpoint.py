@@ -0,0 +1,91 @@
+import pickle
+import zlib
+
+# Checkpoint file format: MAGIC followed by a zlib-compressed pickle of
+# {"tm": TransactionManager, "position": int}. The TransactionManager
+# includes its data managers, waits-for graph, parser and topology, but not
+# its sink nor any profiler (see `TransactionManager.__getstate__`).
+MAGIC = b"RCK\x01"
+COMPRESSION_LEVEL = 1  # favour speed, the pickle is already compact
+
+
+class CheckpointError(Exception):
+    """Error thrown when a checkpoint cannot be saved or loaded."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def save(tm, file_path, position=0):
+    """
+    Save the complete state of a TransactionManager to a file.
+    :param tm: the TransactionManager
+    :param file_path: path of the checkpoint file
+    :param position: number of input lines or compiled instructions
+     consumed so far, to resume the input after restoring
+    :return: the size of the checkpoint in bytes
+    """
+    try:
+        data = pickle.dumps({"tm": tm, "position": position},
+                            pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        # e.g. a Topology built with a lambda as placement
+        raise CheckpointError("Cannot checkpoint the state: {}".format(e))
+    data = MAGIC + zlib.compress(data, COMPRESSION_LEVEL)
+    with open(file_path, 'wb') as file:
+        file.write(data)
+    return len(data)
+
+
+def load(file_path, sink=None):
+    """
+    Restore a TransactionManager saved with `save`, without executing any
+    instruction again.
+    :param file_path: path of the checkpoint file
+    :param sink: the EventSink of the restored TransactionManager (default:
+     an unbuffered TextSink on the standard output)
+    :return: tuple (TransactionManager, position)
+    """
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    if not data.startswith(MAGIC):
+        raise CheckpointError("Not a checkpoint file: {}".format(file_path))
+    try:
+        state = pickle.loads(zlib.decompress(data[len(MAGIC):]))
+    except (zlib.error, pickle.UnpicklingError, EOFError) as e:
+        raise CheckpointError("Corrupted checkpoint file {}: {}".format(
+            file_path, e))
+    tm = state["tm"]
+    if sink:
+        tm.sink = sink
+    return tm, state["position"]
+
+
+class CheckpointTrigger:
+    """
+    Save a checkpoint the first time the TransactionManager reaches a given
+    timestamp, before executing the instruction at that timestamp.
+    """
+
+    def __init__(self, tm, ts, file_path):
+        """
+        :param tm: the TransactionManager
+        :param ts: the timestamp to save the checkpoint at
+        :param file_path: path of the checkpoint file
+        """
+        self.tm = tm
+        self.ts = ts
+        self.file_path = file_path
+        self.size = None  # size of the checkpoint, once saved
+
+    def __call__(self, position):
+        """
+        Save the checkpoint if the timestamp has been reached.
+        :param position: number of input lines or compiled instructions
+         consumed so far
+        :return: boolean value to indicate if the checkpoint was saved now
+        """
+        if self.size is not None or self.tm.ts < self.ts:
+            return False
+        self.size = save(self.tm, self.file_path, position)
+        return True
@@ -0,0 +1,291 @@
+"""
+Typed client API of a TransactionManager.
+
+Each call of a Client runs one tick, like one line of input, without
+formatting or parsing any text. Reads and writes return an OperationFuture,
+set when the operation executes, which may be later than the tick if it has
+to wait for a lock. A Batch submits many instructions of one or more
+transactions in a single tick, with a single deadlock check and a single
+pass of the operation queue:
+
+    client = tm.client
+    client.begin("T1")
+    batch = client.batch()
+    read = batch.read("T1", "x2")
+    batch.write("T1", "x4", 10)
+    client.submit(batch)
+    print(read.result(), client.commit("T1"))
+
+The text interpreter (`process_line`) is a thin layer over this API.
+"""
+from enum import Enum
+
+from parser import InvalidInstructionError
+
+
+class FutureState(Enum):
+    """Status of an OperationFuture."""
+    PENDING = "pending"  # not executed yet
+    DONE = "done"  # executed, the result is set
+    FAILED = "failed"  # the instruction was invalid
+    CANCELLED = "cancelled"  # dropped when its transaction ended
+
+
+class OperationFuture:
+    """
+    Result of an instruction, available once it has executed: the value of
+    a read, the sites of a write, or whether a commit succeeded.
+    """
+
+    __slots__ = ("state", "value")
+
+    def __init__(self):
+        """
+        Initialize a pending OperationFuture instance.
+        """
+        self.state = FutureState.PENDING
+        self.value = None  # result, or InvalidInstructionError if failed
+
+    def __repr__(self):
+        return "OperationFuture({}, {!r})".format(self.state.value,
+                                                  self.value)
+
+    def done(self):
+        """
+        :return: boolean value to indicate if the instruction has executed,
+         failed or been cancelled
+        """
+        return self.state != FutureState.PENDING
+
+    def cancelled(self):
+        """
+        :return: boolean value to indicate if the operation was dropped
+        """
+        return self.state == FutureState.CANCELLED
+
+    def result(self):
+        """
+        :return: the result of the instruction
+        :raise InvalidInstructionError: if it failed, was cancelled, or is
+         still pending
+        """
+        if self.state == FutureState.DONE:
+            return self.value
+        if self.state == FutureState.FAILED:
+            raise self.value
+        raise InvalidInstructionError(
+            "Operation is {}".format(self.state.value))
+
+    def set_result(self, value):
+        """
+        :param value: the result of the instruction
+        """
+        self.state = FutureState.DONE
+        self.value = value
+
+    def set_exception(self, error):
+        """
+        :param error: the InvalidInstructionError of the instruction
+        """
+        self.state = FutureState.FAILED
+        self.value = error
+
+    def cancel(self):
+        """Drop a pending operation whose transaction has ended."""
+        if self.state == FutureState.PENDING:
+            self.state = FutureState.CANCELLED
+
+
+class Batch:
+    """
+    Instructions to submit in one tick with `Client.submit`. Begins, reads
+    and writes are executed in the order they are added, then the operation
+    queue is executed once, then the commits are executed in order (and the
+    operations they unblock are retried).
+    """
+
+    def __init__(self, tm):
+        """
+        Initialize an empty Batch instance.
+        :param tm: the TransactionManager
+        """
+        self.tm = tm
+        # [(instruction, args, future, is_operation)]; the futures of reads
+        # and writes are passed to the TransactionManager, which sets them
+        self.instructions = []
+        self.commits = []
+
+    def __len__(self):
+        return len(self.instructions) + len(self.commits)
+
+    def add(self, instructions, instruction, args, is_operation=False):
+        """
+        :return: the OperationFuture of the new instruction
+        """
+        future = OperationFuture()
+        if is_operation:
+            args += (future,)
+        instructions.append((instruction, args, future, is_operation))
+        return future
+
+    def begin(self, transaction_id):
+        return self.add(self.instructions, self.tm.begin, (transaction_id,))
+
+    def begin_ro(self, transaction_id):
+        return self.add(self.instructions, self.tm.beginro,
+                        (transaction_id,))
+
+    def read(self, transaction_id, variable_id):
+        return self.add(self.instructions, self.tm.add_read_operation,
+                        (transaction_id, variable_id), True)
+
+    def write(self, transaction_id, variable_id, value):
+        return self.add(self.instructions, self.tm.add_write_operation,
+                        (transaction_id, variable_id, value), True)
+
+    def commit(self, transaction_id):
+        return self.add(self.commits, self.tm.end, (transaction_id,))
+
+
+class Client:
+    """Typed API of a TransactionManager, see the module documentation."""
+
+    # text command: (TransactionManager method, converters of its arguments)
+    TEXT_COMMANDS = {
+        "begin": ("begin", (str,)), "beginRO": ("beginro", (str,)),
+        "R": ("add_read_operation", (str, str)),
+        "W": ("add_write_operation", (str, str, str)),
+        "dump": ("dump", ()), "end": ("end", (str,)),
+        "fail": ("fail", (int,)), "recover": ("recover", (int,))}
+
+    def __init__(self, tm):
+        """
+        Initialize a Client instance.
+        :param tm: the TransactionManager
+        """
+        self.tm = tm
+
+    def begin(self, transaction_id):
+        self.tm.tick(self.tm.begin, transaction_id)
+
+    def begin_ro(self, transaction_id):
+        self.tm.tick(self.tm.beginro, transaction_id)
+
+    def read(self, transaction_id, variable_id):
+        """
+        :return: OperationFuture of the value read
+        """
+        future = OperationFuture()
+        self.tm.tick(self.tm.add_read_operation, transaction_id, variable_id,
+                     future)
+        return future
+
+    def write(self, transaction_id, variable_id, value):
+        """
+        :return: OperationFuture of the list of the sites written
+        """
+        future = OperationFuture()
+        self.tm.tick(self.tm.add_write_operation, transaction_id,
+                     variable_id, value, future)
+        return future
+
+    def commit(self, transaction_id):
+        """
+        End a transaction: commit it, or abort it if it accessed a site
+        that failed since.
+        :return: True if it committed, False if it aborted
+        :raise InvalidInstructionError: if one of its operations still waits
+         for a lock
+        """
+        return self.tm.tick(self.tm.end, transaction_id)
+
+    def fail(self, site_id):
+        self.tm.tick(self.tm.fail, site_id)
+
+    def recover(self, site_id):
+        self.tm.tick(self.tm.recover, site_id)
+
+    def dump(self):
+        """
+        :return: list of (site_id, is_up, [(variable_id, value), ...])
+        """
+        return self.tm.tick(self.tm.dump)
+
+    def idle(self):
+        """Run a tick without instruction, so blocked operations retry."""
+        self.tm.tick(lambda: None)
+
+    def batch(self):
+        """
+        :return: a new empty Batch
+        """
+        return Batch(self.tm)
+
+    def submit(self, batch):
+        """
+        Execute a Batch in one tick. An invalid instruction does not stop the
+        others, its future holds the error.
+        :param batch: the Batch
+        """
+        results = self.tm.tick_batch(
+            [(instruction, args)
+             for instruction, args, _, _ in batch.instructions],
+            [(instruction, args)
+             for instruction, args, _, _ in batch.commits])
+        for (_, _, future, is_operation), result in zip(
+                batch.instructions + batch.commits, results):
+            if isinstance(result, InvalidInstructionError):
+                future.set_exception(result)
+            elif not is_operation:
+                future.set_result(result)
+
+    def process_line(self, line, parser=None):
+        """
+        Parse one line of input and execute it.
+        :param line: one line of instruction
+        :param parser: the Parser of the input (default: the parser of the
+         TransactionManager), e.g. one per network client
+        :return: True if success, False if instruction is invalid
+        """
+        li = (parser or self.tm.parser).parse_line(line)
+        if li:
+            command = li.pop(0)
+            try:
+                self.execute(command, li)
+            except InvalidInstructionError as e:
+                self.tm.sink.emit("invalid_instruction", e.message,
+                                  line.strip())
+                return False
+        return True
+
+    def execute(self, command, args):
+        """
+        Execute a text instruction in one tick.
+        :param command: "begin", "beginRO", "R", "W", "dump", "end", "fail",
+         or "recover"
+        :param args: list of the arguments of the command, as strings
+        :return: the result of the instruction
+        """
+        instruction, args = self.instruction(command, args)
+        return self.tm.tick(instruction, *args)
+
+    def instruction(self, command, args):
+        """
+        Look up the TransactionManager method of a text instruction. This is
+        the only dispatcher of the text commands, shared by the engines.
+        :param command: see `execute`
+        :param args: see `execute`
+        :return: tuple of the method and the list of its converted arguments,
+         rejecting the instruction if the command is unknown
+        """
+        method_name, converters = self.TEXT_COMMANDS.get(command,
+                                                         (None, ()))
+        if method_name is None:
+            return self.reject, ["Unknown instruction"]
+        return getattr(self.tm, method_name), [
+            convert(arg) for convert, arg in zip(converters, args)]
+
+    @staticmethod
+    def reject(message):
+        """Instruction of a tick that cannot be executed."""
+        raise InvalidInstructionError(message)
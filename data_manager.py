@@ -1,10 +1,15 @@
 from enum import Enum
-from collections import defaultdict
+from collections import deque
+from bisect import bisect_right
+from topology import Topology
+from profiler import unwrapped_state
 
 
 class CommitValue:
     """Represents a committed value of a variable."""
 
+    __slots__ = ("value", "commit_ts")
+
     def __init__(self, value, commit_ts):
         """
         Initialize a CommitValue instance.
@@ -18,6 +23,8 @@ class CommitValue:
 class TempValue:
     """Saves the temporary written value before the transaction commits."""
 
+    __slots__ = ("value", "transaction_id")
+
     def __init__(self, value, transaction_id):
         """
         Initialize a TempValue instance.
@@ -29,6 +36,9 @@ class TempValue:
 
 
 class Variable:
+    __slots__ = ("variable_id", "committed_value_list", "commit_ts_list",
+                 "temp_value", "is_replicated", "is_readable")
+
     def __init__(self, variable_id, init_value, is_replicated):
         """
         Initialize a Variable instance.
@@ -37,36 +47,75 @@ class Variable:
         :param is_replicated: indicate if variable is replicated or not
         """
         self.variable_id = variable_id
-        self.committed_value_list = [init_value]  # latest commit at front
+        self.committed_value_list = [init_value]  # latest commit at end
+        # commit timestamps of committed_value_list, for binary search
+        self.commit_ts_list = [init_value.commit_ts]
         self.temp_value = None
-        self.is_replicated = is_replicated  # even indexed are replicated
+        self.is_replicated = is_replicated  # stored at several sites
         self.is_readable = True  # replicated var not readable at site recovery
 
     def get_last_committed_value(self):
         """
         :return: the latest committed value
         """
-        return self.committed_value_list[0].value
+        return self.committed_value_list[-1].value
 
-    def get_temp_value(self):
+    def get_temp_value(self, transaction_id):
         """
-        :return: the temporary value written by a transaction holding a W-lock
+        :param transaction_id: the id of the transaction holding the W-lock
+        :return: the temporary value written by the transaction, or the latest
+         committed value if its write has not reached this site (its W-lock
+         was granted while the write waited for other sites, or the site was
+         down when it wrote)
         """
-        if not self.temp_value:
-            raise RuntimeError("No temp value!")
-        return self.temp_value.value
+        if self.temp_value and \
+                self.temp_value.transaction_id == transaction_id:
+            return self.temp_value.value
+        return self.get_last_committed_value()
 
     def add_commit_value(self, commit_value):
         """
-        Insert a CommitValue object to the front of the committed value list.
+        Append a CommitValue object to the end of the committed value list.
+        Commits arrive in timestamp order, so the list stays sorted.
         :param commit_value: a CommitValue object
         """
-        self.committed_value_list.insert(0, commit_value)
+        if commit_value.commit_ts < self.commit_ts_list[-1]:
+            raise RuntimeError("Commit timestamps must not decrease!")
+        self.committed_value_list.append(commit_value)
+        self.commit_ts_list.append(commit_value.commit_ts)
+
+    def prune_versions(self, horizon_ts):
+        """
+        Drop the versions older than the latest commit at or before a
+        timestamp; no transaction can read them any more.
+        :param horizon_ts: begin time of the oldest active read-only
+         transaction, or the current time if there is none
+        :return: the number of versions dropped
+        """
+        idx = bisect_right(self.commit_ts_list, horizon_ts) - 1
+        if idx > 0:
+            del self.committed_value_list[:idx]
+            del self.commit_ts_list[:idx]
+            return idx
+        return 0
+
+    def get_commit_value_at(self, ts):
+        """
+        Find the latest commit at or before a timestamp by binary search.
+        :param ts: the timestamp
+        :return: a CommitValue object, or None if committed after ts only
+        """
+        idx = bisect_right(self.commit_ts_list, ts)
+        if not idx:
+            return None
+        return self.committed_value_list[idx - 1]
 
 
 class Result:
     """Helper class that stores the result of a read or write action."""
 
+    __slots__ = ("success", "value")
+
     def __init__(self, success, value=None):
         """
         Initialize a Result instance.
@@ -77,6 +126,10 @@ class Result:
         self.value = value
 
 
+# Shared result of every failed read, never modified
+FAILED_RESULT = Result(False)
+
+
 class LockType(Enum):
     R = 1
     W = 2
@@ -85,6 +138,9 @@ class LockType(Enum):
 class ReadLock:
     """Represents a current Read lock."""
 
+    __slots__ = ("variable_id", "transaction_id_set")
+    lock_type = LockType.R
+
     def __init__(self, variable_id, transaction_id):
         """
         Initialize a ReadLock instance.
@@ -94,7 +150,6 @@ class ReadLock:
         self.variable_id = variable_id
         # multiple transactions could share a R-lock
         self.transaction_id_set = {transaction_id}
-        self.lock_type = LockType.R
 
     def __repr__(self):
         """Custom print for debugging purpose."""
@@ -105,6 +160,9 @@ class ReadLock:
 class WriteLock:
     """Represents a current Write lock."""
 
+    __slots__ = ("variable_id", "transaction_id")
+    lock_type = LockType.W
+
     def __init__(self, variable_id, transaction_id):
         """
         Initialize a WriteLock instance.
@@ -113,7 +171,6 @@ class WriteLock:
         """
         self.variable_id = variable_id
         self.transaction_id = transaction_id
-        self.lock_type = LockType.W
 
     def __repr__(self):
         """Custom print for debugging purpose."""
@@ -124,6 +181,8 @@ class WriteLock:
 class QueuedLock:
     """Represents a lock in queue."""
 
+    __slots__ = ("variable_id", "transaction_id", "lock_type", "is_removed")
+
     def __init__(self, variable_id, transaction_id, lock_type: LockType):
         """
         Initialize a QueuedLock instance.
@@ -134,6 +193,7 @@ class QueuedLock:
         self.variable_id = variable_id
         self.transaction_id = transaction_id
         self.lock_type = lock_type  # Q-lock could be either read or write
+        self.is_removed = False  # tombstone, left in the queue until popped
 
     def __repr__(self):
         """Custom print for debugging purpose."""
@@ -141,9 +201,127 @@ class QueuedLock:
             self.transaction_id, self.variable_id, self.lock_type)
 
 
+class LockQueue:
+    """
+    FIFO queue of the QueuedLocks of a variable. A transaction has at most
+    one queued lock of each type, found by its id, and the queued W-locks
+    are counted, so that looking a lock up, adding it, removing it and
+    granting the first one are O(1) amortized. Removed locks are marked as
+    tombstones and skipped, and the deque is compacted when they outnumber
+    the queued locks.
+    """
+
+    __slots__ = ("entries", "locks_by_transaction", "num_live",
+                 "num_write_locks")
+
+    def __init__(self):
+        """
+        Initialize an empty LockQueue instance.
+        """
+        self.entries = deque()  # QueuedLocks and tombstones, in FIFO order
+        # {transaction_id: {LockType: QueuedLock}}
+        self.locks_by_transaction = {}
+        self.num_live = 0
+        self.num_write_locks = 0
+
+    def __len__(self):
+        return self.num_live
+
+    def __iter__(self):
+        """Iterate over the queued locks in FIFO order."""
+        return (ql for ql in self.entries if not ql.is_removed)
+
+    def __repr__(self):
+        """Custom print for debugging purpose."""
+        return repr(list(self))
+
+    def get(self, transaction_id, lock_type):
+        """
+        :return: the QueuedLock of this type of the transaction, or None
+        """
+        locks = self.locks_by_transaction.get(transaction_id)
+        return locks.get(lock_type) if locks else None
+
+    def has_transaction(self, transaction_id):
+        """
+        :return: boolean value to indicate if the transaction has queued locks
+        """
+        return transaction_id in self.locks_by_transaction
+
+    def append(self, queued_lock):
+        """
+        :param queued_lock: a QueuedLock, the transaction must not have one
+         of the same type queued
+        """
+        self.entries.append(queued_lock)
+        self.locks_by_transaction.setdefault(
+            queued_lock.transaction_id, {})[queued_lock.lock_type] = \
+            queued_lock
+        self.num_live += 1
+        if queued_lock.lock_type == LockType.W:
+            self.num_write_locks += 1
+
+    def first(self):
+        """
+        :return: the first QueuedLock, or None if the queue is empty
+        """
+        entries = self.entries
+        while entries and entries[0].is_removed:
+            entries.popleft()
+        return entries[0] if entries else None
+
+    def popleft(self):
+        """
+        Remove the first QueuedLock.
+        :return: the QueuedLock
+        """
+        queued_lock = self.first()
+        if queued_lock is None:
+            raise IndexError("pop from an empty LockQueue")
+        self.entries.popleft()
+        self.unindex(queued_lock)
+        return queued_lock
+
+    def remove(self, queued_lock):
+        """
+        Remove a QueuedLock of the queue, leaving a tombstone.
+        :param queued_lock: the QueuedLock
+        """
+        queued_lock.is_removed = True
+        self.unindex(queued_lock)
+        if len(self.entries) > 2 * self.num_live + 8:
+            self.entries = deque(ql for ql in self.entries
+                                 if not ql.is_removed)
+
+    def remove_transaction(self, transaction_id):
+        """
+        Remove all the QueuedLocks of a transaction.
+        :param transaction_id: the id of the transaction
+        :return: boolean value to indicate if any lock is removed
+        """
+        locks = self.locks_by_transaction.get(transaction_id)
+        if not locks:
+            return False
+        for queued_lock in list(locks.values()):
+            self.remove(queued_lock)
+        return True
+
+    def unindex(self, queued_lock):
+        """Forget a QueuedLock that has left the queue."""
+        locks = self.locks_by_transaction[queued_lock.transaction_id]
+        del locks[queued_lock.lock_type]
+        if not locks:
+            del self.locks_by_transaction[queued_lock.transaction_id]
+        self.num_live -= 1
+        if queued_lock.lock_type == LockType.W:
+            self.num_write_locks -= 1
+
+
 class LockManager:
     """Manages both current lock and queued locks of a certain variable."""
 
+    __slots__ = ("variable_id", "current_lock", "queue")
+
     def __init__(self, variable_id):
         """
         Initialize a LockManager instance.
@@ -151,12 +329,12 @@ class LockManager:
         """
         self.variable_id = variable_id
         self.current_lock = None
-        self.queue = []  # list of QueuedLock
+        self.queue = LockQueue()
 
     def clear(self):
         """Clean up both current lock and lock queue."""
         self.current_lock = None
-        self.queue = []
+        self.queue = LockQueue()
 
     def set_current_lock(self, lock):
         """
@@ -195,15 +373,29 @@ class LockManager:
         """
         Add a new QueuedLock into lock queue.
         :param new_lock: the new QueuedLock
+        :return: boolean value to indicate if the lock is added to the queue
         """
-        for queued_lock in self.queue:
-            if queued_lock.transaction_id == new_lock.transaction_id:
-                # transaction holds the same type of lock or the new lock is
-                # a R-lock when already had locks in queue
-                if queued_lock.lock_type == new_lock.lock_type or \
-                        new_lock.lock_type == LockType.R:
-                    return
+        if self.queue.has_transaction(new_lock.transaction_id):
+            # transaction holds the same type of lock or the new lock is
+            # a R-lock when already had locks in queue
+            if new_lock.lock_type == LockType.R or self.queue.get(
+                    new_lock.transaction_id, new_lock.lock_type):
+                return False
         self.queue.append(new_lock)
+        return True
+
+    def remove_from_queue(self, transaction_id, lock_type):
+        """
+        Withdraw a QueuedLock of a transaction from the lock queue.
+        :param transaction_id: the id of the transaction
+        :param lock_type: either R or W type
+        :return: boolean value to indicate if a lock is removed
+        """
+        queued_lock = self.queue.get(transaction_id, lock_type)
+        if queued_lock is None:
+            return False
+        self.queue.remove(queued_lock)
+        return True
 
     def has_other_queued_write_lock(self, transaction_id=None):
         """
@@ -212,58 +404,209 @@ class LockManager:
          this transaction will be ignored.
         :return: boolean value to indicate if existing queued W-lock
         """
-        for queued_lock in self.queue:
-            if queued_lock.lock_type == LockType.W:
-                if transaction_id and \
-                        queued_lock.transaction_id == transaction_id:
-                    continue
-                return True
-        return False
+        num_write_locks = self.queue.num_write_locks
+        if transaction_id and self.queue.get(transaction_id, LockType.W):
+            num_write_locks -= 1
+        return num_write_locks > 0
 
     def release_current_lock_by_transaction(self, transaction_id):
         """
         Release the current lock held by a transaction.
         :param transaction_id: the id of the transaction
+        :return: boolean value to indicate if the current lock has changed
         """
         if self.current_lock:
             if self.current_lock.lock_type == LockType.R:
                 # current lock is R-lock
                 if transaction_id in self.current_lock.transaction_id_set:
                     self.current_lock.transaction_id_set.remove(transaction_id)
-                if not len(self.current_lock.transaction_id_set):
-                    # release when no other transaction holding R-lock
-                    self.current_lock = None
+                    if not len(self.current_lock.transaction_id_set):
+                        # release when no other transaction holding R-lock
+                        self.current_lock = None
+                    return True
             else:
                 # current lock is W-lock
                 if self.current_lock.transaction_id == transaction_id:
                     self.current_lock = None
+                    return True
+        return False
+
+    def blocking_edges(self):
+        """
+        Generate the edges of the blocking graph caused by this variable: a
+        queued lock waits for the current lock and for the conflicting locks
+        queued ahead of it.
+        :return: set of (waiting transaction's id, blocking transaction's id)
+        """
+        edges = set()
+        if not self.current_lock or not self.queue:
+            return edges
+        current_lock = self.current_lock
+        if current_lock.lock_type == LockType.R:
+            holders = current_lock.transaction_id_set
+        else:
+            holders = {current_lock.transaction_id}
+        queued_ahead = set()  # transactions queued ahead
+        queued_ahead_w = set()  # transactions with W-lock queued ahead
+        for ql in self.queue:
+            waiter = ql.transaction_id
+            if ql.lock_type == LockType.W:
+                # W-lock is blocked by any current lock, except an R-lock
+                # held by itself only
+                if not (current_lock.lock_type == LockType.R and
+                        holders == {waiter}):
+                    edges.update((waiter, t_id) for t_id in holders
+                                 if t_id != waiter)
+                # and by any lock queued ahead
+                edges.update((waiter, t_id) for t_id in queued_ahead
+                             if t_id != waiter)
+                queued_ahead_w.add(waiter)
+            else:
+                # R-lock is blocked by current W-lock and queued W-locks
+                if current_lock.lock_type == LockType.W and \
+                        current_lock.transaction_id != waiter:
+                    edges.add((waiter, current_lock.transaction_id))
+                edges.update((waiter, t_id) for t_id in queued_ahead_w
+                             if t_id != waiter)
+            queued_ahead.add(waiter)
+        return edges
+
+
+class FailureHistory:
+    """
+    Failure and recovery times of a site. Both lists are appended in time
+    order, so they are sorted and can be searched by bisection.
+    """
+
+    __slots__ = ("fail_ts_list", "recover_ts_list")
+
+    def __init__(self):
+        """
+        Initialize an empty FailureHistory instance.
+        """
+        self.fail_ts_list = []  # latest fail at end
+        self.recover_ts_list = []  # latest recover at end
+
+    def has_recovered(self):
+        """
+        :return: boolean value to indicate if the site has ever recovered
+        """
+        return bool(self.recover_ts_list)
+
+    def failed_between(self, start_ts, end_ts):
+        """
+        Check if the site failed in the interval (start_ts, end_ts].
+        :param start_ts: start of the interval (excluded)
+        :param end_ts: end of the interval (included)
+        :return: boolean value to indicate if there is a failure in between
+        """
+        idx = bisect_right(self.fail_ts_list, start_ts)
+        return idx < len(self.fail_ts_list) and \
+            self.fail_ts_list[idx] <= end_ts
+
+
+class TransactionLocks:
+    """
+    Index of what a transaction has touched at one site, so that committing
+    or aborting it only visits those variables.
+    """
+
+    __slots__ = ("held", "queued", "written")
+
+    def __init__(self):
+        """
+        Initialize an empty TransactionLocks instance.
+        """
+        self.held = set()  # variables with a current lock held
+        self.queued = set()  # variables with a lock queued (maybe granted)
+        self.written = set()  # variables with a temp value written
+
+    def variables(self):
+        """
+        :return: set of all variables touched by the transaction
+        """
+        return self.held | self.queued | self.written
 
 
 class DataManager:
     """One for each site."""
 
-    def __init__(self, site_id):
+    def __init__(self, site_id, listener=None, topology=None, wal=None):
         """
         Initialize a DataManager instance.
         :param site_id: the id of the site managed by this data manager
+        :param listener: object notified when the state of a variable or of
+         the whole site changes, or when a transaction has to wait for a lock
+         (optional), see `notify_variable_change` and `queue_lock`
+        :param topology: the Topology of the cluster (default layout if None)
+        :param wal: the WriteAheadLog of the site (optional); with a log, a
+         failure loses the variables in memory and recovery replays the log
         """
         self.site_id = site_id  # int type
+        self.listener = listener
+        self.topology = topology or Topology()
+        self.wal = wal
         self.is_up = True
-        self.data = {}  # store each variable
-        self.lock_table = {}  # store lock manager for each variable
-        self.fail_ts_list = []  # latest fail at end
-        self.recover_ts_list = []  # latest recover at end
+        # Variables and lock managers are created on first access, and idle
+        # lock managers are dropped, so memory follows the working set.
+        self.data = {}  # store each accessed variable
+        self.lock_table = {}  # store lock manager for each locked variable
+        self.transaction_locks = {}  # {transaction_id: TransactionLocks}
+        self.history = FailureHistory()  # failure and recovery times
+        # replicated variables created on first access are readable, until
+        # the site recovers (and again once it has caught up)
+        self.is_default_readable = True
+        self.versions_reclaimed = 0  # versions dropped by garbage collection
+        self.reads_served = 0  # successful reads, counted by the TM
 
-        for v_idx in range(1, 21):
-            variable_id = "x" + str(v_idx)
-            if v_idx % 2 == 0:  # replicated (even)
-                self.data[variable_id] = Variable(
-                    variable_id, CommitValue(v_idx * 10, 0), True)
-                self.lock_table[variable_id] = LockManager(variable_id)
-            elif v_idx % 10 + 1 == self.site_id:  # non-replicated (odd)
-                self.data[variable_id] = Variable(
-                    variable_id, CommitValue(v_idx * 10, 0), False)
-                self.lock_table[variable_id] = LockManager(variable_id)
+    def __getstate__(self):
+        """
+        State saved by a checkpoint, see `profiler.unwrapped_state`.
+        """
+        return unwrapped_state(self)
+
+    def notify_variable_change(self, variable_id):
+        """
+        Tell the listener that the locks or the values of a variable have
+        changed, so operations blocked on it may succeed now.
+        :param variable_id: variable's id
+        """
+        if self.listener:
+            self.listener.on_variable_change(self.site_id, variable_id)
+
+    def notify_site_change(self):
+        """
+        Tell the listener that the status of the whole site has changed.
+        """
+        if self.listener:
+            self.listener.on_site_change(self.site_id)
+
+    def get_transaction_locks(self, transaction_id):
+        """
+        :param transaction_id: transaction's id
+        :return: the TransactionLocks of a transaction, created if needed
+        """
+        t_locks = self.transaction_locks.get(transaction_id)
+        if not t_locks:
+            t_locks = TransactionLocks()
+            self.transaction_locks[transaction_id] = t_locks
+        return t_locks
+
+    def queue_lock(self, lm, transaction_id, lock_type):
+        """
+        Add a lock request of a transaction to the lock queue of a variable.
+        :param lm: the LockManager of the variable
+        :param transaction_id: transaction's id
+        :param lock_type: either R or W type
+        """
+        if lm.add_to_queue(
+                QueuedLock(lm.variable_id, transaction_id, lock_type)):
+            self.get_transaction_locks(transaction_id).queued.add(
+                lm.variable_id)
+            # a new waiter can change how the blocked operations are retried
+            self.notify_variable_change(lm.variable_id)
+            if self.listener:
+                self.listener.on_lock_queued(self.site_id, lm, transaction_id)
 
     def has_variable(self, variable_id):
         """
@@ -271,7 +614,43 @@ class DataManager:
         :param variable_id: variable's id
         :return: boolean value to indicate if a variable is stored at this site
         """
-        return self.data.get(variable_id)
+        if variable_id in self.data:
+            return True
+        v_idx = self.topology.variable_index(variable_id)
+        return v_idx is not None and \
+            self.topology.is_stored_at(v_idx, self.site_id)
+
+    def get_variable(self, variable_id):
+        """
+        Get a variable stored at this site, creating it with its initial value
+        on first access.
+        :param variable_id: variable's id
+        :return: the Variable
+        """
+        v = self.data.get(variable_id)
+        if not v:
+            v_idx = self.topology.variable_index(variable_id)
+            is_replicated = self.topology.is_replicated(v_idx)
+            v = Variable(variable_id,
+                         CommitValue(self.topology.initial_value(v_idx), 0),
+                         is_replicated)
+            if is_replicated and not self.is_default_readable:
+                # not written since the site recovered
+                v.is_readable = False
+            self.data[variable_id] = v
+        return v
+
+    def get_lock_manager(self, variable_id):
+        """
+        Get the lock manager of a variable, creating it if it is idle.
+        :param variable_id: variable's id
+        :return: the LockManager
+        """
+        lm = self.lock_table.get(variable_id)
+        if not lm:
+            lm = LockManager(variable_id)
+            self.lock_table[variable_id] = lm
+        return lm
 
     def read_snapshot(self, variable_id, ts):
         """
@@ -281,20 +660,19 @@ class DataManager:
         :param ts: the beginning time of the read-only transaction
         :return: the result of the read action
         """
-        v: Variable = self.data[variable_id]
+        v: Variable = self.get_variable(variable_id)
         if v.is_readable:
-            for commit_value in v.committed_value_list:
-                # find the latest commit value before the transaction's begin
-                if commit_value.commit_ts <= ts:
-                    # only replicated variables need to be handled
-                    if v.is_replicated:
-                        for fail_ts in self.fail_ts_list:
-                            # if the site has failed after the commit and
-                            # before the transaction begins
-                            if commit_value.commit_ts < fail_ts <= ts:
-                                return Result(False)
-                    return Result(True, commit_value.value)
-        return Result(False)
+            # find the latest commit value before the transaction's begin
+            commit_value = v.get_commit_value_at(ts)
+            if commit_value:
+                # only replicated variables need to be handled:
+                # if the site has failed after the commit and before the
+                # transaction begins
+                if v.is_replicated and \
+                        self.history.failed_between(commit_value.commit_ts, ts):
+                    return FAILED_RESULT
+                return Result(True, commit_value.value)
+        return FAILED_RESULT
 
     def read(self, transaction_id, variable_id):
         """
@@ -303,9 +681,9 @@ class DataManager:
         :param variable_id: variable's id
         :return: the result of the read action
         """
-        v: Variable = self.data[variable_id]
+        v: Variable = self.get_variable(variable_id)
         if v.is_readable:  # avoid the revovery case
-            lm: LockManager = self.lock_table[variable_id]
+            lm: LockManager = self.get_lock_manager(variable_id)
             current_lock = lm.current_lock
             if current_lock:
                 if current_lock.lock_type == LockType.R:
@@ -313,25 +691,63 @@ class DataManager:
                         return Result(True, v.get_last_committed_value())
                     if not lm.has_other_queued_write_lock():
                         lm.share_read_lock(transaction_id)
+                        self.get_transaction_locks(transaction_id).held.add(
+                            variable_id)
+                        self.notify_variable_change(variable_id)
                         return Result(True, v.get_last_committed_value())
                     # There is a queued W-lock
-                    lm.add_to_queue(
-                        QueuedLock(variable_id, transaction_id, LockType.R))
-                    return Result(False)
+                    self.queue_lock(lm, transaction_id, LockType.R)
+                    return FAILED_RESULT
                 # current_lock is W-lock
                 if transaction_id == current_lock.transaction_id:
                     # This transaction holds a W-lock
-                    # It has written to the variable
+                    # It may have written to the variable
                     # but the new value is not committed yet
-                    return Result(True, v.get_temp_value())
+                    return Result(True, v.get_temp_value(transaction_id))
                 # Another transaction is holding a W-lock
-                lm.add_to_queue(
-                    QueuedLock(variable_id, transaction_id, LockType.R))
-                return Result(False)
+                self.queue_lock(lm, transaction_id, LockType.R)
+                return FAILED_RESULT
             # No existing lock on the variable, create one
             lm.set_current_lock(ReadLock(variable_id, transaction_id))
+            self.get_transaction_locks(transaction_id).held.add(variable_id)
+            self.notify_variable_change(variable_id)
             return Result(True, v.get_last_committed_value())
-        return Result(False)
+        return FAILED_RESULT
+
+    def count_queued_locks(self, variable_id):
+        """
+        :param variable_id: variable's id
+        :return: the number of locks queued on the variable at this site
+        """
+        lm = self.lock_table.get(variable_id)
+        return len(lm.queue) if lm else 0
+
+    def has_queued_locks(self, transaction_id):
+        """
+        :param transaction_id: transaction's id
+        :return: boolean value to indicate if the transaction waits in the
+         lock queue of a variable at this site
+        """
+        t_locks = self.transaction_locks.get(transaction_id)
+        if not t_locks:
+            return False
+        for variable_id in t_locks.queued:
+            lm = self.lock_table.get(variable_id)
+            if lm and lm.queue.has_transaction(transaction_id):
+                return True
+        return False
+
+    def withdraw_read(self, transaction_id, variable_id):
+        """
+        Withdraw the queued R-lock of a transaction that has read the variable
+        at another site, so that it does not wait here any more.
+        :param transaction_id: transaction's id
+        :param variable_id: variable's id
+        """
+        lm = self.lock_table.get(variable_id)
+        if lm and lm.remove_from_queue(transaction_id, LockType.R):
+            self.resolve_lock_table([variable_id])
+            self.notify_variable_change(variable_id)
 
     def get_write_lock(self, transaction_id, variable_id):
         """
@@ -341,14 +757,16 @@ class DataManager:
         :param variable_id: variable's id
         :return: boolean value to indicate if current W-lock can be acquired
         """
-        lm: LockManager = self.lock_table[variable_id]
+        lm: LockManager = self.lock_table.get(variable_id)
+        if not lm:
+            # No existing lock on the variable
+            return True
         current_lock = lm.current_lock
         if current_lock:
             if current_lock.lock_type == LockType.R:
                 if len(current_lock.transaction_id_set) != 1:
                     # Multiple transactions holding R-lock on the same variable
-                    lm.add_to_queue(
-                        QueuedLock(variable_id, transaction_id, LockType.W))
+                    self.queue_lock(lm, transaction_id, LockType.W)
                     return False
                 # Only one transaction holding an R-lock
                 # Which one?
@@ -356,21 +774,18 @@ class DataManager:
                     # Only this transaction holds the R-lock
                     # Can it be promoted to W-lock?
                     if lm.has_other_queued_write_lock(transaction_id):
-                        lm.add_to_queue(
-                            QueuedLock(variable_id, transaction_id, LockType.W))
+                        self.queue_lock(lm, transaction_id, LockType.W)
                         return False
                     return True
                 # One other transaction is holding the R-lock
-                lm.add_to_queue(
-                    QueuedLock(variable_id, transaction_id, LockType.W))
+                self.queue_lock(lm, transaction_id, LockType.W)
                 return False
             # current lock is W-lock
             if transaction_id == current_lock.transaction_id:
                 # This transaction already holds a W-lock
                 return True
             # Another transaction is holding W-lock
-            lm.add_to_queue(
-                QueuedLock(variable_id, transaction_id, LockType.W))
+            self.queue_lock(lm, transaction_id, LockType.W)
             return False
         # No existing lock on the variable
         return True
@@ -382,8 +797,9 @@ class DataManager:
         :param variable_id: variable's id
         :param value: the value to be written
         """
-        v: Variable = self.data[variable_id]
-        lm: LockManager = self.lock_table[variable_id]
+        v: Variable = self.get_variable(variable_id)
+        lm: LockManager = self.get_lock_manager(variable_id)
+        t_locks = self.get_transaction_locks(transaction_id)
         current_lock = lm.current_lock
         if current_lock:
             if current_lock.lock_type == LockType.R:
@@ -397,6 +813,8 @@ class DataManager:
                     lm.promote_current_lock(
                         WriteLock(variable_id, transaction_id))
                     v.temp_value = TempValue(value, transaction_id)
+                    t_locks.written.add(variable_id)
+                    self.notify_variable_change(variable_id)
                     return
                 raise RuntimeError("Cannot promote to W-Lock: "
                                    "R-lock is not held by this transaction!")
@@ -404,6 +822,7 @@ class DataManager:
             if transaction_id == current_lock.transaction_id:
                 # This transaction already holds a W-lock
                 v.temp_value = TempValue(value, transaction_id)
+                t_locks.written.add(variable_id)
                 return
             # Another transaction is holding W-lock
             raise RuntimeError("Cannot get W-Lock: "
@@ -411,84 +830,129 @@ class DataManager:
         # No existing lock on the variable
         lm.set_current_lock(WriteLock(variable_id, transaction_id))
         v.temp_value = TempValue(value, transaction_id)
+        t_locks.held.add(variable_id)
+        t_locks.written.add(variable_id)
+        self.notify_variable_change(variable_id)
 
     def dump(self):
         """
-        Output the current status of the site, and the committed values of all
+        Get the current status of the site, and the committed values of all
         variables in ascending order by variable name.
+        :return: tuple (site_id, is_up, [(variable_id, value), ...])
         """
-        # if self.is_up:
-        #     print("Site {} [UP]:".format(self.site_id))
-        # else:
-        #     print("Site {} [DOWN]:".format(self.site_id))
-
-        # replicated = ""
-        # non_replicated = ""
-        # for v in self.data.values():
-        #     v_str = "{}: {}, ".format(v.variable_id,
-        #                               v.get_last_committed_value())
-        #     if v.is_replicated:
-        #         replicated += v_str
-        #     else:
-        #         non_replicated += v_str
-        # print("     " + replicated)
-        # if non_replicated:
-        #     print("     " + non_replicated)
-        site_status = "UP" if self.is_up else "DOWN"
-        output = "Site {} [{}] - ".format(self.site_id, site_status)
-        for v in self.data.values():
-            v_str = "{}: {}, ".format(v.variable_id,
-                                      v.get_last_committed_value())
-            output += v_str
-        print(output)
+        values = []
+        # the memory of a failed site is lost, its values are in the log
+        logged_values = self.wal.latest_values() \
+            if self.wal and not self.is_up else {}
+        for v_idx in self.topology.variables_at_site(self.site_id):
+            variable_id = "x" + str(v_idx)
+            v = self.data.get(variable_id)
+            if v:
+                value = v.get_last_committed_value()
+            elif variable_id in logged_values:
+                value = logged_values[variable_id]
+            else:
+                value = self.topology.initial_value(v_idx)
+            values.append((variable_id, value))
+        return self.site_id, self.is_up, values
 
     def abort(self, transaction_id):
         """
         Abort the transaction and release its locks.
         :param transaction_id: transaction's id
         """
-        for lm in self.lock_table.values():
+        t_locks = self.transaction_locks.pop(transaction_id, None)
+        if not t_locks:
+            return
+        touched_variables = sorted(t_locks.held | t_locks.queued)
+        changed_variables = []
+        for variable_id in touched_variables:
+            lm = self.lock_table.get(variable_id)
+            if not lm:
+                continue
             # release current lock held by this transaction
-            lm.release_current_lock_by_transaction(transaction_id)
+            changed = lm.release_current_lock_by_transaction(transaction_id)
             # remove queued locks of this transaction
-            for ql in list(lm.queue):
-                if ql.transaction_id == transaction_id:
-                    lm.queue.remove(ql)
-        self.resolve_lock_table()
+            if lm.queue.remove_transaction(transaction_id):
+                changed = True
+            if changed:
+                changed_variables.append(variable_id)
+        self.resolve_lock_table(touched_variables)
+        for variable_id in changed_variables:
+            self.notify_variable_change(variable_id)
 
-    def commit(self, transaction_id, commit_ts):
+    def commit(self, transaction_id, commit_ts, gc_horizon_ts=None):
         """
         Commit a transaction and release its locks.
         :param transaction_id: transaction's id
         :param commit_ts: the timestamp of the commit
+        :param gc_horizon_ts: if provided, drop the versions of the written
+         variables that are older than this horizon (see `prune_versions`)
         """
-        for lm in self.lock_table.values():
+        # there shouldn't be any queued locks of this transaction; check
+        # before releasing anything, so that a failed commit changes nothing
+        if self.has_queued_locks(transaction_id):
+            raise RuntimeError(
+                "{} cannot commit with unresolved queued locks!".format(
+                    transaction_id))
+        t_locks = self.transaction_locks.pop(transaction_id, None)
+        if not t_locks:
+            return
+        touched_variables = sorted(t_locks.held | t_locks.queued)
+        changed_variables = []
+        for variable_id in touched_variables:
+            lm = self.lock_table.get(variable_id)
+            if not lm:
+                continue
             # release current lock held by this transaction
-            lm.release_current_lock_by_transaction(transaction_id)
-            # there shouldn't be any queued locks of this transaction
-            # print(lm.queue)
-            for ql in list(lm.queue):
-                if ql.transaction_id == transaction_id:
-                    raise RuntimeError(
-                        "{} cannot commit with unresolved queued locks!".format(
-                            transaction_id))
-        # commit temp values
-        for v in self.data.values():
+            if lm.release_current_lock_by_transaction(transaction_id):
+                changed_variables.append(variable_id)
+        # temp values written by this transaction
+        written_variables = []
+        for variable_id in sorted(t_locks.written):
+            v = self.data[variable_id]
             if v.temp_value and v.temp_value.transaction_id == transaction_id:
-                v.add_commit_value(CommitValue(v.temp_value.value, commit_ts))
-                v.is_readable = True
-        self.resolve_lock_table()
+                written_variables.append(v)
+        if self.wal and written_variables:
+            # log the commit before applying it
+            self.wal.append_commit(
+                commit_ts, [(v.variable_id, v.temp_value.value)
+                            for v in written_variables])
+        # commit temp values
+        for v in written_variables:
+            v.add_commit_value(CommitValue(v.temp_value.value, commit_ts))
+            v.is_readable = True
+            changed_variables.append(v.variable_id)
+            if gc_horizon_ts is not None:
+                self.versions_reclaimed += v.prune_versions(gc_horizon_ts)
+        self.resolve_lock_table(touched_variables)
+        for variable_id in changed_variables:
+            self.notify_variable_change(variable_id)
 
-    def resolve_lock_table(self):
+    def resolve_lock_table(self, variable_ids=None):
         """
         Check the lock table and move queued locks ahead if necessary.
+        Lock managers left without any lock are dropped.
+        :param variable_ids: only check the lock managers of these variables
+         (optional), used after the locks of a transaction are released
         """
-        for v, lm in self.lock_table.items():
+        if variable_ids is None:
+            variable_ids = list(self.lock_table)
+        for v in variable_ids:
+            lm = self.lock_table.get(v)
+            if not lm:
+                continue
+            if not lm.current_lock and not lm.queue:
+                del self.lock_table[v]
+                continue
             if lm.queue:
+                queue_length = len(lm.queue)
                 if not lm.current_lock:
                     # current lock is None
                     # pop the first queued lock and add to
-                    first_ql = lm.queue.pop(0)
+                    first_ql = lm.queue.popleft()
+                    self.get_transaction_locks(
+                        first_ql.transaction_id).held.add(v)
                     if first_ql.lock_type == LockType.R:
                         lm.set_current_lock(ReadLock(
                             first_ql.variable_id, first_ql.transaction_id))
@@ -498,101 +962,137 @@ class DataManager:
                 if lm.current_lock.lock_type == LockType.R:
                     # current lock is R-lock
                     # share R-lock with leading R-queued-locks
-                    for ql in list(lm.queue):
+                    ql = lm.queue.first()
+                    while ql is not None:
                         if ql.lock_type == LockType.W:
                             if len(lm.current_lock.transaction_id_set) == 1 \
                                     and ql.transaction_id in \
                                     lm.current_lock.transaction_id_set:
                                 lm.promote_current_lock(WriteLock(
                                     ql.variable_id, ql.transaction_id))
-                                lm.queue.remove(ql)
+                                lm.queue.popleft()
                             break
                         lm.share_read_lock(ql.transaction_id)
-                        lm.queue.remove(ql)
+                        self.get_transaction_locks(
+                            ql.transaction_id).held.add(v)
+                        lm.queue.popleft()
+                        ql = lm.queue.first()
+                if len(lm.queue) != queue_length:
+                    # some queued locks have been granted
+                    self.notify_variable_change(v)
+
+    def collect_versions(self, horizon_ts):
+        """
+        Drop the versions of all variables older than the horizon.
+        :param horizon_ts: see `Variable.prune_versions`
+        :return: the number of versions dropped
+        """
+        reclaimed = 0
+        for v in self.data.values():
+            reclaimed += v.prune_versions(horizon_ts)
+        self.versions_reclaimed += reclaimed
+        return reclaimed
+
+    def count_versions(self):
+        """
+        :return: the number of committed versions retained at this site
+        """
+        return sum(len(v.committed_value_list) for v in self.data.values())
 
     def fail(self, ts):
         """
-        Set site status to down and clear the lock table.
+        Set site status to down and clear the lock table. With a log, the
+        variables in memory are lost too.
         :param ts: record the failure time
         """
         self.is_up = False
-        self.fail_ts_list.append(ts)
-        for lm in self.lock_table.values():
-            lm.clear()
+        self.history.fail_ts_list.append(ts)
+        self.lock_table = {}
+        self.transaction_locks.clear()
+        if self.wal:
+            # commits are reported as they execute, they must survive
+            self.wal.sync()
+            self.data = {}
+        self.notify_site_change()
 
-    def recover(self, ts):
+    def recover(self, ts, gc_horizon_ts=None):
         """
-        Set site status to up.
+        Set site status to up, replaying the log if there is one.
         Replicated variables do not respond to Read until a committed write
         takes place.
         :param ts: record the recovery time
+        :param gc_horizon_ts: see `replay_log`
         """
         self.is_up = True
-        self.recover_ts_list.append(ts)
+        self.history.recover_ts_list.append(ts)
+        if self.wal:
+            self.replay_log(gc_horizon_ts)
+        self.is_default_readable = False
         for v in self.data.values():
             if v.is_replicated:
                 v.is_readable = False  # only for replicated variables
+        self.notify_site_change()
 
-    def generate_blocking_graph(self):
+    def has_write_lock(self, variable_id):
         """
-        Generate the blocking graph for this site
-        :return: blocking graph
+        :param variable_id: variable's id
+        :return: boolean value to indicate if a transaction holds a W-lock on
+         the variable at this site
         """
+        lm = self.lock_table.get(variable_id)
+        return bool(lm and lm.current_lock and
+                    lm.current_lock.lock_type == LockType.W)
 
-        def current_blocks_queued(current_lock, queued_lock):
-            """
-            Check if the current lock is blocking a queued lock.
-            :param current_lock: current lock
-            :param queued_lock: a queued Lock
-            :return: boolean value to indicate if current blocks queued
-            """
-            if current_lock.lock_type == LockType.R:
-                if queued_lock.lock_type == LockType.R or \
-                        (len(current_lock.transaction_id_set) == 1 and
-                         queued_lock.transaction_id in
-                         current_lock.transaction_id_set):
-                    return False
-                return True
-            # current lock is W-lock
-            return not current_lock.transaction_id == queued_lock.transaction_id
-
-        def queued_blocks_queued(queued_lock_left, queued_lock_right):
-            """
-            Check if a queued lock is blocking another queued lock behind it.
-            :param queued_lock_left: a queued lock
-            :param queued_lock_right: another queued lock behind the first one
-            :return: boolean value to indicate if queued blocks queued
-            """
-            if queued_lock_left.lock_type == LockType.R and \
-                    queued_lock_right.lock_type == LockType.R:
-                return False
-            # at least one lock is W-lock
-            return not queued_lock_left.transaction_id == queued_lock_right.transaction_id
+    def get_catch_up_version(self, variable_id):
+        """
+        Get the latest committed version of a replicated variable, for a
+        recovering site to catch up from. The variable must be readable at
+        this site.
+        :param variable_id: variable's id
+        :return: a CommitValue object, or None if the variable is unreadable
+        """
+        v = self.data.get(variable_id)
+        if v:
+            return v.committed_value_list[-1] if v.is_readable else None
+        if not self.is_default_readable:
+            return None
+        # never written, still its initial value
+        v_idx = self.topology.variable_index(variable_id)
+        return CommitValue(self.topology.initial_value(v_idx), 0)
 
-        graph = defaultdict(set)
-        for variable_id, lm in self.lock_table.items():
-            if not lm.current_lock or not lm.queue:
-                continue
-            # print("current_lock: {}".format(lm.current_lock))
-            # print("queue: {}".format(lm.queue))
-            for ql in lm.queue:
-                if current_blocks_queued(lm.current_lock, ql):
-                    if lm.current_lock.lock_type == LockType.R:
-                        for t_id in lm.current_lock.transaction_id_set:
-                            if t_id != ql.transaction_id:
-                                graph[ql.transaction_id].add(t_id)
-                    else:
-                        if lm.current_lock.transaction_id != ql.transaction_id:
-                            graph[ql.transaction_id].add(
-                                lm.current_lock.transaction_id)
-            for i in range(len(lm.queue)):
-                for j in range(i):
-                    # print("queued_blocks_queued({}, {})".format(
-                    #     lm.queue[j], lm.queue[i]))
-                    if queued_blocks_queued(lm.queue[j], lm.queue[i]):
-                        # if lm.queue[j].transaction_id != lm.queue[i
-                        # ].transaction_id:
-                        graph[lm.queue[i].transaction_id].add(
-                            lm.queue[j].transaction_id)
-        # print("graph {}={}".format(self.site_id, dict(graph)))
-        return graph
+    def catch_up(self, versions, is_complete):
+        """
+        Install the latest committed versions of replicated variables copied
+        from other sites after a recovery, and make them readable.
+        :param versions: dict {variable_id: CommitValue}
+        :param is_complete: boolean value to indicate if all the replicated
+         variables of the site were caught up, so variables created later on
+         first access are readable too
+        """
+        for variable_id, commit_value in versions.items():
+            if is_complete and commit_value.commit_ts == 0 and \
+                    variable_id not in self.data:
+                continue  # created with its initial value on first access
+            v = self.get_variable(variable_id)
+            if commit_value.commit_ts > v.commit_ts_list[-1]:
+                v.add_commit_value(CommitValue(commit_value.value,
+                                               commit_value.commit_ts))
+            v.is_readable = True
+        if is_complete:
+            self.is_default_readable = True
+        self.notify_site_change()
+
+    def replay_log(self, gc_horizon_ts=None):
+        """
+        Rebuild the committed versions of the variables from the log, after
+        the failure lost them.
+        :param gc_horizon_ts: if provided, drop again the versions older than
+         this horizon (see `collect_versions`)
+        """
+        self.data = {}
+        for commit_ts, writes in self.wal.records():
+            for variable_id, value in writes:
+                self.get_variable(variable_id).add_commit_value(
+                    CommitValue(value, commit_ts))
+        if gc_horizon_ts is not None:
+            self.collect_versions(gc_horizon_ts)
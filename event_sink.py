@@ -0,0 +1,163 @@
+import json
+import sys
+
+# Fields of each event, in the order they are passed to `EventSink.emit`.
+EVENT_FIELDS = {
+    "message": ("text",),
+    "tick": ("ts",),
+    "invalid_instruction": ("message", "instruction"),
+    "invalid_operation": ("op_id",),
+    "begin": ("transaction_id",),
+    "begin_ro": ("transaction_id",),
+    "read": ("transaction_id", "variable_id", "site_id", "value"),
+    "read_snapshot": ("transaction_id", "variable_id", "site_id", "value"),
+    "write": ("transaction_id", "variable_id", "value", "site_ids"),
+    "commit": ("transaction_id",),
+    "abort": ("transaction_id", "reason"),
+    "deadlock": ("transaction_id",),
+    "fail": ("site_id",),
+    "recover": ("site_id",),
+    # variables: number of variables copied from source_site_ids; skipped:
+    # variables left unreadable; seconds: wall time of the transfer
+    "catch_up": ("site_id", "variables", "source_site_ids", "skipped",
+                 "seconds"),
+    # sites: list of (site_id, is_up, [(variable_id, value), ...])
+    "dump": ("sites",),
+}
+
+
+def format_dump(sites):
+    """
+    :param sites: list of (site_id, is_up, [(variable_id, value), ...])
+    :return: the text of a dump, one line per site
+    """
+    lines = ["Dump:"]
+    for site_id, is_up, values in sites:
+        lines.append("Site {} [{}] - {}".format(
+            site_id, "UP" if is_up else "DOWN",
+            "".join("{}: {}, ".format(variable_id, value)
+                    for variable_id, value in values)))
+    return "\n".join(lines)
+
+
+def format_catch_up(site_id, variables, source_site_ids, skipped, seconds):
+    """
+    :return: the text of a catch-up after a recovery (see EVENT_FIELDS)
+    """
+    text = "Site {} catches up {} variables from sites {} in {:.3f} ms".format(
+        site_id, variables, source_site_ids, 1e3 * seconds)
+    if skipped:
+        text += ", still unreadable: " + ", ".join(skipped)
+    return text
+
+
+# Text of each event, as printed by the simulation.
+TEXT_FORMATS = {
+    "message": "{}".format,
+    "tick": "----- Timestamp: {} -----".format,
+    "invalid_instruction": "[INVALID_INSTRUCTION] {}: {}".format,
+    "invalid_operation": lambda op_id: "Invalid operation!",
+    "begin": "{} begins".format,
+    "begin_ro": "{} begins and is read-only".format,
+    "read": "{} reads {}.{}: {}".format,
+    "read_snapshot": "{} (RO) reads {}.{}: {}".format,
+    "write": "{} writes {} with value {} to sites {}".format,
+    "commit": "{} commits!".format,
+    "abort": "{} aborts! (due to {})".format,
+    "deadlock": "Deadlock detected: aborting {}".format,
+    "fail": "Site {} fails".format,
+    "recover": "Site {} recovers".format,
+    "catch_up": format_catch_up,
+    "dump": format_dump,
+}
+
+
+class EventSink:
+    """
+    Receives the events of a simulation (see EVENT_FIELDS).
+    """
+
+    def emit(self, event, *values):
+        """
+        Handle one event.
+        :param event: the name of the event (e.g. "read")
+        :param values: the values of the event's fields
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """Write out any buffered output."""
+        pass
+
+    def close(self):
+        """Flush the sink. The sink is not used afterwards."""
+        self.flush()
+
+
+class NullSink(EventSink):
+    """Discards every event."""
+
+    def emit(self, event, *values):
+        pass
+
+
+class BufferedSink(EventSink):
+    """
+    Sink writing one line per event to a text stream, buffering up to
+    `buffer_size` lines between writes.
+    """
+
+    def __init__(self, stream=None, buffer_size=1024):
+        """
+        :param stream: text stream to write to (default: the current
+         standard output at the time of each write)
+        :param buffer_size: number of lines buffered before writing them, 0
+         to write every line right away
+        """
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.buffer = []
+
+    def format(self, event, values):
+        """
+        :return: the line of text of an event
+        """
+        raise NotImplementedError
+
+    def emit(self, event, *values):
+        self.buffer.append(self.format(event, values))
+        if len(self.buffer) > self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.append("")
+            stream = self.stream or sys.stdout
+            stream.write("\n".join(self.buffer))
+            self.buffer = []
+
+
+class TextSink(BufferedSink):
+    """Writes events as human readable text, the default output."""
+
+    def format(self, event, values):
+        return TEXT_FORMATS[event](*values)
+
+
+class JsonlSink(BufferedSink):
+    """Writes events as JSON objects, one per line."""
+
+    def format(self, event, values):
+        record = {"event": event}
+        for field, value in zip(EVENT_FIELDS[event], values):
+            record[field] = value
+        if event == "dump":
+            record["sites"] = [
+                {"site_id": site_id, "is_up": is_up,
+                 "values": dict(site_values)}
+                for site_id, is_up, site_values in record["sites"]]
+        return json.dumps(record)
+
+
+# sinks selectable by name, e.g. from the command line
+SINKS = {"text": TextSink, "jsonl": JsonlSink, "none": NullSink}
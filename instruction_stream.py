@@ -0,0 +1,294 @@
+import sys
+from parser import Parser
+from transaction_manager import InvalidInstructionError
+
+# Compiled instruction stream format:
+#   header: MAGIC
+#   record: one opcode byte followed by its arguments, each argument being
+#           an unsigned LEB128 varint.
+# Strings (transaction ids, variable ids, values and raw lines) are interned:
+# OP_STRING defines the next entry of the string table, and the other
+# records refer to strings by their index in the table.
+MAGIC = b"RCI\x01"
+
+OP_STRING = 0  # length, utf-8 bytes
+OP_BEGIN = 1  # transaction
+OP_BEGINRO = 2  # transaction
+OP_READ = 3  # transaction, variable
+OP_WRITE = 4  # transaction, variable, integer value
+OP_WRITE_STRING = 5  # transaction, variable, value
+OP_DUMP = 6
+OP_END = 7  # transaction
+OP_FAIL = 8  # site id
+OP_RECOVER = 9  # site id
+OP_RAW = 10  # line, replayed through `TransactionManager.process_line`
+
+CHUNK_SIZE = 1 << 16
+
+
+class InstructionStreamError(Exception):
+    """Error thrown when a compiled instruction stream is malformed."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def encode_varint(n, out):
+    """
+    Append an unsigned integer to a bytearray as a LEB128 varint.
+    :param n: a non-negative integer
+    :param out: the bytearray
+    """
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def parse_int(s):
+    """
+    :param s: a string
+    :return: the non-negative integer written as s, or None if converting it
+     back would not give s (e.g. "007")
+    """
+    try:
+        n = int(s)
+    except ValueError:
+        return None
+    if n < 0 or str(n) != s:
+        return None
+    return n
+
+
+class InstructionCompiler:
+    """
+    Compile lines of instructions into a binary instruction stream, one line
+    at a time. Lines that do not form a valid instruction are kept as raw
+    lines, so that replaying them reports the same errors.
+    """
+
+    def __init__(self, file):
+        """
+        Initialize an InstructionCompiler instance and write the header.
+        :param file: binary file to write the stream to
+        """
+        self.file = file
+        self.parser = Parser()
+        self.string_index = {}
+        self.buffer = bytearray(MAGIC)
+        self.num_instructions = 0
+
+    def intern(self, s):
+        """
+        :param s: a string
+        :return: the index of the string in the string table, defining it
+         first if needed
+        """
+        idx = self.string_index.get(s)
+        if idx is None:
+            idx = self.string_index[s] = len(self.string_index)
+            data = s.encode("utf-8")
+            self.buffer.append(OP_STRING)
+            encode_varint(len(data), self.buffer)
+            self.buffer += data
+        return idx
+
+    def compile_line(self, line):
+        """
+        Compile one line of input.
+        :param line: one line of instruction
+        :return: False if no more lines will be executed (the rest of the
+         input is debug info), True otherwise
+        """
+        li = self.parser.parse_line(line)
+        if self.parser.debug_info_below:
+            return False
+        if not li:
+            return True
+        command, args = li[0], li[1:]
+        record = self.compile_instruction(command, args)
+        if record is None:
+            record = [OP_RAW, self.intern(line)]
+        buffer = self.buffer
+        buffer.append(record[0])
+        for arg in record[1:]:
+            encode_varint(arg, buffer)
+        self.num_instructions += 1
+        if len(buffer) >= CHUNK_SIZE:
+            self.flush()
+        return True
+
+    def compile_instruction(self, command, args):
+        """
+        :param command: the command of the instruction
+        :param args: list of arguments of the instruction
+        :return: the opcode followed by its arguments, or None if the
+         instruction cannot be compiled
+        """
+        if command in ("begin", "beginRO", "end") and args:
+            opcode = {"begin": OP_BEGIN, "beginRO": OP_BEGINRO,
+                      "end": OP_END}[command]
+            return [opcode, self.intern(args[0])]
+        if command == "R" and len(args) >= 2:
+            return [OP_READ, self.intern(args[0]), self.intern(args[1])]
+        if command == "W" and len(args) >= 3:
+            value = parse_int(args[2])
+            if value is None:
+                return [OP_WRITE_STRING, self.intern(args[0]),
+                        self.intern(args[1]), self.intern(args[2])]
+            return [OP_WRITE, self.intern(args[0]), self.intern(args[1]),
+                    value]
+        if command == "dump":
+            return [OP_DUMP]
+        if command in ("fail", "recover") and args:
+            site_id = parse_int(args[0])
+            if site_id is not None:
+                return [OP_FAIL if command == "fail" else OP_RECOVER,
+                        site_id]
+        return None
+
+    def flush(self):
+        """Write the buffered records to the file."""
+        self.file.write(self.buffer)
+        self.buffer = bytearray()
+
+
+def compile_file(lines, file):
+    """
+    Compile lines of instructions into a binary instruction stream.
+    :param lines: iterable of lines of instructions
+    :param file: binary file to write the stream to
+    :return: the number of instructions compiled
+    """
+    compiler = InstructionCompiler(file)
+    for line in lines:
+        if not compiler.compile_line(line):
+            break
+    compiler.flush()
+    return compiler.num_instructions
+
+
+def read_instructions(file):
+    """
+    Decode a binary instruction stream, reading the file in chunks.
+    :param file: binary file to read the stream from
+    :return: generator of (opcode, arguments) tuples, with string arguments
+     resolved through the string table
+    """
+    data = file.read(CHUNK_SIZE)
+    if data[:len(MAGIC)] != MAGIC:
+        raise InstructionStreamError("Not a compiled instruction stream")
+    strings = []
+    pos = len(MAGIC)
+    end = len(data)
+    eof = False
+    while True:
+        if end - pos < CHUNK_SIZE // 2 and not eof:
+            # refill early enough that most records are complete in data
+            more = file.read(CHUNK_SIZE)
+            if more:
+                data = data[pos:] + more
+                end = len(data)
+                pos = 0
+            else:
+                eof = True
+        if pos == end:
+            return
+        start = pos
+        try:
+            opcode = data[pos]
+            pos += 1
+            values = []
+            num_args = ARITY[opcode]
+            while num_args:
+                n = data[pos]
+                pos += 1
+                if n >= 0x80:
+                    n &= 0x7f
+                    shift = 7
+                    while True:
+                        b = data[pos]
+                        pos += 1
+                        n |= (b & 0x7f) << shift
+                        if b < 0x80:
+                            break
+                        shift += 7
+                values.append(n)
+                num_args -= 1
+            if opcode == OP_STRING:
+                length = values[0]
+                if pos + length > end:
+                    raise IndexError
+                strings.append(sys.intern(
+                    data[pos:pos + length].decode("utf-8")))
+                pos += length
+                continue
+        except IndexError:
+            more = None if eof else file.read(CHUNK_SIZE)
+            if not more:
+                raise InstructionStreamError("Truncated instruction stream")
+            data = data[start:] + more
+            end = len(data)
+            pos = 0
+            continue
+        except KeyError:
+            raise InstructionStreamError(
+                "Unknown opcode {}".format(opcode))
+        if opcode == OP_WRITE:
+            yield opcode, (strings[values[0]], strings[values[1]],
+                           str(values[2]))
+        elif opcode in (OP_FAIL, OP_RECOVER):
+            yield opcode, (values[0],)
+        else:
+            yield opcode, tuple(strings[v] for v in values)
+
+
+# number of varint arguments of each opcode
+ARITY = {OP_STRING: 1, OP_BEGIN: 1, OP_BEGINRO: 1, OP_READ: 2, OP_WRITE: 3,
+         OP_WRITE_STRING: 3, OP_DUMP: 0, OP_END: 1, OP_FAIL: 1,
+         OP_RECOVER: 1, OP_RAW: 1}
+
+# text form of each opcode, for error messages
+INSTRUCTION_FORMATS = {OP_BEGIN: "begin({})", OP_BEGINRO: "beginRO({})",
+                       OP_READ: "R({},{})", OP_WRITE: "W({},{},{})",
+                       OP_WRITE_STRING: "W({},{},{})", OP_DUMP: "dump()",
+                       OP_END: "end({})", OP_FAIL: "fail({})",
+                       OP_RECOVER: "recover({})"}
+
+
+def replay(tm, file, skip=0, before_instruction=None):
+    """
+    Execute a binary instruction stream, without parsing any text.
+    Errors of invalid instructions are reported with the instruction in
+    its canonical text form (e.g. "R(T1,x2)").
+    :param tm: the TransactionManager
+    :param file: binary file to read the stream from
+    :param skip: number of instructions to decode without executing them,
+     e.g. when resuming from a checkpoint
+    :param before_instruction: function called with the number of
+     instructions consumed so far before executing each instruction
+     (optional)
+    :return: the number of instructions consumed
+    """
+    handlers = {OP_BEGIN: tm.begin, OP_BEGINRO: tm.beginro,
+                OP_READ: tm.add_read_operation,
+                OP_WRITE: tm.add_write_operation,
+                OP_WRITE_STRING: tm.add_write_operation, OP_DUMP: tm.dump,
+                OP_END: tm.end, OP_FAIL: tm.fail, OP_RECOVER: tm.recover}
+    count = 0
+    for opcode, args in read_instructions(file):
+        if count < skip:
+            count += 1
+            continue
+        if before_instruction:
+            before_instruction(count)
+        count += 1
+        if opcode == OP_RAW:
+            tm.process_line(args[0])
+            continue
+        try:
+            tm.tick(handlers[opcode], *args)
+        except InvalidInstructionError as e:
+            tm.sink.emit("invalid_instruction", e.message,
+                         INSTRUCTION_FORMATS[opcode].format(*args))
+    return count
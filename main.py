@@ -1,25 +1,263 @@
 import transaction_manager
+import async_engine
+import topology
+import instruction_stream
+import event_sink
+import profiler
+import checkpoint
+import wal
+import argparse
+import os
 import sys
 
 if __name__ == '__main__':
-    tm = transaction_manager.TransactionManager()
-
     # Usage:
-    # $ python3 main.py [input_file]
-    file_path = sys.argv[1] if len(sys.argv) >= 2 else None
-    if file_path:
-        print("Getting input from {}...".format(file_path))
+    # $ python3 main.py [--policy POLICY] [--sites N] [--variables M]
+    #                   [--replication-factor K] [--gc-interval TICKS]
+    #                   [--version-stats]
+    #                   [--output-format FORMAT]
+    #                   [--wal-dir DIR [--wal-sync SYNC] [--wal-group-ticks N]]
+    #                   [--recovery MODE] [--replica-selection SELECTION]
+    #                   [--latency MS [--jitter MS] [--fan-out FAN_OUT]]
+    #                   [--profile] [--profile-output PROFILE_FILE]
+    #                   [--checkpoint-at TICK --checkpoint-file FILE]
+    #                   [--restore FILE]
+    #                   [--compile OUTPUT_FILE | --replay] [input_file]
+    arg_parser = argparse.ArgumentParser(
+        description="Replicated Concurrency Control and Recovery")
+    arg_parser.add_argument(
+        "input_file", nargs="?",
+        help="file to read instructions from (default: standard input)")
+    arg_parser.add_argument(
+        "--policy", default=transaction_manager.ConcurrencyPolicy.DETECTION,
+        type=transaction_manager.ConcurrencyPolicy,
+        choices=list(transaction_manager.ConcurrencyPolicy),
+        metavar="{" + ",".join(
+            p.value for p in transaction_manager.ConcurrencyPolicy) + "}",
+        help="deadlock handling: detect cycles in the waits-for graph "
+             "(default), or prevent them with wait-die or wound-wait")
+    arg_parser.add_argument(
+        "--sites", type=int, default=10,
+        help="number of sites (default: 10)")
+    arg_parser.add_argument(
+        "--variables", type=int, default=20,
+        help="number of variables x1...xM (default: 20)")
+    arg_parser.add_argument(
+        "--replication-factor", type=int, default=None,
+        help="number of sites storing each even indexed variable "
+             "(default: all sites)")
+    arg_parser.add_argument(
+        "--gc-interval", type=int, default=50,
+        help="drop versions no read-only transaction can read on commit, "
+             "and sweep all variables at most every TICKS ticks after the "
+             "oldest read-only transaction ends (default: 50, negative to "
+             "keep every version)")
+    arg_parser.add_argument(
+        "--version-stats", action="store_true",
+        help="print the number of versions retained and reclaimed by "
+             "garbage collection to the standard error when the input ends")
+    arg_parser.add_argument(
+        "--wal-dir", metavar="DIR",
+        help="log the commits of each site to DIR/site<N>.wal, a failed "
+             "site loses its memory and recovers by replaying its log")
+    arg_parser.add_argument(
+        "--wal-sync", default=wal.SyncPolicy.GROUP, type=wal.SyncPolicy,
+        choices=list(wal.SyncPolicy),
+        metavar="{" + ",".join(p.value for p in wal.SyncPolicy) + "}",
+        help="fsync the log after each commit, once per group of ticks "
+             "(default), or never")
+    arg_parser.add_argument(
+        "--wal-group-ticks", type=int, default=1, metavar="N",
+        help="number of ticks per group commit (default: 1)")
+    arg_parser.add_argument(
+        "--recovery", default=transaction_manager.RecoveryMode.WAIT_FOR_WRITE,
+        type=transaction_manager.RecoveryMode,
+        choices=list(transaction_manager.RecoveryMode),
+        metavar="{" + ",".join(
+            m.value for m in transaction_manager.RecoveryMode) + "}",
+        help="a recovered site cannot serve reads of its replicated "
+             "variables until they are written (default), or catches up "
+             "by copying their latest versions from the other sites")
+    arg_parser.add_argument(
+        "--replica-selection",
+        default=transaction_manager.ReplicaSelection.FIRST,
+        type=transaction_manager.ReplicaSelection,
+        choices=list(transaction_manager.ReplicaSelection),
+        metavar="{" + ",".join(
+            s.value for s in transaction_manager.ReplicaSelection) + "}",
+        help="order in which reads try the sites storing a variable: site "
+             "order (default), round-robin, fewest queued locks first, "
+             "random, or the site of the transaction's first read first")
+    arg_parser.add_argument(
+        "--latency", type=float, metavar="MS",
+        help="run the sites as asyncio actors behind network links with "
+             "this one-way latency (see async_engine.py)")
+    arg_parser.add_argument(
+        "--jitter", type=float, default=0.0, metavar="MS",
+        help="maximum random deviation from the latency (default: 0)")
+    arg_parser.add_argument(
+        "--fan-out", default="gather", choices=async_engine.FAN_OUTS,
+        help="send the messages of an operation to all the replicas at "
+             "once (default), or one after the other")
+    arg_parser.add_argument(
+        "--output-format", default="text", choices=list(event_sink.SINKS),
+        help="text output (default), JSON lines with one event per line, "
+             "or no output at all")
+    arg_parser.add_argument(
+        "--profile", action="store_true",
+        help="time each phase of the simulation and print a summary to "
+             "the standard error")
+    arg_parser.add_argument(
+        "--profile-output", metavar="PROFILE_FILE",
+        help="time each phase of the simulation and save the profile: as "
+             "folded stacks for flame graphs if PROFILE_FILE ends with "
+             "\".folded\", in the format of cProfile otherwise")
+    arg_parser.add_argument(
+        "--checkpoint-at", type=int, metavar="TICK",
+        help="save the complete state to --checkpoint-file before executing "
+             "the instruction at timestamp TICK")
+    arg_parser.add_argument(
+        "--checkpoint-file", default="repcrec.ckpt", metavar="FILE",
+        help="checkpoint file to save (default: repcrec.ckpt)")
+    arg_parser.add_argument(
+        "--restore", metavar="FILE",
+        help="restore the state saved in a checkpoint FILE, and continue "
+             "with the input after the instructions it has executed (the "
+             "policy, topology and GC options of the checkpoint are kept)")
+    mode = arg_parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--compile", metavar="OUTPUT_FILE",
+        help="compile the instructions into a binary instruction stream "
+             "written to OUTPUT_FILE, without executing them")
+    mode.add_argument(
+        "--replay", action="store_true",
+        help="execute input_file as a binary instruction stream produced "
+             "by --compile")
+    args = arg_parser.parse_args()
+
+    if args.compile:
+        file_path = args.input_file
         try:
-            with open(file_path, 'r') as file:
-                for line in file:
-                    tm.process_line(line)
-        except IOError:
-            print("[ERROR] Cannot open file: {}".format(file_path))
+            with open(args.compile, 'wb') as output:
+                if file_path:
+                    with open(file_path, 'r') as file:
+                        count = instruction_stream.compile_file(file, output)
+                else:
+                    count = instruction_stream.compile_file(sys.stdin,
+                                                            output)
+        except IOError as e:
+            print("[ERROR] Cannot open file: {}".format(e.filename))
+            sys.exit(1)
+        print("Compiled {} instructions into {}".format(count, args.compile))
+        sys.exit(0)
+    if args.replay and not args.input_file:
+        arg_parser.error("--replay requires an input file")
+    if args.latency is not None and (
+            not args.input_file or args.replay or args.restore or
+            args.checkpoint_at is not None):
+        arg_parser.error("--latency requires an input file, and cannot be "
+                         "used with --replay or checkpoints")
+
+    try:
+        cluster = topology.Topology(args.sites, args.variables,
+                                    args.replication_factor)
+    except ValueError as e:
+        arg_parser.error(str(e))
+    gc_interval = args.gc_interval if args.gc_interval >= 0 else None
+    if args.wal_group_ticks < 1:
+        arg_parser.error("--wal-group-ticks must be positive")
+    if args.wal_dir:
+        os.makedirs(args.wal_dir, exist_ok=True)
+    sink = event_sink.SINKS[args.output_format]()
+    position = 0  # input lines or compiled instructions already executed
+    if args.restore:
+        try:
+            tm, position = checkpoint.load(args.restore, sink)
+        except (checkpoint.CheckpointError, IOError) as e:
+            arg_parser.error("cannot restore {}: {}".format(
+                args.restore, getattr(e, "message", e)))
     else:
-        print("Getting input from standard input... (enter \"exit\" to exit)")
-        while True:
-            line = input()
-            if line.strip() == "exit":
-                break
-            tm.process_line(line)
-            print("========================")
+        tm_args = dict(
+            policy=args.policy, topology=cluster, gc_interval=gc_interval,
+            sink=sink, wal_dir=args.wal_dir, wal_sync=args.wal_sync,
+            wal_group_ticks=args.wal_group_ticks, recovery=args.recovery,
+            replica_selection=args.replica_selection)
+        if args.latency is not None:
+            tm = async_engine.AsyncTransactionManager(
+                args.latency / 1e3, args.jitter / 1e3, args.fan_out,
+                **tm_args)
+        else:
+            tm = transaction_manager.TransactionManager(**tm_args)
+    trigger = None
+    if args.checkpoint_at is not None:
+        trigger = checkpoint.CheckpointTrigger(tm, args.checkpoint_at,
+                                               args.checkpoint_file)
+    phase_profiler = None
+    if args.profile or args.profile_output:
+        phase_profiler = profiler.Profiler()
+        phase_profiler.attach(tm)
+
+    file_path = args.input_file
+    try:
+        if file_path:
+            sink.emit("message", "Getting input from {}...".format(file_path))
+            try:
+                if args.latency is not None:
+                    with open(file_path, 'r') as file:
+                        async_engine.run(tm, file)
+                elif args.replay:
+                    with open(file_path, 'rb') as file:
+                        instruction_stream.replay(tm, file, position,
+                                                  trigger)
+                else:
+                    with open(file_path, 'r') as file:
+                        for line_no, line in enumerate(file):
+                            if line_no < position:
+                                continue
+                            if trigger:
+                                trigger(line_no)
+                            tm.process_line(line)
+            except instruction_stream.InstructionStreamError as e:
+                sink.emit("message", "[ERROR] Cannot replay {}: {}".format(
+                    file_path, e.message))
+            except IOError:
+                sink.emit("message",
+                          "[ERROR] Cannot open file: {}".format(file_path))
+        else:
+            sink.emit("message", "Getting input from standard input... "
+                                 "(enter \"exit\" to exit)")
+            sink.flush()
+            while True:
+                line = input()
+                if line.strip() == "exit":
+                    break
+                if trigger:
+                    trigger(position)
+                position += 1
+                tm.process_line(line)
+                sink.emit("message", "========================")
+                sink.flush()
+    except checkpoint.CheckpointError as e:
+        sink.emit("message", "[ERROR] " + e.message)
+    finally:
+        sink.close()
+        tm.close_logs()
+        if trigger:
+            if trigger.size is None:
+                print("Timestamp {} not reached, no checkpoint saved".format(
+                    args.checkpoint_at), file=sys.stderr)
+            else:
+                print("Checkpoint of timestamp {} saved to {} ({} bytes)"
+                      .format(args.checkpoint_at, args.checkpoint_file,
+                              trigger.size), file=sys.stderr)
+        if args.version_stats:
+            print("Versions: {retained} retained, {reclaimed} reclaimed"
+                  .format(**tm.version_stats()), file=sys.stderr)
+        if phase_profiler:
+            if args.profile:
+                phase_profiler.print_summary()
+            if args.profile_output:
+                if args.profile_output.endswith(".folded"):
+                    phase_profiler.dump_folded(args.profile_output)
+                else:
+                    phase_profiler.dump_stats(args.profile_output)
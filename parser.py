@@ -1,8 +1,26 @@
 import re
+from profiler import unwrapped_state
+
+
+class InvalidInstructionError(Exception):
+    """Error thrown when the instruction is invalid."""
+
+    def __init__(self, message):
+        self.message = message
 
 
 class Parser:
-    debug_info_below = False
+    def __init__(self):
+        """
+        Initialize a Parser instance.
+        """
+        self.debug_info_below = False  # set after the "===" line
+
+    def __getstate__(self):
+        """
+        State saved by a checkpoint, see `profiler.unwrapped_state`.
+        """
+        return unwrapped_state(self)
 
     def parse_line(self, line):
         """
@@ -0,0 +1,192 @@
+import functools
+import marshal
+import sys
+import time
+
+# Methods timed by `Profiler.attach`. Nothing is wrapped unless profiling is
+# enabled, so a TransactionManager without profiler runs at full speed.
+TRANSACTION_MANAGER_PHASES = [
+    "process_line", "tick", "resolve_deadlock", "execute_operation_queue",
+    "read", "read_snapshot", "write", "commit", "abort", "dump", "fail",
+    "recover", "collect_versions"]
+DATA_MANAGER_PHASES = [
+    "resolve_lock_table", "commit", "abort", "read", "read_snapshot",
+    "get_write_lock", "write"]
+WAITS_FOR_PHASES = ["update", "find_cycles"]
+PARSER_PHASES = ["parse_line"]
+
+
+def unwrapped_state(obj, excluded=()):
+    """
+    State of an instrumented object to save in a checkpoint (its
+    `__getstate__`): its attributes, without the timed wrappers a Profiler
+    set on the instance in place of its methods.
+    :param obj: the object
+    :param excluded: names of other attributes to leave out
+    :return: dict of the attributes
+    """
+    return {key: value for key, value in obj.__dict__.items()
+            if key not in excluded and not hasattr(type(obj), key)}
+
+
+class PhaseStats:
+    """Calls and time of a phase, or of a phase called from another."""
+
+    __slots__ = ("calls", "total_time", "self_time")
+
+    def __init__(self):
+        """
+        Initialize an empty PhaseStats instance.
+        """
+        self.calls = 0
+        self.total_time = 0.0  # including the phases it calls
+        self.self_time = 0.0  # excluding the phases it calls
+
+
+class Profiler:
+    """
+    Record the wall time and number of calls of the phases of the
+    simulation, by wrapping the methods of the TransactionManager, its
+    DataManagers, its Parser and its waits-for graph.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty Profiler instance.
+        """
+        self.phases = {}  # {phase: PhaseStats}
+        self.calls = {}  # {(caller phase, phase): PhaseStats}
+        self.stacks = {}  # {(phase, ...): self time}, outermost first
+        self.code = {}  # {phase: (file name, line number)}
+        self.stack = []  # [[phase, time spent in called phases]]
+
+    def attach(self, tm):
+        """
+        Instrument a TransactionManager, its DataManagers, its Parser and its
+        waits-for graph, if it detects deadlocks.
+        :param tm: the TransactionManager
+        """
+        self.instrument(tm, "tm.", TRANSACTION_MANAGER_PHASES)
+        self.instrument(tm.parser, "parser.", PARSER_PHASES)
+        if tm.waits_for:
+            self.instrument(tm.waits_for, "waits_for.", WAITS_FOR_PHASES)
+        for dm in tm.data_manager_list:
+            self.instrument(dm, "dm.", DATA_MANAGER_PHASES)
+
+    def instrument(self, obj, prefix, method_names):
+        """
+        Replace methods of an object by timed wrappers. Instances of the
+        same class share their phases (e.g. "dm.commit" for all sites).
+        :param obj: the object
+        :param prefix: prefix of the phase names
+        :param method_names: the names of the methods
+        """
+        for name in method_names:
+            method = getattr(obj, name)
+            setattr(obj, name, self.wrap(prefix + name, method))
+
+    def wrap(self, phase, method):
+        """
+        :param phase: the name of the phase
+        :param method: the method to time
+        :return: a function calling the method and recording its time
+        """
+        code = method.__code__
+        self.code[phase] = (code.co_filename, code.co_firstlineno)
+        stack = self.stack
+        perf_counter = time.perf_counter
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            frame = [phase, 0.0]
+            stack.append(frame)
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                stack.pop()
+                self.record(phase, elapsed, elapsed - frame[1])
+        return timed
+
+    def record(self, phase, elapsed, self_time):
+        """
+        Record one call of a phase that has just returned.
+        :param phase: the name of the phase
+        :param elapsed: time of the call
+        :param self_time: time of the call outside the phases it called
+        """
+        caller = None
+        if self.stack:
+            caller_frame = self.stack[-1]
+            caller_frame[1] += elapsed
+            caller = caller_frame[0]
+        for table, key in ((self.phases, phase),
+                           (self.calls, (caller, phase))):
+            stats = table.get(key)
+            if stats is None:
+                stats = table[key] = PhaseStats()
+            stats.calls += 1
+            stats.total_time += elapsed
+            stats.self_time += self_time
+        key = tuple(frame[0] for frame in self.stack) + (phase,)
+        self.stacks[key] = self.stacks.get(key, 0.0) + self_time
+
+    def total_time(self):
+        """
+        :return: the time spent in the outermost phases
+        """
+        return sum(stats.total_time for (caller, _), stats
+                   in self.calls.items() if caller is None)
+
+    def print_summary(self, file=None):
+        """
+        Print a table of the phases, by decreasing total time.
+        :param file: text stream to print to (default: standard error)
+        """
+        file = file or sys.stderr
+        total = self.total_time() or 1.0
+        print("{:<32}{:>10}{:>12}{:>12}{:>8}{:>12}".format(
+            "phase", "calls", "total (s)", "self (s)", "total%",
+            "mean (us)"), file=file)
+        for phase, stats in sorted(self.phases.items(),
+                                   key=lambda item: -item[1].total_time):
+            print("{:<32}{:>10}{:>12.3f}{:>12.3f}{:>7.1f}%{:>12.1f}".format(
+                phase, stats.calls, stats.total_time, stats.self_time,
+                100 * stats.total_time / total,
+                1e6 * stats.total_time / stats.calls), file=file)
+
+    def dump_stats(self, file_path):
+        """
+        Save the profile in the format of `cProfile`, readable with
+        `pstats.Stats(file_path)` and tools such as snakeviz.
+        :param file_path: path of the output file
+        """
+        def key(phase):
+            file_name, line = self.code[phase]
+            return file_name, line, phase
+
+        stats = {}
+        for phase, phase_stats in self.phases.items():
+            callers = {}
+            for (caller, callee), call_stats in self.calls.items():
+                if callee == phase and caller is not None:
+                    callers[key(caller)] = (
+                        call_stats.calls, call_stats.calls,
+                        call_stats.self_time, call_stats.total_time)
+            stats[key(phase)] = (phase_stats.calls, phase_stats.calls,
+                                 phase_stats.self_time,
+                                 phase_stats.total_time, callers)
+        with open(file_path, "wb") as file:
+            marshal.dump(stats, file)
+
+    def dump_folded(self, file_path):
+        """
+        Save the profile as folded stacks ("outer;inner microseconds" per
+        line), the input format of flamegraph.pl and speedscope.
+        :param file_path: path of the output file
+        """
+        with open(file_path, "w") as file:
+            for stack, self_time in sorted(self.stacks.items()):
+                file.write("{} {}\n".format(";".join(stack),
+                                            int(round(1e6 * self_time))))
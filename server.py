@@ -0,0 +1,446 @@
+"""
+Serve one TransactionManager to many network clients, over TCP or a Unix
+socket.
+
+Each connection sends instructions, with the text grammar of the input
+files or with a compact binary framing, and may pipeline them: it does not
+have to wait for the response of an instruction before sending the next
+one. The instructions of all the connections are executed one tick after
+the other, in the order they arrive, on a single timeline. Each instruction
+gets one response with the events of its tick. The events of a transaction
+go to the connection that began it; when they happen during the tick of
+another connection (e.g. a blocked read that executes, or an abort), they
+are sent as notifications. When a connection closes, its active
+transactions abort.
+
+Text protocol: one instruction per line, e.g. "R(T1,x2)". The response is
+the text output of the events, then a line ".". Notifications are lines
+starting with "* ".
+
+Binary protocol: the connection starts with MAGIC, then every message is a
+frame: a 4-byte big-endian payload length, then the payload. A request is
+an instruction: its opcode (see instruction_stream.py), then its arguments,
+integers as LEB128 varints and strings as their length and utf-8 bytes. A
+response or notification starts with FRAME_RESPONSE or FRAME_NOTIFICATION,
+followed by the events as JSON objects, one per line (see JsonlSink).
+
+Usage:
+$ python3 server.py [--host HOST] [--port PORT | --unix PATH]
+      [--pipeline N] [--policy POLICY] [--sites N] [--variables M]
+      [--replication-factor K]
+"""
+import argparse
+import asyncio
+import os
+import struct
+import sys
+import traceback
+
+import event_sink
+import instruction_stream
+import topology
+import transaction_manager
+from instruction_stream import InstructionStreamError, encode_varint
+from parser import InvalidInstructionError, Parser
+
+MAGIC = b"RCB1"
+FRAME_HEADER = struct.Struct(">I")
+MAX_FRAME_SIZE = 1 << 20
+FRAME_RESPONSE = 0
+FRAME_NOTIFICATION = 1
+TEXT_END = "."
+TEXT_NOTIFICATION = "* "
+
+# command of each opcode, and kind of each of its arguments (int or str)
+REQUEST_FORMATS = {
+    instruction_stream.OP_BEGIN: ("begin", (str,)),
+    instruction_stream.OP_BEGINRO: ("beginRO", (str,)),
+    instruction_stream.OP_READ: ("R", (str, str)),
+    instruction_stream.OP_WRITE: ("W", (str, str, int)),
+    instruction_stream.OP_WRITE_STRING: ("W", (str, str, str)),
+    instruction_stream.OP_DUMP: ("dump", ()),
+    instruction_stream.OP_END: ("end", (str,)),
+    instruction_stream.OP_FAIL: ("fail", (int,)),
+    instruction_stream.OP_RECOVER: ("recover", (int,)),
+}
+
+
+def encode_request(command, args):
+    """
+    :param command: the command of the instruction (e.g. "R")
+    :param args: list of arguments of the instruction
+    :return: the binary frame of the instruction
+    """
+    if command == "W" and instruction_stream.parse_int(str(args[2])) \
+            is not None:
+        opcode = instruction_stream.OP_WRITE
+    else:
+        opcode = {"begin": instruction_stream.OP_BEGIN,
+                  "beginRO": instruction_stream.OP_BEGINRO,
+                  "R": instruction_stream.OP_READ,
+                  "W": instruction_stream.OP_WRITE_STRING,
+                  "dump": instruction_stream.OP_DUMP,
+                  "end": instruction_stream.OP_END,
+                  "fail": instruction_stream.OP_FAIL,
+                  "recover": instruction_stream.OP_RECOVER}[command]
+    payload = bytearray([opcode])
+    for kind, arg in zip(REQUEST_FORMATS[opcode][1], args):
+        if kind is int:
+            encode_varint(int(arg), payload)
+        else:
+            data = str(arg).encode("utf-8")
+            encode_varint(len(data), payload)
+            payload += data
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def decode_varint(data, pos):
+    """
+    :param data: bytes
+    :param pos: position of a LEB128 varint in data
+    :return: tuple (integer, position after it)
+    """
+    n = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def decode_request(payload):
+    """
+    :param payload: the payload of a request frame
+    :return: tuple (command, args) of the instruction
+    """
+    try:
+        command, kinds = REQUEST_FORMATS[payload[0]]
+        args = []
+        pos = 1
+        for kind in kinds:
+            n, pos = decode_varint(payload, pos)
+            if kind is int:
+                args.append(n)
+            else:
+                if pos + n > len(payload):
+                    raise IndexError
+                args.append(payload[pos:pos + n].decode("utf-8"))
+                pos += n
+    except (IndexError, KeyError, UnicodeDecodeError):
+        raise InstructionStreamError("Malformed request")
+    if command == "W":
+        args[2] = str(args[2])
+    return command, args
+
+
+class Connection:
+    """A client connection, and the events it has to be sent."""
+
+    def __init__(self, writer, is_binary, pipeline):
+        """
+        Initialize a Connection instance.
+        :param writer: the asyncio.StreamWriter of the connection
+        :param is_binary: boolean value to indicate if it uses the binary
+         protocol
+        :param pipeline: maximum number of instructions received and not
+         answered yet
+        """
+        self.writer = writer
+        self.is_binary = is_binary
+        self.format = event_sink.JsonlSink().format if is_binary else \
+            event_sink.TextSink().format
+        self.parser = Parser()  # its own "===" marker
+        self.in_flight = asyncio.Semaphore(pipeline)
+        self.transaction_ids = set()  # active transactions it began
+        self.response = []  # lines of the current response
+        self.notifications = []  # lines of the pending notification
+        self.is_open = True
+
+    def send(self, kind, lines):
+        """
+        Send a response or a notification.
+        :param kind: FRAME_RESPONSE or FRAME_NOTIFICATION
+        :param lines: list of lines of events
+        """
+        if not self.is_open:
+            return
+        if self.is_binary:
+            payload = bytes([kind]) + "\n".join(lines).encode("utf-8")
+            self.writer.write(FRAME_HEADER.pack(len(payload)) + payload)
+        elif kind == FRAME_RESPONSE:
+            self.writer.write("".join(
+                line + "\n" for line in lines + [TEXT_END]).encode("utf-8"))
+        else:
+            self.writer.write("".join(
+                TEXT_NOTIFICATION + line + "\n" for event in lines
+                for line in event.split("\n")).encode("utf-8"))
+
+
+class RoutingSink(event_sink.EventSink):
+    """
+    Sends each event to the connection owning its transaction, or to the
+    connection whose instruction is executing.
+    """
+
+    def __init__(self):
+        self.current = None  # Connection of the executing instruction
+        self.owners = {}  # {transaction_id: Connection}
+        self.notified = []  # Connections with pending notifications
+
+    def emit(self, event, *values):
+        conn = self.current
+        if event_sink.EVENT_FIELDS[event][0] == "transaction_id":
+            transaction_id = values[0]
+            if event in ("begin", "begin_ro") and conn:
+                self.owners[transaction_id] = conn
+                conn.transaction_ids.add(transaction_id)
+            conn = self.owners.get(transaction_id, conn)
+            if event in ("commit", "abort") and conn:
+                self.owners.pop(transaction_id, None)
+                conn.transaction_ids.discard(transaction_id)
+        if conn is None or not conn.is_open:
+            return
+        if conn is self.current:
+            conn.response.append(conn.format(event, values))
+        else:
+            if not conn.notifications:
+                self.notified.append(conn)
+            conn.notifications.append(conn.format(event, values))
+
+    def flush(self):
+        """Send the pending notifications."""
+        for conn in self.notified:
+            conn.send(FRAME_NOTIFICATION, conn.notifications)
+            conn.notifications = []
+        self.notified = []
+
+
+class Server:
+    """Executes the instructions of all the connections on one timeline."""
+
+    def __init__(self, tm, pipeline=64):
+        """
+        Initialize a Server instance.
+        :param tm: the TransactionManager, whose sink is replaced
+        :param pipeline: maximum number of instructions of a connection
+         received and not answered yet
+        """
+        self.tm = tm
+        self.sink = RoutingSink()
+        tm.sink = self.sink
+        self.pipeline = pipeline
+        self.requests = None  # asyncio.Queue of (Connection, request)
+        self.num_connections = 0
+        self.num_instructions = 0
+
+    async def serve(self, host="127.0.0.1", port=7070, unix_path=None):
+        """
+        Accept connections and execute their instructions until cancelled.
+        :param host: the address to listen on
+        :param port: the TCP port to listen on
+        :param unix_path: listen on this Unix socket instead (optional)
+        """
+        self.requests = asyncio.Queue()
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        executor = asyncio.ensure_future(self.execute_requests())
+        try:
+            await executor
+        finally:
+            executor.cancel()
+            server.close()
+            await server.wait_closed()
+
+    async def handle(self, reader, writer):
+        """
+        Read the requests of a connection and queue them.
+        """
+        self.num_connections += 1
+        try:
+            head = await reader.readexactly(len(MAGIC))
+        except asyncio.IncompleteReadError as e:
+            head = e.partial
+        conn = Connection(writer, head == MAGIC, self.pipeline)
+        try:
+            if conn.is_binary:
+                while True:
+                    header = await reader.readexactly(FRAME_HEADER.size)
+                    size = FRAME_HEADER.unpack(header)[0]
+                    if size > MAX_FRAME_SIZE:
+                        break
+                    payload = await reader.readexactly(size)
+                    await conn.in_flight.acquire()
+                    self.requests.put_nowait((conn, payload))
+            else:
+                lines = head.decode("utf-8", "replace").splitlines(True)
+                partial = lines.pop() if lines and \
+                    not lines[-1].endswith("\n") else ""
+                while True:
+                    if lines:
+                        line = lines.pop(0)
+                    else:
+                        line = (await reader.readline()).decode(
+                            "utf-8", "replace")
+                        if partial:
+                            line = partial + line
+                            partial = ""
+                        if not line:
+                            break
+                    await conn.in_flight.acquire()
+                    self.requests.put_nowait((conn, line))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.requests.put_nowait((conn, None))
+
+    async def execute_requests(self):
+        """
+        Execute the queued requests one at a time. When there are none and
+        the waits-for graph has a cycle, run a tick without instruction to
+        resolve the deadlock, since blocked clients may send nothing else.
+        Other blocked operations are retried by the tick that changes their
+        locks, so the timestamp never advances with the wall clock.
+        """
+        requests = self.requests
+        while True:
+            waits_for = self.tm.waits_for
+            if requests.empty() and waits_for and waits_for.cycle_detected:
+                self.tm.tick(lambda: None)
+                self.sink.flush()
+                continue
+            conn, request = await requests.get()
+            if request is None:
+                self.disconnect(conn)
+            else:
+                self.execute(conn, request)
+                conn.in_flight.release()
+
+    def execute(self, conn, request):
+        """
+        Execute one request and send its response and the notifications.
+        :param conn: the Connection
+        :param request: a line of text or the payload of a binary frame
+        """
+        self.num_instructions += 1
+        self.sink.current = conn
+        try:
+            if conn.is_binary:
+                try:
+                    command, args = decode_request(request)
+                except InstructionStreamError as e:
+                    self.sink.emit("invalid_instruction", e.message,
+                                   request.hex())
+                else:
+                    try:
+                        self.tm.client.execute(command, args)
+                    except InvalidInstructionError as e:
+                        self.sink.emit(
+                            "invalid_instruction", e.message,
+                            "{}({})".format(command, ",".join(
+                                str(arg) for arg in args)))
+            else:
+                self.tm.client.process_line(request, conn.parser)
+        except Exception as e:
+            traceback.print_exc()
+            self.sink.emit("message", "[ERROR] {}: {}".format(
+                type(e).__name__, e))
+        finally:
+            self.sink.current = None
+        conn.send(FRAME_RESPONSE, conn.response)
+        conn.response = []
+        self.sink.flush()
+
+    def disconnect(self, conn):
+        """
+        Close a connection, aborting its active transactions in one tick.
+        :param conn: the Connection
+        """
+        conn.is_open = False
+        transaction_ids = sorted(t_id for t_id in conn.transaction_ids
+                                 if t_id in self.tm.transaction_table)
+        if transaction_ids:
+            self.tm.tick(self.abort_transactions, transaction_ids)
+            self.sink.flush()
+        conn.writer.close()
+
+    def abort_transactions(self, transaction_ids):
+        """
+        Instruction aborting the transactions of a closed connection.
+        :param transaction_ids: list of transactions' ids
+        """
+        for transaction_id in transaction_ids:
+            if transaction_id in self.tm.transaction_table:
+                self.tm.abort(transaction_id, "disconnect")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    arg_parser.add_argument(
+        "--host", default="127.0.0.1",
+        help="address to listen on (default: 127.0.0.1)")
+    arg_parser.add_argument(
+        "--port", type=int, default=7070,
+        help="TCP port to listen on (default: 7070)")
+    arg_parser.add_argument(
+        "--unix", metavar="PATH",
+        help="listen on a Unix socket instead of TCP")
+    arg_parser.add_argument(
+        "--pipeline", type=int, default=64, metavar="N",
+        help="instructions a connection may send before the first response "
+             "(default: 64)")
+    arg_parser.add_argument(
+        "--policy", default=transaction_manager.ConcurrencyPolicy.DETECTION,
+        type=transaction_manager.ConcurrencyPolicy,
+        choices=list(transaction_manager.ConcurrencyPolicy),
+        metavar="{" + ",".join(
+            p.value for p in transaction_manager.ConcurrencyPolicy) + "}",
+        help="deadlock handling (default: detection)")
+    arg_parser.add_argument(
+        "--sites", type=int, default=10,
+        help="number of sites (default: 10)")
+    arg_parser.add_argument(
+        "--variables", type=int, default=20,
+        help="number of variables x1...xM (default: 20)")
+    arg_parser.add_argument(
+        "--replication-factor", type=int, default=None,
+        help="number of sites storing each even indexed variable "
+             "(default: all sites)")
+    args = arg_parser.parse_args()
+    if args.pipeline < 1:
+        arg_parser.error("--pipeline must be positive")
+
+    try:
+        cluster = topology.Topology(args.sites, args.variables,
+                                    args.replication_factor)
+    except ValueError as e:
+        arg_parser.error(str(e))
+    tm = transaction_manager.TransactionManager(args.policy, cluster)
+    server = Server(tm, args.pipeline)
+    print("Listening on {}".format(
+        args.unix or "{}:{}".format(args.host, args.port)), file=sys.stderr)
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(server.serve(args.host, args.port, args.unix))
+    try:
+        loop.run_until_complete(task)
+    except KeyboardInterrupt:
+        task.cancel()
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+    finally:
+        loop.close()
+        if args.unix and os.path.exists(args.unix):
+            os.remove(args.unix)
+        print("{} connections, {} instructions".format(
+            server.num_connections, server.num_instructions),
+            file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
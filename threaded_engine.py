@@ -0,0 +1,537 @@
+"""
+Multi-threaded engine: a pool of worker threads runs transactions against
+the data managers at the same time, each worker running one transaction
+after the other.
+
+The data managers are ConcurrentDataManagers, made safe for concurrent
+callers with striped latches: each variable maps to one of a fixed number of
+locks, so operations on different variables of a site run in parallel and
+only operations on variables of the same stripe are serialized. A LockManager
+is only accessed under the latch of its variable. Committing or aborting a
+transaction takes the latches of all the variables it touched, in stripe
+order, so latching cannot deadlock.
+
+A worker whose lock request is queued blocks on a condition variable until
+the locks of the variable change. Deadlocks are prevented with wait-die: a
+transaction queued behind an older one aborts, and restarts with its original
+timestamp. Sites do not fail in this engine.
+"""
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from data_manager import DataManager
+from topology import Topology
+from transaction_manager import InvalidInstructionError
+
+
+class StripedLatches:
+    """A fixed array of locks, each shared by the variables of a stripe."""
+
+    def __init__(self, topology, num_stripes=64):
+        """
+        Initialize a StripedLatches instance.
+        :param topology: the Topology mapping variables to their indexes
+        :param num_stripes: number of locks
+        """
+        self.topology = topology
+        self.latches = [threading.Lock() for _ in range(num_stripes)]
+        # acquisitions that had to wait, approximate (not latched itself)
+        self.num_contended = 0
+
+    def stripe_of(self, variable_id):
+        """
+        :param variable_id: variable's id
+        :return: the index of the latch of the variable
+        """
+        v_idx = self.topology.variable_index(variable_id)
+        if v_idx is None:
+            v_idx = hash(variable_id)
+        return v_idx % len(self.latches)
+
+    def acquire(self, stripe):
+        """
+        Acquire the latch of a stripe, counting the contended acquisitions.
+        :param stripe: the index of the latch
+        """
+        latch = self.latches[stripe]
+        if not latch.acquire(False):
+            self.num_contended += 1
+            latch.acquire()
+
+    @contextmanager
+    def hold(self, variable_ids=None):
+        """
+        Hold the latches of some variables, acquired in stripe order.
+        :param variable_ids: iterable of variables' ids, None for all the
+         latches
+        """
+        if variable_ids is None:
+            stripes = range(len(self.latches))
+        else:
+            stripes = sorted({self.stripe_of(v) for v in variable_ids})
+        for stripe in stripes:
+            self.acquire(stripe)
+        try:
+            yield
+        finally:
+            for stripe in stripes:
+                self.latches[stripe].release()
+
+
+class ConcurrentDataManager(DataManager):
+    """
+    DataManager safe for concurrent callers: the operations on a variable
+    hold its latch, the operations on a transaction hold the latches of the
+    variables it touched, and the operations on the whole site hold all of
+    them. The listener is called with the latches held.
+    """
+
+    def __init__(self, site_id, listener=None, topology=None,
+                 num_stripes=64):
+        """
+        Initialize a ConcurrentDataManager instance.
+        :param site_id: see `DataManager`
+        :param listener: see `DataManager`
+        :param topology: see `DataManager`
+        :param num_stripes: number of latches of the site
+        """
+        super().__init__(site_id, listener, topology)
+        self.latches = StripedLatches(self.topology, num_stripes)
+
+    def __getstate__(self):
+        raise TypeError("A ConcurrentDataManager cannot be checkpointed")
+
+    def touched_variables(self, transaction_id):
+        """
+        :param transaction_id: transaction's id
+        :return: set of the variables a transaction holds or waits for locks
+         on at this site
+        """
+        t_locks = self.transaction_locks.get(transaction_id)
+        if not t_locks:
+            return set()
+        # other threads only grant the locks the transaction waits for, so
+        # this union of copies holds whatever they do
+        return t_locks.held | t_locks.queued
+
+    def read_snapshot(self, variable_id, ts):
+        with self.latches.hold([variable_id]):
+            return super().read_snapshot(variable_id, ts)
+
+    def read(self, transaction_id, variable_id):
+        with self.latches.hold([variable_id]):
+            return super().read(transaction_id, variable_id)
+
+    def count_queued_locks(self, variable_id):
+        with self.latches.hold([variable_id]):
+            return super().count_queued_locks(variable_id)
+
+    def withdraw_read(self, transaction_id, variable_id):
+        with self.latches.hold([variable_id]):
+            super().withdraw_read(transaction_id, variable_id)
+
+    def get_write_lock(self, transaction_id, variable_id):
+        with self.latches.hold([variable_id]):
+            return super().get_write_lock(transaction_id, variable_id)
+
+    def write(self, transaction_id, variable_id, value):
+        with self.latches.hold([variable_id]):
+            super().write(transaction_id, variable_id, value)
+
+    def try_write(self, transaction_id, variable_id, value):
+        """
+        Get the W-lock of a variable and write the value in one step, so that
+        no other transaction takes a lock in between.
+        :param transaction_id: transaction's id
+        :param variable_id: variable's id
+        :param value: the value to be written
+        :return: boolean value to indicate if the value is written, otherwise
+         the W-lock is queued
+        """
+        with self.latches.hold([variable_id]):
+            if not DataManager.get_write_lock(self, transaction_id,
+                                              variable_id):
+                return False
+            DataManager.write(self, transaction_id, variable_id, value)
+            return True
+
+    def has_write_lock(self, variable_id):
+        with self.latches.hold([variable_id]):
+            return super().has_write_lock(variable_id)
+
+    def abort(self, transaction_id):
+        with self.latches.hold(self.touched_variables(transaction_id)):
+            super().abort(transaction_id)
+
+    def commit(self, transaction_id, commit_ts, gc_horizon_ts=None):
+        with self.latches.hold(self.touched_variables(transaction_id)):
+            super().commit(transaction_id, commit_ts, gc_horizon_ts)
+
+    def dump(self):
+        with self.latches.hold():
+            return super().dump()
+
+    def collect_versions(self, horizon_ts):
+        with self.latches.hold():
+            return super().collect_versions(horizon_ts)
+
+
+class TransactionDied(Exception):
+    """Raised in a worker when wait-die aborts its transaction."""
+
+    def __init__(self, variable_id):
+        """
+        :param variable_id: the variable the transaction was waiting for
+        """
+        self.variable_id = variable_id
+
+
+class Wakeups:
+    """
+    Condition variables on which workers wait for the locks of a variable to
+    change, striped like the latches. Each stripe counts its changes, so a
+    change between an attempt and the wait is not missed.
+    """
+
+    def __init__(self, topology, num_stripes=64):
+        """
+        Initialize a Wakeups instance.
+        :param topology: the Topology mapping variables to their indexes
+        :param num_stripes: number of condition variables
+        """
+        self.stripes = StripedLatches(topology, num_stripes)
+        self.conditions = [threading.Condition()
+                           for _ in range(num_stripes)]
+        self.versions = [0] * num_stripes
+
+    def version(self, variable_id):
+        """
+        :param variable_id: variable's id
+        :return: the number of changes of the stripe of the variable
+        """
+        return self.versions[self.stripes.stripe_of(variable_id)]
+
+    def notify(self, variable_id):
+        """
+        Wake up the workers waiting on the stripe of a variable.
+        :param variable_id: variable's id
+        """
+        stripe = self.stripes.stripe_of(variable_id)
+        condition = self.conditions[stripe]
+        with condition:
+            self.versions[stripe] += 1
+            condition.notify_all()
+
+    def wait(self, variable_id, version, timeout):
+        """
+        Wait for a change of the stripe of a variable.
+        :param variable_id: variable's id
+        :param version: the version of the stripe before the failed attempt
+        :param timeout: maximum time to wait, in seconds
+        """
+        stripe = self.stripes.stripe_of(variable_id)
+        condition = self.conditions[stripe]
+        with condition:
+            if self.versions[stripe] == version:
+                condition.wait(timeout)
+
+
+class WorkerStats:
+    """Counters of one worker thread, summed when the run ends."""
+
+    __slots__ = ("commits", "deaths", "waits", "wait_seconds", "operations")
+
+    def __init__(self):
+        self.commits = 0
+        self.deaths = 0  # restarts after wait-die aborts
+        self.waits = 0  # operations blocked on a queued lock
+        self.wait_seconds = 0.0
+        self.operations = 0
+
+
+class ThreadedEngine:
+    """
+    Runs transaction scripts on a pool of worker threads. A script is a list
+    of instructions (command, args): "begin" or "beginRO", then "R" and "W",
+    then "end", with the same arguments as the text instructions.
+    """
+
+    def __init__(self, topology=None, num_workers=4, num_stripes=64,
+                 think_time=0.0, wait_timeout=0.05):
+        """
+        Initialize a ThreadedEngine instance.
+        :param topology: the Topology of the cluster (default layout if None)
+        :param num_workers: number of worker threads
+        :param num_stripes: number of latches per site
+        :param think_time: time a worker sleeps after each operation, with
+         its locks held, in seconds
+        :param wait_timeout: maximum time a blocked worker waits before it
+         tries again, in seconds
+        """
+        self.topology = topology or Topology()
+        self.num_workers = num_workers
+        self.think_time = think_time
+        self.wait_timeout = wait_timeout
+        self.data_manager_list = [
+            ConcurrentDataManager(site_id, self, self.topology, num_stripes)
+            for site_id in range(1, self.topology.num_sites + 1)]
+        self.wakeups = Wakeups(self.topology, num_stripes)
+        self.replica_index = {}  # {variable_id: [DataManager]}
+        self.clock_lock = threading.Lock()
+        self.clock = 0
+        self.committing = set()  # commit timestamps not applied everywhere
+        self.timestamps = {}  # {transaction_id: timestamp of first begin}
+        self.dying = set()  # transactions wait-die has chosen to abort
+
+    # -----------------------------------------------------
+    # ------------------ Listener methods -----------------
+    # -----------------------------------------------------
+    def on_variable_change(self, site_id, variable_id):
+        """
+        Called by a data manager when the locks or the values of a variable
+        change: wake up the workers waiting for it.
+        :param site_id: the id of the site
+        :param variable_id: the id of the variable
+        """
+        self.wakeups.notify(variable_id)
+
+    def on_site_change(self, site_id):
+        """Sites do not fail in this engine."""
+
+    def on_lock_queued(self, site_id, lm, transaction_id):
+        """
+        Called by a data manager, with the latch of the variable held, when a
+        transaction has to wait in the lock queue: it dies if it waits for an
+        older transaction.
+        :param site_id: the id of the site
+        :param lm: the LockManager of the variable
+        :param transaction_id: the id of the waiting transaction
+        """
+        ts = self.timestamps[transaction_id]
+        for waiter, holder in lm.blocking_edges():
+            if waiter == transaction_id and \
+                    self.timestamps.get(holder, ts) < ts:
+                self.dying.add(transaction_id)
+                return
+
+    # -----------------------------------------------------
+    # --------------------- Execution ---------------------
+    # -----------------------------------------------------
+    def next_timestamp(self):
+        """
+        :return: a new timestamp, larger than all the previous ones
+        """
+        with self.clock_lock:
+            self.clock += 1
+            return self.clock
+
+    def snapshot_timestamp(self):
+        """
+        :return: the timestamp of a read-only transaction: every commit
+         before it is applied at all the sites
+        """
+        with self.clock_lock:
+            if self.committing:
+                return min(self.committing) - 1
+            return self.clock
+
+    def get_replicas(self, variable_id):
+        """
+        :param variable_id: variable's id
+        :return: the DataManagers storing the variable, in site order
+        """
+        replicas = self.replica_index.get(variable_id)
+        if replicas is None:
+            v_idx = self.topology.variable_index(variable_id)
+            if v_idx is None:
+                raise InvalidInstructionError(
+                    "Variable {} does not exist".format(variable_id))
+            replicas = [self.data_manager_list[site_id - 1]
+                        for site_id in self.topology.sites_of(v_idx)]
+            self.replica_index[variable_id] = replicas
+        return replicas
+
+    def run(self, scripts):
+        """
+        Run transaction scripts on the worker threads, in the order workers
+        become free.
+        :param scripts: iterable of transaction scripts
+        :return: dict of results, with the counters of all the workers
+        """
+        tasks = queue.Queue()
+        for script in scripts:
+            tasks.put(script)
+        stats = [WorkerStats() for _ in range(self.num_workers)]
+        errors = []
+        workers = [threading.Thread(target=self.work,
+                                    args=(tasks, worker_stats, errors))
+                   for worker_stats in stats]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        if errors:
+            raise errors[0]
+        results = {"workers": self.num_workers, "seconds": elapsed,
+                   "latch_contention": sum(dm.latches.num_contended
+                                           for dm in self.data_manager_list)}
+        for name in WorkerStats.__slots__:
+            results[name] = sum(getattr(s, name) for s in stats)
+        return results
+
+    def work(self, tasks, stats, errors):
+        """
+        Body of a worker thread: run scripts until there are none left.
+        :param tasks: the queue.Queue of scripts
+        :param stats: the WorkerStats of the worker
+        :param errors: list collecting the exception stopping a worker
+        """
+        try:
+            while True:
+                try:
+                    script = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                self.run_transaction(script, stats)
+        except Exception as e:
+            errors.append(e)
+
+    def run_transaction(self, script, stats):
+        """
+        Run a transaction script until it commits, restarting it with the
+        same timestamp each time it dies.
+        :param script: the transaction script
+        :param stats: the WorkerStats of the worker
+        """
+        command, args = script[0]
+        if command not in ("begin", "beginRO"):
+            raise InvalidInstructionError(
+                "A script must start with begin or beginRO")
+        transaction_id = args[0]
+        is_ro = command == "beginRO"
+        self.timestamps[transaction_id] = self.next_timestamp()
+        try:
+            while True:
+                ts = self.snapshot_timestamp() if is_ro else \
+                    self.timestamps[transaction_id]
+                try:
+                    self.run_operations(transaction_id, is_ro, ts,
+                                        script[1:], stats)
+                    return
+                except TransactionDied as e:
+                    self.abort(transaction_id)
+                    stats.deaths += 1
+                    # restarting right away would die again on the same lock
+                    self.wakeups.wait(e.variable_id,
+                                      self.wakeups.version(e.variable_id),
+                                      self.wait_timeout)
+        finally:
+            del self.timestamps[transaction_id]
+
+    def run_operations(self, transaction_id, is_ro, ts, instructions, stats):
+        """
+        Run the operations of a transaction, then commit it.
+        :param transaction_id: transaction's id
+        :param is_ro: boolean value to indicate if it is read-only
+        :param ts: its timestamp (the snapshot of a read-only transaction)
+        :param instructions: the instructions after its begin
+        :param stats: the WorkerStats of the worker
+        """
+        lock_sites = set()
+        for command, args in instructions:
+            if command == "R":
+                variable_id = args[1]
+                replicas = self.get_replicas(variable_id)
+                # spread the R-locks of a variable over its replicas
+                first = ts % len(replicas)
+                dm = replicas[first]
+                if is_ro:
+                    # as in the TransactionManager, try the other replicas
+                    # and retry until one has a readable version
+                    ordered = replicas[first:] + replicas[:first]
+                    self.wait_until(
+                        transaction_id, variable_id, stats,
+                        lambda: any(dm.read_snapshot(variable_id, ts).success
+                                    for dm in ordered))
+                else:
+                    lock_sites.add(dm)
+                    self.wait_until(
+                        transaction_id, variable_id, stats,
+                        lambda: dm.read(transaction_id, variable_id).success)
+            elif command == "W":
+                if is_ro:
+                    raise InvalidInstructionError(
+                        "Read-only transaction {} cannot write".format(
+                            transaction_id))
+                variable_id, value = args[1], args[2]
+                replicas = self.get_replicas(variable_id)
+                lock_sites.update(replicas)
+                self.wait_until(
+                    transaction_id, variable_id, stats,
+                    lambda: all([dm.try_write(transaction_id, variable_id,
+                                              value) for dm in replicas]))
+            elif command == "end":
+                break
+            else:
+                raise InvalidInstructionError(
+                    "Unknown command {} in a script".format(command))
+            stats.operations += 1
+            if self.think_time:
+                time.sleep(self.think_time)
+        if not is_ro:
+            self.commit(transaction_id, lock_sites)
+        stats.commits += 1
+
+    def wait_until(self, transaction_id, variable_id, stats, attempt):
+        """
+        Try an operation until it succeeds, waiting for the locks of the
+        variable to change after each failure.
+        :param transaction_id: transaction's id
+        :param variable_id: variable's id
+        :param stats: the WorkerStats of the worker
+        :param attempt: function trying the operation, returning a boolean
+         value to indicate if it succeeded
+        """
+        start = None
+        while True:
+            version = self.wakeups.version(variable_id)
+            if attempt():
+                break
+            if transaction_id in self.dying:
+                raise TransactionDied(variable_id)
+            if start is None:
+                start = time.perf_counter()
+                stats.waits += 1
+            self.wakeups.wait(variable_id, version, self.wait_timeout)
+        if start is not None:
+            stats.wait_seconds += time.perf_counter() - start
+
+    def commit(self, transaction_id, lock_sites):
+        """
+        Commit a transaction at the sites where it holds locks.
+        :param transaction_id: transaction's id
+        :param lock_sites: set of the DataManagers of these sites
+        """
+        with self.clock_lock:
+            self.clock += 1
+            commit_ts = self.clock
+            self.committing.add(commit_ts)
+        try:
+            for dm in sorted(lock_sites, key=lambda dm: dm.site_id):
+                dm.commit(transaction_id, commit_ts)
+        finally:
+            with self.clock_lock:
+                self.committing.discard(commit_ts)
+
+    def abort(self, transaction_id):
+        """
+        Abort a transaction at all the sites, releasing its locks.
+        :param transaction_id: transaction's id
+        """
+        for dm in self.data_manager_list:
+            dm.abort(transaction_id)
+        self.dying.discard(transaction_id)
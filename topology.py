@@ -0,0 +1,112 @@
+def default_initial_value(v_idx):
+    """
+    Initial value of a variable: 10 times its index (e.g. x3 starts at 30).
+    :param v_idx: the index of the variable
+    """
+    return v_idx * 10
+
+
+class Topology:
+    """
+    Layout of the cluster: the sites, the variables, their initial values and
+    the sites storing each variable.
+    The default layout has 10 sites and 20 variables x1...x20. Even indexed
+    variables are replicated at all sites, odd indexed variables are stored at
+    site 1 + (index mod 10).
+    """
+
+    def __init__(self, num_sites=10, num_variables=20, replication_factor=None,
+                 initial_value=default_initial_value, placement=None):
+        """
+        Initialize a Topology instance.
+        :param num_sites: number of sites, with ids 1...num_sites
+        :param num_variables: number of variables, x1...x{num_variables}
+        :param replication_factor: number of sites storing an even indexed
+         variable (default: all sites)
+        :param initial_value: function mapping a variable's index to its
+         initial value
+        :param placement: function mapping a variable's index and the
+         topology to the ascending list of site ids storing the variable
+         (default: `default_placement`)
+        """
+        if num_sites < 1 or num_variables < 0:
+            raise ValueError("Invalid number of sites or variables")
+        if replication_factor is not None and \
+                not 1 <= replication_factor <= num_sites:
+            raise ValueError("Replication factor must be between 1 and the "
+                             "number of sites")
+        self.num_sites = num_sites
+        self.num_variables = num_variables
+        self.replication_factor = replication_factor
+        self.initial_value = initial_value
+        self.placement = placement or default_placement
+
+    def variable_index(self, variable_id):
+        """
+        :param variable_id: variable's id (e.g. "x12")
+        :return: the index of the variable (e.g. 12), or None if the variable
+         does not exist
+        """
+        if variable_id[:1] != "x" or not variable_id[1:].isdigit():
+            return None
+        v_idx = int(variable_id[1:])
+        if not 1 <= v_idx <= self.num_variables:
+            return None
+        return v_idx
+
+    def sites_of(self, v_idx):
+        """
+        :param v_idx: the index of the variable
+        :return: the ascending list of site ids storing the variable
+        """
+        return self.placement(v_idx, self)
+
+    def is_stored_at(self, v_idx, site_id):
+        """
+        :param v_idx: the index of the variable
+        :param site_id: the id of the site
+        :return: boolean value to indicate if the variable is stored at the site
+        """
+        if self.placement is default_placement and \
+                self.replication_factor is None:
+            # avoid building the list of all sites
+            return v_idx % 2 == 0 or v_idx % self.num_sites + 1 == site_id
+        return site_id in self.sites_of(v_idx)
+
+    def is_replicated(self, v_idx):
+        """
+        :param v_idx: the index of the variable
+        :return: boolean value to indicate if the variable has several copies
+        """
+        if self.placement is default_placement:
+            factor = self.replication_factor or self.num_sites
+            return v_idx % 2 == 0 and factor > 1
+        return len(self.sites_of(v_idx)) > 1
+
+    def variables_at_site(self, site_id):
+        """
+        :param site_id: the id of the site
+        :return: the ascending list of indexes of the variables at the site
+        """
+        return [v_idx for v_idx in range(1, self.num_variables + 1)
+                if self.is_stored_at(v_idx, site_id)]
+
+
+def default_placement(v_idx, topology):
+    """
+    Even indexed variables are replicated at `replication_factor` sites
+    (consecutive sites starting from site 1 + (index mod number of sites)), or
+    at all sites by default. Odd indexed variables are stored at site
+    1 + (index mod number of sites).
+    :param v_idx: the index of the variable
+    :param topology: the Topology
+    :return: the ascending list of site ids storing the variable
+    """
+    num_sites = topology.num_sites
+    if v_idx % 2 == 0:
+        factor = topology.replication_factor
+        if factor is None or factor == num_sites:
+            return list(range(1, num_sites + 1))
+        first = v_idx % num_sites
+        return sorted((first + i) % num_sites + 1 for i in range(factor))
+    return [v_idx % num_sites + 1]
@@ -1,45 +1,96 @@
+from client import Client
 from data_manager import DataManager
-from parser import Parser
+from parser import InvalidInstructionError, Parser
+from profiler import unwrapped_state
+from waits_for_graph import WaitsForGraph
+from topology import Topology
+from event_sink import TextSink
+from wal import SyncPolicy, WriteAheadLog
 from collections import defaultdict
+from enum import Enum
+import heapq
+import os
+import random
+import time
 
 
-class InvalidInstructionError(Exception):
-    """Error thrown when the instruction is invalid."""
+class ConcurrencyPolicy(Enum):
+    """How the transaction manager handles transactions waiting for locks."""
+    DETECTION = "detection"  # detect cycles in the waits-for graph
+    WAIT_DIE = "wait-die"  # younger waiter aborts itself
+    WOUND_WAIT = "wound-wait"  # older waiter aborts younger lock holders
 
-    def __init__(self, message):
-        self.message = message
+
+class RecoveryMode(Enum):
+    """How a recovered site makes its replicated variables readable again."""
+    WAIT_FOR_WRITE = "wait-for-write"  # until a write commits at the site
+    CATCH_UP = "catch-up"  # copy the latest versions from the other sites
+
+
+class ReplicaSelection(Enum):
+    """In which order a read tries the sites storing a variable."""
+    FIRST = "first"  # in site order
+    ROUND_ROBIN = "round-robin"  # start one site further at each read
+    LEAST_QUEUED = "least-queued"  # fewest locks queued on the variable
+    RANDOM = "random"  # in a random order
+    STICKY = "sticky"  # the site of the transaction's first read, if any
 
 
 class Transaction:
-    def __init__(self, ts, transaction_id, is_ro):
+    __slots__ = ("ts", "seq", "transaction_id", "is_ro", "will_abort",
+                 "sites_accessed", "lock_sites", "pending_op_ids",
+                 "read_site_id")
+
+    def __init__(self, ts, seq, transaction_id, is_ro):
         """
         Initialize a Transaction instance.
         :param ts (int): the timestamp when the transaction begins
+        :param seq (int): the begin order, unique even among transactions
+         that begin in the same tick (e.g. in one Batch)
         :param transaction_id (str): the id of the transaction (e.g. T1, T2)
         :param is_ro (bool): whether the transaction is read-only
         """
         self.ts = ts
+        self.seq = seq
         self.transaction_id = transaction_id
         self.is_ro = is_ro
         self.will_abort = False
         self.sites_accessed = []
+        self.lock_sites = set()  # sites where it may hold or wait for locks
+        self.pending_op_ids = set()  # ids of its operations still in queue
+        self.read_site_id = None  # site of its first read
+
+    def age(self):
+        """
+        :return: (ts, seq), smaller for older transactions
+        """
+        return self.ts, self.seq
 
 
 class Operation:
     """An Operation is either a Read or a Write instruction."""
 
-    def __init__(self, command, transaction_id, variable_id, value=None):
+    __slots__ = ("op_id", "command", "transaction_id", "variable_id", "value",
+                 "future")
+
+    def __init__(self, op_id, command, transaction_id, variable_id,
+                 value=None, future=None):
         """
         Initialize an Operation instance.
+        :param op_id (int): increasing id that gives the arrival order
         :param command (str): "R" or "W"
         :param transaction_id: the id of the transaction performing this op
         :param variable_id: the id of the variable
         :param value: write value (optional)
+        :param future: the OperationFuture of a Client, set when the
+         operation executes (optional)
         """
+        self.op_id = op_id
         self.command = command
         self.transaction_id = transaction_id
         self.variable_id = variable_id
         self.value = value
+        self.future = future
 
     def __repr__(self):
         """Custom print for debugging purpose."""
@@ -52,119 +103,370 @@ class Operation:
 
 class TransactionManager:
     """Transaction Manager class."""
-    parser = Parser()
-    transaction_table = {}  # {transaction_id: Transaction}
-    ts = 0  # timestamp
-    operation_queue = []  # list of Operations
 
-    def __init__(self):
+    def __init__(self, policy=ConcurrencyPolicy.DETECTION, topology=None,
+                 gc_interval=50, sink=None, wal_dir=None,
+                 wal_sync=SyncPolicy.GROUP, wal_group_ticks=1,
+                 recovery=RecoveryMode.WAIT_FOR_WRITE,
+                 replica_selection=ReplicaSelection.FIRST, seed=0):
         """
-        Initialize all data managers.
+        Initialize all data managers and the waits-for graph among
+        transactions, which is updated as their lock tables change.
+        All the state is owned by the instance, so several transaction
+        managers can run in the same process.
+        :param policy: the ConcurrencyPolicy for deadlocks. With a prevention
+         policy (wait-die or wound-wait) no waits-for graph is built.
+        :param topology: the Topology of the cluster (default: 10 sites and
+         20 variables)
+        :param gc_interval: garbage collection of old versions. Versions no
+         active read-only transaction can read are dropped when a variable is
+         committed, and all variables are swept at most every gc_interval
+         ticks after the oldest read-only transaction ends. None keeps every
+         version.
+        :param sink: the EventSink receiving the output of the simulation
+         (default: an unbuffered TextSink on the standard output)
+        :param wal_dir: directory of the write-ahead logs of the sites, one
+         file per site (default: no log, failures keep the data in memory)
+        :param wal_sync: the SyncPolicy of the logs. With group commit, the
+         commits of wal_group_ticks consecutive ticks share one fsync.
+        :param wal_group_ticks: number of ticks per group commit
+        :param recovery: the RecoveryMode of the sites
+        :param replica_selection: the ReplicaSelection of reads
+        :param seed: seed of the random ReplicaSelection
         """
+        self.policy = policy
+        self.sink = sink or TextSink(buffer_size=0)
+        self.topology = topology or Topology()
+        self.gc_interval = gc_interval
+        self.wal_dir = wal_dir
+        self.wal_sync = wal_sync
+        self.wal_group_ticks = wal_group_ticks
+        self.recovery = recovery
+        self.replica_selection = replica_selection
+        self.seed = seed
         self.data_manager_list = []
-        for site_id in range(1, 11):
-            self.data_manager_list.append(DataManager(site_id))
+        self.client = Client(self)
+        self.reset()
+
+    def reset(self, sink=None):
+        """
+        Discard all transactions, operations and data, and start again from
+        timestamp 0 with the same policy and topology, so the instance can
+        run another input. Data managers and the parser are created anew, so
+        a Profiler has to be attached again.
+        :param sink: the EventSink for the next input (optional, default:
+         keep the current sink)
+        """
+        if sink:
+            self.sink = sink
+        self.parser = Parser()
+        self.transaction_table = {}  # {transaction_id: Transaction}
+        self.ts = 0  # timestamp
+        self.next_seq = 0  # begin order of the next transaction
+        self.operation_queue = {}  # {op_id: Operation}, in arrival order
+        self.next_op_id = 0
+        # Blocked operations are parked on the variable they wait for, and
+        # only retried after a data manager reports a change of that variable.
+        self.waiting_op_ids = defaultdict(list)  # {variable_id: [op_id]}
+        self.ready_op_ids = []  # heap of op_ids to retry in the next pass
+        self.deferred_op_ids = []  # op_ids woken behind the running pass
+        self.current_op_id = None  # op_id being executed by the running pass
+        self.read_only_ts = {}  # {transaction_id: ts} of active RO, by age
+        self.gc_pending = False  # the oldest RO transaction has ended
+        self.last_gc_ts = 0
+        if self.policy == ConcurrencyPolicy.DETECTION:
+            self.waits_for = WaitsForGraph()
+        else:
+            self.waits_for = None
+        self.prevention_victims = []  # aborted if current operation fails
+        # Placement index: the sites storing each accessed variable, as
+        # (site bit, DataManager), and a bitmap of the sites that are up
+        # (bit site_id - 1) that fail and recover keep current.
+        self.replica_index = {}  # {variable_id: [(site bit, DataManager)]}
+        self.up_sites = (1 << self.topology.num_sites) - 1
+        self.next_replica = 0  # round-robin position of the next read
+        self.replica_random = random.Random(self.seed)
+        self.close_logs()
+        self.data_manager_list = []
+        for site_id in range(1, self.topology.num_sites + 1):
+            wal = None
+            if self.wal_dir:
+                wal = WriteAheadLog(
+                    os.path.join(self.wal_dir, "site{}.wal".format(site_id)),
+                    self.wal_sync)
+            self.data_manager_list.append(
+                DataManager(site_id, self, self.topology, wal))
+
+    def __getstate__(self):
+        """
+        State saved by a checkpoint: everything but the sink, the client and
+        the methods wrapped by a Profiler.
+        """
+        return unwrapped_state(self, ("sink", "client"))
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.sink = TextSink(buffer_size=0)
+        self.client = Client(self)
 
     def process_line(self, line):
         """Core simulation process.
-        Parse input, resolve deadlock, process instructions and operations.
+        Parse input, resolve deadlock, process instructions and operations,
+        through the typed API of `self.client` (see client.py).
         :param line: one line of instruction
         :return: True if success, False if instruction is invalid
         """
-        li = self.parser.parse_line(line)
-        if li:
-            command = li.pop(0)
-            try:
-                print("----- Timestamp: " + str(self.ts) + " -----")
-                if self.resolve_deadlock():
-                    self.execute_operation_queue()
-                self.process_instruction(command, li)
+        return self.client.process_line(line)
+
+    def tick(self, instruction, *args):
+        """
+        Advance the simulation by one time step: resolve deadlock, execute
+        the instruction and the operation queue, then collect old versions.
+        The timestamp is not advanced if the instruction is invalid.
+        :param instruction: the method executing the instruction (e.g.
+         `begin` or `add_read_operation`)
+        :param args: the arguments of the instruction
+        :return: the result of the instruction
+        """
+        self.sink.emit("tick", self.ts)
+        if self.resolve_deadlock():
+            self.execute_operation_queue()
+        result = instruction(*args)
+        self.execute_operation_queue()
+        self.finish_tick()
+        return result
+
+    def tick_batch(self, instructions, final_instructions=()):
+        """
+        Advance the simulation by one time step executing several
+        instructions, with a single deadlock resolution and a single pass of
+        the operation queue after them. Final instructions (e.g. `end`) run
+        after that pass, followed by another pass for the operations they
+        unblock. An invalid instruction does not stop the others.
+        :param instructions: list of (instruction, args), see `tick`
+        :param final_instructions: list of (instruction, args)
+        :return: list of the results of the instructions, then of the final
+         ones, with the InvalidInstructionError of an invalid one
+        """
+        self.sink.emit("tick", self.ts)
+        if self.resolve_deadlock():
+            self.execute_operation_queue()
+        results = []
+        for idx, (instruction, args) in enumerate(
+                list(instructions) + list(final_instructions)):
+            if idx == len(instructions):
                 self.execute_operation_queue()
-                self.ts += 1
+            try:
+                results.append(instruction(*args))
             except InvalidInstructionError as e:
-                print("[INVALID_INSTRUCTION] " + e.message +
-                      ": " + line.strip())
-                return False
-            # finally:
-            #     print()
-        return True
-
-    def process_instruction(self, command, args):
-        """
-        Process an instruction.
-        If the instruction is Read or Write, add it to the operation queue.
-        Otherwise, execute the instruction directly.
-        :param command: "begin", "beginRO", "R", "W", "dump", "end", "fail",
-         or "recover"
-        :param args: list of arguments for a command
-        """
-        if command == "begin":
-            self.begin(args[0])
-        elif command == "beginRO":
-            self.beginro(args[0])
-        elif command == "R":
-            self.add_read_operation(args[0], args[1])
-        elif command == "W":
-            self.add_write_operation(args[0], args[1], args[2])
-        elif command == "dump":
-            self.dump()
-        elif command == "end":
-            self.end(args[0])
-        elif command == "fail":
-            self.fail(int(args[0]))
-        elif command == "recover":
-            self.recover(int(args[0]))
-        else:
-            raise InvalidInstructionError("Unknown instruction")
+                results.append(e)
+        self.execute_operation_queue()
+        self.finish_tick()
+        return results
 
-    def add_read_operation(self, transaction_id, variable_id):
+    def finish_tick(self):
+        """
+        End the current time step: collect old versions if due, sync the
+        write-ahead logs at the end of a group commit, and advance the
+        timestamp.
+        """
+        if self.gc_pending and \
+                self.ts - self.last_gc_ts >= self.gc_interval:
+            self.collect_versions()
+        if self.wal_dir and (self.ts + 1) % self.wal_group_ticks == 0:
+            self.sync_logs()
+        self.ts += 1
+
+    def add_read_operation(self, transaction_id, variable_id, future=None):
         """
         Insert a Read Operation to the operation queue
         :param transaction_id: the id of the transaction performing this op
         :param variable_id: the id of the variable
+        :param future: OperationFuture set to the value read (optional)
         """
         if not self.transaction_table.get(transaction_id):
             raise InvalidInstructionError(
                 "Transaction {} does not exist".format(transaction_id))
-        self.operation_queue.append(
-            Operation("R", transaction_id, variable_id))
+        self.add_operation(Operation(
+            self.next_op_id, "R", transaction_id, variable_id, None, future))
 
-    def add_write_operation(self, transaction_id, variable_id, value):
+    def add_write_operation(self, transaction_id, variable_id, value,
+                            future=None):
         """
         Insert a Write Operation to the operation queue
         :param transaction_id: the id of the transaction performing this op
         :param variable_id: the id of the variable
         :param value: write value
+        :param future: OperationFuture set to the list of the sites written
+         (optional)
         """
         if not self.transaction_table.get(transaction_id):
             raise InvalidInstructionError(
                 "Transaction {} does not exist".format(transaction_id))
-        self.operation_queue.append(
-            Operation("W", transaction_id, variable_id, value))
+        self.add_operation(Operation(
+            self.next_op_id, "W", transaction_id, variable_id, value,
+            future))
+
+    def add_operation(self, op):
+        """
+        Insert an Operation to the operation queue and schedule it for the
+        next pass.
+        :param op: the new Operation
+        """
+        self.next_op_id += 1
+        self.operation_queue[op.op_id] = op
+        self.transaction_table[op.transaction_id].pending_op_ids.add(op.op_id)
+        heapq.heappush(self.ready_op_ids, op.op_id)
+
+    def drop_operations(self, transaction_id):
+        """
+        Remove all queued operations of a transaction that has ended, and
+        cancel their futures.
+        :param transaction_id: the id of the transaction
+        """
+        for op_id in self.transaction_table[transaction_id].pending_op_ids:
+            op = self.operation_queue.pop(op_id, None)
+            if op and op.future:
+                op.future.cancel()
+
+    def has_pending_operations(self, transaction_id):
+        """
+        :param transaction_id: the id of the transaction
+        :return: boolean value to indicate if the transaction has operations
+         waiting in the operation queue
+        """
+        transaction = self.transaction_table.get(transaction_id)
+        return bool(transaction and transaction.pending_op_ids)
 
     def execute_operation_queue(self):
-        """Go through operation queue and execute any executable operations."""
-        for op in list(self.operation_queue):
-            if not self.transaction_table.get(op.transaction_id):
-                self.operation_queue.remove(op)
-            else:
-                success = False
-                if op.command == "R":
-                    if self.transaction_table[op.transaction_id].is_ro:
-                        success = self.read_snapshot(op.transaction_id,
-                                                     op.variable_id)
-                    else:
-                        success = self.read(op.transaction_id, op.variable_id)
-                elif op.command == "W":
-                    success = self.write(op.transaction_id, op.variable_id,
-                                         op.value)
+        """
+        Execute the operations that may have become executable, in arrival
+        order. Operations that fail are parked on their variable until a data
+        manager reports a change of it (see `on_variable_change`).
+        """
+        self.start_operation_pass()
+        op = self.next_ready_operation()
+        while op:
+            success = False
+            if op.command == "R":
+                if self.transaction_table[op.transaction_id].is_ro:
+                    success = self.read_snapshot(op.transaction_id,
+                                                 op.variable_id)
                 else:
-                    print("Invalid operation!")
-                if success:
-                    # print("Executed op: {}".format(op))
-                    self.operation_queue.remove(op)
+                    success = self.read(op.transaction_id, op.variable_id)
+            elif op.command == "W":
+                success = self.write(op.transaction_id, op.variable_id,
+                                     op.value)
+            else:
+                self.sink.emit("invalid_operation", op.op_id)
+            self.finish_operation(op, success)
+            op = self.next_ready_operation()
         # print("Remaining ops: {}".format(self.operation_queue))
 
+    def start_operation_pass(self):
+        """
+        Schedule the operations woken behind the previous pass.
+        """
+        for op_id in self.deferred_op_ids:
+            heapq.heappush(self.ready_op_ids, op_id)
+        self.deferred_op_ids = []
+
+    def next_ready_operation(self):
+        """
+        :return: the next Operation of the running pass, in arrival order, or
+         None at the end of the pass
+        """
+        while self.ready_op_ids:
+            op_id = heapq.heappop(self.ready_op_ids)
+            op = self.operation_queue.get(op_id)
+            if op:  # otherwise the transaction has ended
+                self.current_op_id = op_id
+                return op
+        self.current_op_id = None
+        return None
+
+    def finish_operation(self, op, success):
+        """
+        Remove an Operation that succeeded from the queue, or park it on its
+        variable, then abort the victims of the prevention policy.
+        :param op: the Operation
+        :param success: boolean value to indicate if it was executed
+        """
+        if success:
+            # print("Executed op: {}".format(op))
+            self.operation_queue.pop(op.op_id)
+            self.transaction_table[
+                op.transaction_id].pending_op_ids.discard(op.op_id)
+        else:
+            self.waiting_op_ids[op.variable_id].append(op.op_id)
+        if self.prevention_victims:
+            victims = self.prevention_victims
+            self.prevention_victims = []
+            if not success:
+                for victim in victims:
+                    if self.transaction_table.get(victim):
+                        self.abort(victim, self.policy.value)
+
+    def wake_operations(self, variable_id):
+        """
+        Schedule the operations parked on a variable to be retried.
+        Operations behind the running pass are retried in this pass, the
+        others in the next pass, the same order as rescanning the whole queue.
+        :param variable_id: the id of the variable
+        """
+        for op_id in self.waiting_op_ids.pop(variable_id, ()):
+            if op_id not in self.operation_queue:
+                continue
+            if self.current_op_id is not None and op_id < self.current_op_id:
+                self.deferred_op_ids.append(op_id)
+            else:
+                heapq.heappush(self.ready_op_ids, op_id)
+
+    def on_variable_change(self, site_id, variable_id):
+        """Called by a data manager when a variable's state has changed."""
+        if self.waits_for:
+            lm = self.data_manager_list[site_id - 1].lock_table.get(
+                variable_id)
+            self.waits_for.update(site_id, variable_id,
+                                  lm.blocking_edges() if lm else set())
+        self.wake_operations(variable_id)
+
+    def on_site_change(self, site_id):
+        """Called by a data manager when it fails or recovers."""
+        dm = self.data_manager_list[site_id - 1]
+        if self.waits_for and not dm.is_up:
+            # lock table of the site is cleared
+            self.waits_for.clear_site(site_id)
+        for variable_id in list(self.waiting_op_ids):
+            if dm.has_variable(variable_id):
+                self.wake_operations(variable_id)
+
+    def on_lock_queued(self, site_id, lm, transaction_id):
+        """
+        Called by a data manager when a transaction has to wait in the lock
+        queue of a variable. Apply the deadlock prevention policy, if any,
+        against the transactions it waits for. Victims are aborted after the
+        operation, if it fails.
+        :param site_id: the id of the site
+        :param lm: the LockManager of the variable
+        :param transaction_id: the id of the waiting transaction
+        """
+        if self.policy == ConcurrencyPolicy.DETECTION:
+            return
+        age = self.transaction_table[transaction_id].age()
+        blockers = [holder for waiter, holder in lm.blocking_edges()
+                    if waiter == transaction_id]
+        if self.policy == ConcurrencyPolicy.WAIT_DIE:
+            # wait only for younger transactions, otherwise die
+            if any(self.transaction_table[t_id].age() < age
+                   for t_id in blockers):
+                self.prevention_victims.append(transaction_id)
+        else:
+            # wound younger transactions, wait for older ones
+            for t_id in sorted(blockers):
+                if self.transaction_table[t_id].age() > age:
+                    self.prevention_victims.append(t_id)
+
     # -----------------------------------------------------
     # -------------- Instruction Executions ---------------
     # -----------------------------------------------------
@@ -173,119 +475,322 @@ class TransactionManager:
             raise InvalidInstructionError(
                 "{} already exists".format(transaction_id))
         self.transaction_table[transaction_id] = Transaction(
-            self.ts, transaction_id, False)
-        print("{} begins".format(transaction_id))
+            self.ts, self.next_seq, transaction_id, False)
+        self.next_seq += 1
+        self.sink.emit("begin", transaction_id)
 
     def beginro(self, transaction_id):
         if self.transaction_table.get(transaction_id):
             raise InvalidInstructionError(
                 "{} already exists".format(transaction_id))
         self.transaction_table[transaction_id] = Transaction(
-            self.ts, transaction_id, True)
-        print("{} begins and is read-only".format(transaction_id))
+            self.ts, self.next_seq, transaction_id, True)
+        self.next_seq += 1
+        self.read_only_ts[transaction_id] = self.ts
+        self.sink.emit("begin_ro", transaction_id)
+
+    def get_live_replicas(self, variable_id):
+        """
+        :param variable_id: variable's id
+        :return: the DataManagers that are up and store the variable, in
+         site order
+        """
+        replicas = self.replica_index.get(variable_id)
+        if replicas is None:
+            v_idx = self.topology.variable_index(variable_id)
+            if v_idx is None:
+                return []
+            replicas = [(1 << (site_id - 1),
+                         self.data_manager_list[site_id - 1])
+                        for site_id in self.topology.sites_of(v_idx)]
+            self.replica_index[variable_id] = replicas
+        up_sites = self.up_sites
+        return [dm for site_bit, dm in replicas if up_sites & site_bit]
+
+    def get_read_replicas(self, transaction, variable_id):
+        """
+        :param transaction: the Transaction reading the variable
+        :param variable_id: variable's id
+        :return: the DataManagers that are up and store the variable, in the
+         order the read tries them (see ReplicaSelection)
+        """
+        replicas = self.get_live_replicas(variable_id)
+        selection = self.replica_selection
+        if len(replicas) < 2 or selection == ReplicaSelection.FIRST:
+            return replicas
+        if selection == ReplicaSelection.LEAST_QUEUED:
+            # ties go to the site that served fewer reads, then site order
+            return sorted(replicas, key=lambda dm: (
+                dm.count_queued_locks(variable_id), dm.reads_served))
+        if selection == ReplicaSelection.RANDOM:
+            self.replica_random.shuffle(replicas)
+            return replicas
+        if selection == ReplicaSelection.STICKY and \
+                transaction.read_site_id is not None:
+            for idx, dm in enumerate(replicas):
+                if dm.site_id == transaction.read_site_id:
+                    return [dm] + replicas[:idx] + replicas[idx + 1:]
+        # round-robin, also spreads the first reads of sticky transactions
+        start = self.next_replica % len(replicas)
+        self.next_replica += 1
+        return replicas[start:] + replicas[:start]
 
     def read_snapshot(self, transaction_id, variable_id):
         """Perform read operation for read-only transactions."""
-        if not self.transaction_table.get(transaction_id):
+        t = self.transaction_table.get(transaction_id)
+        if not t:
             raise InvalidInstructionError(
                 "Transaction {} does not exist".format(transaction_id))
-        ts = self.transaction_table[transaction_id].ts
-        for dm in self.data_manager_list:
-            if dm.is_up and dm.has_variable(variable_id):
-                # pass the transaction's begin time into each data manager
-                # when doing read-only
-                result = dm.read_snapshot(variable_id, ts)
-                if result.success:
-                    print("{} (RO) reads {}.{}: {}".format(
-                        transaction_id, variable_id, dm.site_id, result.value))
-                    return True
+        for dm in self.get_read_replicas(t, variable_id):
+            # pass the transaction's begin time into each data manager
+            # when doing read-only
+            result = dm.read_snapshot(variable_id, t.ts)
+            if result.success:
+                self.record_read(t, dm, variable_id, result.value)
+                return True
         return False
 
     def read(self, transaction_id, variable_id):
         """Perform read operation for normal transactions."""
-        if not self.transaction_table.get(transaction_id):
+        t = self.transaction_table.get(transaction_id)
+        if not t:
             raise InvalidInstructionError(
                 "Transaction {} does not exist".format(transaction_id))
-        for dm in self.data_manager_list:
-            if dm.is_up and dm.has_variable(variable_id):
-                result = dm.read(transaction_id, variable_id)
-                if result.success:
-                    self.transaction_table[
-                        transaction_id].sites_accessed.append(dm.site_id)
-                    print("{} reads {}.{}: {}".format(
-                        transaction_id, variable_id, dm.site_id, result.value))
-                    return True
+        replicas = self.get_read_replicas(t, variable_id)
+        for dm in replicas:
+            t.lock_sites.add(dm.site_id)
+            result = dm.read(transaction_id, variable_id)
+            if result.success:
+                # the read may wait at other sites since an earlier try
+                for other_dm in replicas:
+                    if other_dm is not dm:
+                        other_dm.withdraw_read(transaction_id, variable_id)
+                self.record_read(t, dm, variable_id, result.value)
+                return True
         return False
 
+    def record_read(self, transaction, dm, variable_id, value):
+        """
+        Account for a successful read and report it.
+        :param transaction: the reading Transaction
+        :param dm: the DataManager of the site that served the read
+        :param variable_id: variable's id
+        :param value: the value read
+        """
+        dm.reads_served += 1
+        self.resolve_current_operation(value)
+        if transaction.read_site_id is None:
+            transaction.read_site_id = dm.site_id
+        if transaction.is_ro:
+            self.sink.emit("read_snapshot", transaction.transaction_id,
+                           variable_id, dm.site_id, value)
+        else:
+            transaction.sites_accessed.append(dm.site_id)
+            self.sink.emit("read", transaction.transaction_id, variable_id,
+                           dm.site_id, value)
+
     def write(self, transaction_id, variable_id, value):
-        if not self.transaction_table.get(transaction_id):
+        t = self.transaction_table.get(transaction_id)
+        if not t:
             raise InvalidInstructionError(
                 "Transaction {} does not exist".format(transaction_id))
-        all_relevant_sites_down = True
+        replicas = self.get_live_replicas(variable_id)
         can_get_all_write_locks = True
-        for dm in self.data_manager_list:
-            if dm.is_up and dm.has_variable(variable_id):
-                # check if all the relevant sites are down now
-                all_relevant_sites_down = False
-                result = dm.get_write_lock(transaction_id, variable_id)
-                if not result:
-                    can_get_all_write_locks = False
-
-        if not all_relevant_sites_down and can_get_all_write_locks:
-            # print("{} will write {} with value {}".format(
-            #     transaction_id, variable_id, value))
-            sites_written = []
-            for dm in self.data_manager_list:
-                if dm.is_up and dm.has_variable(variable_id):
-                    dm.write(transaction_id, variable_id, value)
-                    self.transaction_table[
-                        transaction_id].sites_accessed.append(dm.site_id)
-                    sites_written.append(dm.site_id)
-            print("{} writes {} with value {} to sites {}".format(
-                transaction_id, variable_id, value, sites_written))
+        for dm in replicas:
+            t.lock_sites.add(dm.site_id)
+            if not dm.get_write_lock(transaction_id, variable_id):
+                can_get_all_write_locks = False
+
+        # at least one relevant site must be up
+        if replicas and can_get_all_write_locks:
+            for dm in replicas:
+                dm.write(transaction_id, variable_id, value)
+            self.record_write(t, replicas, variable_id, value)
             return True
         return False
 
+    def record_write(self, transaction, replicas, variable_id, value):
+        """
+        Account for a successful write and report it.
+        :param transaction: the writing Transaction
+        :param replicas: the DataManagers of the sites written
+        :param variable_id: variable's id
+        :param value: the value written
+        """
+        sites_written = [dm.site_id for dm in replicas]
+        transaction.sites_accessed.extend(sites_written)
+        self.resolve_current_operation(sites_written)
+        self.sink.emit("write", transaction.transaction_id, variable_id,
+                       value, sites_written)
+
+    def resolve_current_operation(self, result):
+        """
+        Set the future of the operation being executed, if it has one.
+        :param result: the result of the operation
+        """
+        op = self.operation_queue.get(self.current_op_id)
+        if op is not None and op.future:
+            op.future.set_result(result)
+
     def dump(self):
-        print("Dump:")
-        for dm in self.data_manager_list:
-            dm.dump()
+        """
+        :return: list of (site_id, is_up, [(variable_id, value), ...])
+        """
+        dumps = [dm.dump() for dm in self.data_manager_list]
+        self.sink.emit("dump", dumps)
+        return dumps
 
     def end(self, transaction_id):
-        """Commit or abort a transaction depending its status."""
+        """
+        Commit or abort a transaction depending its status.
+        :return: True if it committed, False if it aborted
+        """
         if not self.transaction_table.get(transaction_id):
             raise InvalidInstructionError(
                 "Transaction {} does not exist".format(transaction_id))
         if self.transaction_table[transaction_id].will_abort:
-            self.abort(transaction_id, True)
-        else:
-            self.commit(transaction_id, self.ts)
+            self.abort(transaction_id, "site failure")
+            return False
+        self.check_no_queued_locks(self.transaction_table[transaction_id])
+        self.commit(transaction_id, self.ts)
+        return True
 
-    def abort(self, transaction_id, due_to_site_fail=False):
-        """Abort a transaction."""
-        for dm in self.data_manager_list:
-            dm.abort(transaction_id)
-        self.transaction_table.pop(transaction_id)
-        if due_to_site_fail:
-            print("{} aborts! (due to site failure)".format(transaction_id))
-        else:
-            print("{} aborts! (due to deadlock)".format(transaction_id))
+    def check_no_queued_locks(self, transaction):
+        """
+        A transaction cannot commit while one of its operations waits in the
+        lock queue of a site, e.g. when a pipelining client ends it early.
+        Nothing is changed then.
+        :param transaction: the Transaction to commit
+        :raise InvalidInstructionError: if it has a queued lock
+        """
+        for site_id in sorted(transaction.lock_sites):
+            if self.data_manager_list[site_id - 1].has_queued_locks(
+                    transaction.transaction_id):
+                raise InvalidInstructionError(
+                    "Transaction {} has operations waiting for locks".format(
+                        transaction.transaction_id))
+
+    def abort(self, transaction_id, reason="deadlock"):
+        """
+        Abort a transaction.
+        :param reason: "deadlock", "site failure", or the prevention policy
+        """
+        transaction = self.transaction_table[transaction_id]
+        for site_id in sorted(transaction.lock_sites):
+            self.data_manager_list[site_id - 1].abort(transaction_id)
+        self.remove_transaction(transaction_id)
+        self.sink.emit("abort", transaction_id, reason)
 
     def commit(self, transaction_id, commit_ts):
         """Commit a transaction."""
-        for dm in self.data_manager_list:
-            dm.commit(transaction_id, commit_ts)
+        transaction = self.transaction_table[transaction_id]
+        gc_horizon_ts = self.prepare_commit(transaction)
+        for site_id in sorted(transaction.lock_sites):
+            self.data_manager_list[site_id - 1].commit(
+                transaction_id, commit_ts, gc_horizon_ts)
+        self.remove_transaction(transaction_id)
+        self.sink.emit("commit", transaction_id)
+
+    def prepare_commit(self, transaction):
+        """
+        Retire a committing read-only transaction from the garbage collection
+        horizon.
+        :param transaction: the committing Transaction
+        :return: the garbage collection horizon for the commit at the sites
+        """
+        if transaction.is_ro:
+            oldest_ro = next(iter(self.read_only_ts))
+            self.read_only_ts.pop(transaction.transaction_id)
+            if self.gc_interval is not None and \
+                    transaction.transaction_id == oldest_ro:
+                # more versions may be dropped now
+                self.gc_pending = True
+        return self.get_gc_horizon_ts()
+
+    def remove_transaction(self, transaction_id):
+        """
+        Forget a transaction that has committed or aborted at its sites.
+        :param transaction_id: the id of the transaction
+        """
+        self.drop_operations(transaction_id)
         self.transaction_table.pop(transaction_id)
-        print("{} commits!".format(transaction_id))
+
+    # -----------------------------------------------------
+    # -------------- Version Garbage Collection -----------
+    # -----------------------------------------------------
+    def get_gc_horizon_ts(self):
+        """
+        :return: the timestamp before which versions can be dropped (except
+         the latest one before it), or None if garbage collection is disabled
+        """
+        if self.gc_interval is None:
+            return None
+        for ts in self.read_only_ts.values():
+            # begin time of the oldest active read-only transaction
+            return ts
+        return self.ts
+
+    def collect_versions(self):
+        """Drop the versions no transaction can read at all sites."""
+        horizon_ts = self.get_gc_horizon_ts()
+        if horizon_ts is not None:
+            for dm in self.data_manager_list:
+                dm.collect_versions(horizon_ts)
+        self.gc_pending = False
+        self.last_gc_ts = self.ts
+
+    def version_stats(self):
+        """
+        :return: dict with the number of committed versions retained and
+         reclaimed by garbage collection over all sites
+        """
+        return {
+            "retained": sum(dm.count_versions()
+                            for dm in self.data_manager_list),
+            "reclaimed": sum(dm.versions_reclaimed
+                             for dm in self.data_manager_list),
+        }
+
+    # -----------------------------------------------------
+    # ---------------- Write-Ahead Logs -------------------
+    # -----------------------------------------------------
+    def sync_logs(self):
+        """Group commit: make the commits logged so far durable."""
+        for dm in self.data_manager_list:
+            if dm.wal:
+                dm.wal.sync()
+
+    def close_logs(self):
+        """Sync and close the write-ahead logs of the sites."""
+        for dm in self.data_manager_list:
+            if dm.wal:
+                dm.wal.close()
+
+    def read_stats(self):
+        """
+        :return: dict {site_id: number of reads served by the site}
+        """
+        return {dm.site_id: dm.reads_served for dm in self.data_manager_list}
+
+    def get_data_manager(self, site_id):
+        """
+        :param site_id: the id of the site
+        :return: the DataManager of the site
+        """
+        if not 1 <= site_id <= len(self.data_manager_list):
+            raise InvalidInstructionError(
+                "Site {} does not exist".format(site_id))
+        return self.data_manager_list[site_id - 1]
 
     def fail(self, site_id):
         """Site fails."""
-        dm = self.data_manager_list[site_id - 1]
+        dm = self.get_data_manager(site_id)
         if not dm.is_up:
             raise InvalidInstructionError(
                 "Site {} is already down".format(site_id))
+        self.up_sites &= ~(1 << (site_id - 1))
         dm.fail(self.ts)
-        print("Site {} fails".format(site_id))
+        self.sink.emit("fail", site_id)
         for t in self.transaction_table.values():
             if (not t.is_ro) and (not t.will_abort) and (
                     site_id in t.sites_accessed):
@@ -295,51 +800,82 @@ class TransactionManager:
 
     def recover(self, site_id):
         """Site recovers."""
-        dm = self.data_manager_list[site_id - 1]
+        dm = self.get_data_manager(site_id)
         if dm.is_up:
             raise InvalidInstructionError(
                 "Site {} is already up".format(site_id))
-        dm.recover(self.ts)
-        print("Site {} recovers".format(site_id))
+        self.up_sites |= 1 << (site_id - 1)
+        dm.recover(self.ts, self.get_gc_horizon_ts())
+        self.sink.emit("recover", site_id)
+        if self.recovery == RecoveryMode.CATCH_UP:
+            self.catch_up(dm)
+
+    def catch_up(self, dm):
+        """
+        Copy the latest committed versions of the replicated variables of a
+        recovered site from the other sites that are up, in one transfer.
+        Like a committed write, a copy makes the variable readable again.
+        Variables a transaction holds a W-lock on, or that no site can
+        serve, stay unreadable until the next committed write.
+        :param dm: the DataManager of the recovered site
+        """
+        start = time.perf_counter()
+        versions = {}  # {variable_id: CommitValue}
+        source_site_ids = set()
+        skipped = []
+        for v_idx in self.topology.variables_at_site(dm.site_id):
+            if not self.topology.is_replicated(v_idx):
+                continue
+            variable_id = "x" + str(v_idx)
+            version = None
+            for peer in self.get_live_replicas(variable_id):
+                if peer is dm:
+                    continue
+                if peer.has_write_lock(variable_id):
+                    # the pending write would not reach the recovered site
+                    version = None
+                    break
+                if not version:
+                    version = peer.get_catch_up_version(variable_id)
+                    source_site_id = peer.site_id
+            if version:
+                versions[variable_id] = version
+                source_site_ids.add(source_site_id)
+            else:
+                skipped.append(variable_id)
+        dm.catch_up(versions, not skipped)
+        self.sink.emit("catch_up", dm.site_id, len(versions),
+                       sorted(source_site_ids), skipped,
+                       time.perf_counter() - start)
 
     # -----------------------------------------------------
     # ---------------- Deadlock Detection -----------------
     # -----------------------------------------------------
     def resolve_deadlock(self):
         """
-        Detect deadlocks using cycle detection and abort the youngest
-        transaction in the cycle.
+        Resolve deadlocks if a cycle has been detected in the waits-for graph.
+        All cycles are found in one pass as strongly connected components, and
+        the youngest transaction of each component is aborted, until no cycle
+        remains.
         :return: True if a deadlock is resolved, False if no deadlock detected
         """
-        blocking_graph = defaultdict(set)
-        for dm in self.data_manager_list:
-            if dm.is_up:
-                graph = dm.generate_blocking_graph()
-                for node, adj_list in graph.items():
-                    blocking_graph[node].update(adj_list)
-        # print(dict(blocking_graph))
-        youngest_t_id = None
-        youngest_ts = -1
-        for node in list(blocking_graph.keys()):
-            visited = set()
-            if has_cycle(node, node, visited, blocking_graph):
-                if self.transaction_table[node].ts > youngest_ts:
-                    youngest_t_id = node
-                    youngest_ts = self.transaction_table[node].ts
-        if youngest_t_id:
-            print("Deadlock detected: aborting {}".format(youngest_t_id))
-            self.abort(youngest_t_id)
-            return True
-        return False
-
-
-def has_cycle(current, root, visited, blocking_graph):
-    """Helper function that detects cycle in blocking graph using dfs."""
-    visited.add(current)
-    for neighbour in blocking_graph[current]:
-        if neighbour == root:
-            return True
-        if neighbour not in visited:
-            if has_cycle(neighbour, root, visited, blocking_graph):
-                return True
-    return False
+        if not self.waits_for or not self.waits_for.cycle_detected:
+            return False
+        resolved = False
+        components = self.waits_for.find_cycles()
+        while components:
+            victims = [max(component,
+                           key=lambda t_id: self.transaction_table[t_id].age())
+                       for component in components]
+            victims.sort(key=lambda t_id: self.transaction_table[t_id].age(),
+                         reverse=True)
+            for victim in victims:
+                # an earlier abort may have broken this cycle already
+                if not self.waits_for.can_reach(victim, victim):
+                    continue
+                self.sink.emit("deadlock", victim)
+                self.abort(victim)
+                resolved = True
+            components = self.waits_for.find_cycles()
+        self.waits_for.cycle_detected = False
+        return resolved
@@ -0,0 +1,153 @@
+from collections import defaultdict
+from profiler import unwrapped_state
+
+
+class WaitsForGraph:
+    """
+    Waits-for graph among transactions, kept up to date incrementally.
+    Each lock manager contributes a set of edges (waiter, holder); an edge
+    exists in the graph as long as at least one lock manager contributes it.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty WaitsForGraph instance.
+        """
+        self.adj = defaultdict(dict)  # {waiter: {holder: contributor count}}
+        # {site_id: {variable_id: set of edges contributed}}
+        self.contributions = defaultdict(dict)
+        self.cycle_detected = False  # set when a new edge closes a cycle
+
+    def __getstate__(self):
+        """
+        State saved by a checkpoint, see `profiler.unwrapped_state`.
+        """
+        return unwrapped_state(self)
+
+    def update(self, site_id, variable_id, edges):
+        """
+        Replace the edges contributed by the lock manager of a variable.
+        :param site_id: the id of the site of the lock manager
+        :param variable_id: the id of the variable of the lock manager
+        :param edges: set of (waiter, holder) edges
+        """
+        site_contributions = self.contributions[site_id]
+        old_edges = site_contributions.get(variable_id, set())
+        if edges:
+            site_contributions[variable_id] = edges
+        else:
+            site_contributions.pop(variable_id, None)
+        for edge in old_edges - edges:
+            self.remove_edge(*edge)
+        for edge in edges - old_edges:
+            self.add_edge(*edge)
+
+    def clear_site(self, site_id):
+        """
+        Remove all edges contributed by the lock managers of a site.
+        :param site_id: the id of the site
+        """
+        for edges in self.contributions.pop(site_id, {}).values():
+            for edge in edges:
+                self.remove_edge(*edge)
+
+    def add_edge(self, waiter, holder):
+        """
+        Add one contribution of an edge. Check for a cycle when the edge is
+        new to the graph.
+        :param waiter: the id of the waiting transaction
+        :param holder: the id of the transaction being waited for
+        """
+        holders = self.adj[waiter]
+        count = holders.get(holder, 0)
+        holders[holder] = count + 1
+        if not count and not self.cycle_detected and \
+                self.can_reach(holder, waiter):
+            self.cycle_detected = True
+
+    def remove_edge(self, waiter, holder):
+        """
+        Remove one contribution of an edge.
+        :param waiter: the id of the waiting transaction
+        :param holder: the id of the transaction being waited for
+        """
+        holders = self.adj[waiter]
+        if holders[holder] == 1:
+            del holders[holder]
+            if not holders:
+                del self.adj[waiter]
+        else:
+            holders[holder] -= 1
+
+    def can_reach(self, source, target):
+        """
+        Check if there is a path from source to target, using an iterative
+        depth-first search.
+        :return: boolean value to indicate if target is reachable
+        """
+        visited = {source}
+        stack = [source]
+        while stack:
+            node = stack.pop()
+            for neighbour in self.adj.get(node, ()):
+                if neighbour == target:
+                    return True
+                if neighbour not in visited:
+                    visited.add(neighbour)
+                    stack.append(neighbour)
+        return False
+
+    def find_cycles(self):
+        """
+        Find all strongly connected components that contain a cycle in a
+        single pass (iterative Tarjan's algorithm).
+        :return: list of sets of transaction ids, one for each component
+        """
+        index_of = {}
+        low_link = {}
+        on_stack = set()
+        stack = []
+        components = []
+        next_index = 0
+        for root in list(self.adj):
+            if root in index_of:
+                continue
+            index_of[root] = low_link[root] = next_index
+            next_index += 1
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.adj.get(root, ())))]
+            while work:
+                node, neighbours = work[-1]
+                descended = False
+                for neighbour in neighbours:
+                    if neighbour not in index_of:
+                        index_of[neighbour] = low_link[neighbour] = next_index
+                        next_index += 1
+                        stack.append(neighbour)
+                        on_stack.add(neighbour)
+                        work.append(
+                            (neighbour, iter(self.adj.get(neighbour, ()))))
+                        descended = True
+                        break
+                    if neighbour in on_stack:
+                        low_link[node] = min(low_link[node],
+                                             index_of[neighbour])
+                if descended:
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low_link[parent] = min(low_link[parent], low_link[node])
+                if low_link[node] == index_of[node]:
+                    component = set()
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.add(member)
+                        if member == node:
+                            break
+                    # no self loops in the graph, so a cycle needs two nodes
+                    if len(component) > 1:
+                        components.append(component)
+        return components
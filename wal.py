@@ -0,0 +1,108 @@
+import json
+import os
+from enum import Enum
+
+
+class SyncPolicy(Enum):
+    """When the commit records of a write-ahead log are made durable."""
+    COMMIT = "commit"  # fsync after each commit record
+    GROUP = "group"  # one fsync for all the commits of a group of ticks
+    NONE = "none"  # leave the records to the operating system
+
+
+class WriteAheadLog:
+    """
+    Append-only log of the commits of one site, in a local file. Each line
+    is a JSON commit record {"ts": commit timestamp, "writes": [[variable_id,
+    value], ...]}, appended before the values are committed in memory.
+    """
+
+    def __init__(self, file_path, sync_policy=SyncPolicy.GROUP):
+        """
+        Initialize a WriteAheadLog instance, truncating the file.
+        :param file_path: path of the log file
+        :param sync_policy: the SyncPolicy
+        """
+        self.file_path = file_path
+        self.sync_policy = sync_policy
+        self.file = open(file_path, 'wb')
+        self.size = 0  # bytes written
+        self.unsynced = False  # records written since the last fsync
+        self.num_records = 0
+        self.num_syncs = 0
+
+    def __getstate__(self):
+        """
+        State saved by a checkpoint: everything but the open file.
+        """
+        self.sync()
+        state = dict(self.__dict__)
+        del state["file"]
+        return state
+
+    def __setstate__(self, state):
+        """
+        Reopen the log, dropping the records appended after the checkpoint.
+        """
+        self.__dict__.update(state)
+        self.file = open(self.file_path, 'r+b')
+        self.file.truncate(self.size)
+        self.file.seek(self.size)
+
+    def append_commit(self, commit_ts, writes):
+        """
+        Append the commit record of a transaction.
+        :param commit_ts: the timestamp of the commit
+        :param writes: list of (variable_id, value) committed at this site
+        """
+        record = json.dumps({"ts": commit_ts, "writes": writes}) + "\n"
+        data = record.encode("utf-8")
+        self.file.write(data)
+        self.size += len(data)
+        self.num_records += 1
+        self.unsynced = True
+        if self.sync_policy == SyncPolicy.COMMIT:
+            self.sync()
+
+    def sync(self):
+        """
+        Make the records appended so far durable, with a single fsync.
+        """
+        if not self.unsynced:
+            return
+        self.file.flush()
+        if self.sync_policy != SyncPolicy.NONE:
+            os.fsync(self.file.fileno())
+            self.num_syncs += 1
+        self.unsynced = False
+
+    def records(self):
+        """
+        Read the commit records back, in commit order. An incomplete last
+        record (torn write) is ignored.
+        :return: generator of (commit_ts, [(variable_id, value), ...])
+        """
+        self.file.flush()
+        with open(self.file_path, 'rb') as file:
+            for line in file:
+                try:
+                    record = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    return
+                yield record["ts"], record["writes"]
+
+    def latest_values(self):
+        """
+        :return: dict {variable_id: value} of the last committed values in
+         the log
+        """
+        values = {}
+        for _, writes in self.records():
+            for variable_id, value in writes:
+                values[variable_id] = value
+        return values
+
+    def close(self):
+        """Sync and close the log file."""
+        self.sync()
+        self.file.close()